@@ -1,6 +1,8 @@
+import hashlib
 import logging
 import traceback
 import uuid
+from django.conf import settings
 from django.utils.timezone import now
 from django.db import connection
 from django.core.exceptions import PermissionDenied
@@ -11,6 +13,10 @@ from custom_middlewares.request_context import set_current_request_id, clear_cur
 
 logger = logging.getLogger(__name__)
 
+# Bodies above this size are not read for logging, so uploads keep streaming
+# to disk instead of being buffered in memory by request.body
+MAX_LOGGED_BODY_SIZE = 64 * 1024
+
 class RequestAndErrorHandling:
     """
     Combined middleware that handles request logging and error handling.
@@ -32,10 +38,11 @@ class RequestAndErrorHandling:
         # Store request_id in request for use in views
         request.request_id = request_id
 
-        try:
-            body = request.body.decode('utf-8')
-        except Exception:
-            body = '<unable to decode body>'
+        # Identify the calling client for per-client scheduling and admission
+        request.client_ip = client_ip
+        request.client_id = self.get_client_id(request)
+
+        body = self.get_loggable_body(request)
 
         # Process the request
         try:
@@ -70,14 +77,52 @@ class RequestAndErrorHandling:
 
         return response
     
-    def process_exception(self, request, exception):
+    def get_client_id(self, request):
         """
-        Process exceptions that occur during request handling.
+        The authenticated user, else the client named by a known X-API-Key,
+        else the client address. Never a value the caller can pick freely,
+        which would let it multiply its fair share and admission quota.
+        """
+        user = getattr(request, 'user', None)  # Set by AuthenticationMiddleware
+        if user is not None and user.is_authenticated:
+            return f"user:{user.pk}"
+        api_key = request.META.get('HTTP_X_API_KEY')
+        if api_key:
+            client_name = settings.CLIENT_API_KEYS.get(hashlib.sha256(api_key.encode('utf-8')).hexdigest())
+            if client_name:
+                return f"key:{client_name}"
+        # The last TRUSTED_PROXY_COUNT X-Forwarded-For entries were added by our
+        # own proxies; anything before them is whatever the caller sent
+        forwarded = [ip.strip() for ip in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if ip.strip()]
+        if settings.TRUSTED_PROXY_COUNT and len(forwarded) >= settings.TRUSTED_PROXY_COUNT:
+            address = forwarded[-settings.TRUSTED_PROXY_COUNT]
+        else:
+            address = request.META.get('REMOTE_ADDR')
+        return f"ip:{address}" if address else ''
+
+    def get_loggable_body(self, request):
         """
+        Return the request body for logging without forcing uploads into memory.
+        """
+        content_type = request.META.get('CONTENT_TYPE', '')
+        if content_type.startswith('multipart/'):
+            return '<multipart body not logged>'
+        try:
+            content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = 0
+        if content_length > MAX_LOGGED_BODY_SIZE:
+            return f'<body of {content_length} bytes not logged>'
         try:
-            body = request.body.decode('utf-8')
+            return request.body.decode('utf-8')
         except Exception:
-            body = '<unable to decode body>'
+            return '<unable to decode body>'
+
+    def process_exception(self, request, exception):
+        """
+        Process exceptions that occur during request handling.
+        """
+        body = self.get_loggable_body(request)
 
         # Log the full error with traceback
         logger.error(
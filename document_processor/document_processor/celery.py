@@ -2,7 +2,10 @@ from __future__ import absolute_import, unicode_literals
 import os
 import logging
 from celery import Celery
-from celery.signals import after_setup_logger, after_setup_task_logger, task_success, task_failure, task_revoked, task_retry
+from celery.signals import (
+    after_setup_logger, after_setup_task_logger, task_success, task_failure, task_revoked, task_retry,
+    worker_process_shutdown
+)
 from celery.utils.log import get_task_logger
 from django.core.cache import cache
 from document_processor.settings.base import CELERY_LOG_DIR
@@ -70,4 +73,10 @@ def handle_task_retry(request, args, kwargs, eta, **kw):
 
 @task_revoked.connect
 def handle_task_revoked(request, **kw):
-    logger.warning(f"Task {request.id} was revoked")
\ No newline at end of file
+    logger.warning(f"Task {request.id} was revoked")
+
+@worker_process_shutdown.connect
+def handle_worker_process_shutdown(**kw):
+    # Write out documents still buffered in this process before it exits
+    from document_processor_app.write_buffer import flush_write_buffer
+    flush_write_buffer()
@@ -0,0 +1,141 @@
+"""
+Admission control for new document work.
+
+Before an upload is accepted the current backlog (tasks in the outbox, waiting
+to be dispatched or in flight) is compared with ADMISSION_MAX_BACKLOG and the client's own backlog
+with ADMISSION_MAX_CLIENT_BACKLOG. Over the limit, or while the broker is
+known to be down, the request is rejected with 429 and a Retry-After estimate
+derived from the observed drain rate. Nothing here ever sleeps on the
+request thread.
+"""
+import math
+import time
+
+from celery import current_app
+from celery.exceptions import OperationalError
+from django.conf import settings
+from django.core.cache import cache
+from django_redis import get_redis_connection
+
+from . import fair_scheduling, outbox
+
+BACKLOG_CACHE_KEY = 'admission:backlog'
+BROKER_DOWN_CACHE_KEY = 'admission:broker-down'
+DRAINED_KEY = 'admission:drained:{bucket}'
+DRAIN_BUCKET_SECONDS = 10
+
+
+class AdmissionRejected(Exception):
+    """Raised when new work cannot be accepted right now"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def clamp_retry_after(seconds):
+    seconds = max(settings.ADMISSION_MIN_RETRY_AFTER, min(seconds, settings.ADMISSION_MAX_RETRY_AFTER))
+    return int(math.ceil(seconds))
+
+
+def record_drained(count=1):
+    """Count finished document tasks into the current drain rate bucket"""
+    bucket = int(time.time() // DRAIN_BUCKET_SECONDS)
+    key = DRAINED_KEY.format(bucket=bucket)
+    redis = get_redis_connection('default')
+    pipe = redis.pipeline()
+    pipe.incrby(key, count)
+    pipe.expire(key, settings.ADMISSION_DRAIN_WINDOW + DRAIN_BUCKET_SECONDS)
+    pipe.execute()
+
+
+def get_drain_rate():
+    """Finished document tasks per second over the last ADMISSION_DRAIN_WINDOW"""
+    current = int(time.time() // DRAIN_BUCKET_SECONDS)
+    buckets = range(current - settings.ADMISSION_DRAIN_WINDOW // DRAIN_BUCKET_SECONDS, current + 1)
+    redis = get_redis_connection('default')
+    counts = redis.mget([DRAINED_KEY.format(bucket=bucket) for bucket in buckets])
+    drained = sum(int(count) for count in counts if count)
+    return drained / settings.ADMISSION_DRAIN_WINDOW
+
+
+def get_broker_backlog():
+    """Messages ready in the document queues, read with passive declares"""
+    backlog = 0
+    try:
+        with current_app.connection_for_write() as connection:
+            channel = connection.default_channel
+            for queue in settings.DOCUMENT_QUEUES:
+                backlog += channel.queue_declare(queue=queue, passive=True).message_count
+    except OperationalError:
+        # Uploads still land in the outbox, whose pending rows are counted instead
+        return 0
+    return backlog
+
+
+def get_backlog():
+    """Total backlog, cached for ADMISSION_BACKLOG_CACHE_TTL seconds"""
+    backlog = cache.get(BACKLOG_CACHE_KEY)
+    if backlog is None:
+        if settings.FAIR_SCHEDULING_ENABLED:
+            backlog = fair_scheduling.backlog()
+        else:
+            backlog = get_broker_backlog()
+        # Accepted uploads the relay has not published yet
+        backlog += outbox.pending_count()
+        cache.set(BACKLOG_CACHE_KEY, backlog, settings.ADMISSION_BACKLOG_CACHE_TTL)
+    return backlog
+
+
+def record_broker_failure():
+    """Reject new work for ADMISSION_BROKER_RETRY_AFTER seconds"""
+    try:
+        cache.set(BROKER_DOWN_CACHE_KEY, time.time() + settings.ADMISSION_BROKER_RETRY_AFTER,
+                  settings.ADMISSION_BROKER_RETRY_AFTER)
+    except Exception:
+        pass  # The cache shares Redis with the fair queues, it may be the part that is down
+
+
+def broker_unavailable(retry_after=None):
+    return AdmissionRejected(
+        "The task queue is unavailable, please retry later",
+        clamp_retry_after(retry_after or settings.ADMISSION_BROKER_RETRY_AFTER)
+    )
+
+
+def check_admission(client_id=None, cost=1):
+    """
+    Raise AdmissionRejected when cost more tasks would push the backlog over
+    its limits. Failing to measure the backlog counts as the broker being down.
+    """
+    if not settings.ADMISSION_CONTROL_ENABLED:
+        return
+    try:
+        broker_down_until = cache.get(BROKER_DOWN_CACHE_KEY)
+        if broker_down_until:
+            raise broker_unavailable(broker_down_until - time.time())
+
+        backlog = get_backlog()
+        excess = backlog + cost - settings.ADMISSION_MAX_BACKLOG
+        message = "Too many documents are queued, please retry later"
+        if settings.FAIR_SCHEDULING_ENABLED and client_id:
+            client_excess = (
+                fair_scheduling.client_backlog(client_id) + cost - settings.ADMISSION_MAX_CLIENT_BACKLOG
+            )
+            if client_excess > 0 and client_excess >= excess:
+                excess = client_excess
+                message = "Too many of your documents are queued, please retry later"
+        if excess <= 0:
+            return
+        drain_rate = get_drain_rate()
+    except AdmissionRejected:
+        raise
+    except Exception:
+        record_broker_failure()
+        raise broker_unavailable()
+
+    if drain_rate > 0:
+        retry_after = excess / drain_rate
+    else:
+        retry_after = settings.ADMISSION_MAX_RETRY_AFTER
+    raise AdmissionRejected(message, clamp_retry_after(retry_after))
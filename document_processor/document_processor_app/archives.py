@@ -0,0 +1,52 @@
+"""
+Streaming readers for bulk upload archives.
+
+Members are yielded one at a time as file objects that decompress on read, so
+an archive is never extracted in memory or on disk as a whole. Each member must
+be consumed before the next one is requested.
+"""
+import tarfile
+import zipfile
+
+
+def iter_zip_members(archive):
+    with zipfile.ZipFile(archive) as zip_file:
+        for info in zip_file.infolist():
+            if info.is_dir():
+                continue
+            with zip_file.open(info) as member:
+                yield info.filename, info.file_size, member
+
+
+def iter_tar_members(archive):
+    # 'r|*' reads the tar as a forward-only stream with any compression
+    with tarfile.open(fileobj=archive, mode='r|*') as tar_file:
+        for info in tar_file:
+            if not info.isfile():
+                continue
+            member = tar_file.extractfile(info)
+            yield info.name, info.size, member
+
+
+def iter_archive_members(archive):
+    """Yield (member_name, size, file_obj) for every file in a ZIP or TAR upload"""
+    archive.seek(0)
+    is_zip = zipfile.is_zipfile(archive)
+    archive.seek(0)
+    if is_zip:
+        return iter_zip_members(archive)
+    return iter_tar_members(archive)
+
+
+def iter_member_names(archive):
+    """Names of the files in a ZIP or TAR upload, read from headers without extracting"""
+    archive.seek(0)
+    is_zip = zipfile.is_zipfile(archive)
+    archive.seek(0)
+    if is_zip:
+        with zipfile.ZipFile(archive) as zip_file:
+            yield from (info.filename for info in zip_file.infolist() if not info.is_dir())
+    else:
+        with tarfile.open(fileobj=archive, mode='r|*') as tar_file:
+            yield from (info.name for info in tar_file if info.isfile())
+    archive.seek(0)
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.core.cache import cache
 import json
 
@@ -15,4 +16,36 @@ def set_document_cache(file_hash, status, task_id=None):
 def get_document_cache(file_hash):
     cache_key = get_cache_key(file_hash)
     data = cache.get(cache_key)
-    return json.loads(data) if data else None 
\ No newline at end of file
+    return json.loads(data) if data else None
+
+def get_document_cache_many(file_hashes):
+    """Fetch the cache state of many hashes in one round trip, keyed by hash"""
+    cache_keys = {get_cache_key(file_hash): file_hash for file_hash in file_hashes}
+    found = cache.get_many(list(cache_keys))
+    return {cache_keys[cache_key]: json.loads(data) for cache_key, data in found.items() if data}
+
+def claim_document_cache(file_hash, task_id):
+    """
+    Atomically mark the hash as queued for task_id (Redis SET NX) with a lease.
+    Returns (claimed, cache_data), where cache_data belongs to whoever holds the key.
+    The lease lets another upload take over if the claiming task never reports back.
+    """
+    cache_key = get_cache_key(file_hash)
+    cache_data = {
+        'status': 'queued',
+        'task_id': task_id
+    }
+    for _ in range(2):
+        if cache.add(cache_key, json.dumps(cache_data), timeout=settings.DOCUMENT_CLAIM_LEASE):
+            return True, cache_data
+        existing = get_document_cache(file_hash)
+        if existing is not None:
+            return False, existing
+        # The key expired between add and get, try to claim it again
+    return False, cache_data
+
+def release_document_claim(file_hash, task_id):
+    """Drop our claim, e.g. when the task could not be published"""
+    cache_data = get_document_cache(file_hash)
+    if cache_data and cache_data.get('task_id') == task_id and cache_data.get('status') == 'queued':
+        cache.delete(get_cache_key(file_hash))
@@ -0,0 +1,49 @@
+"""
+Split document text into token-bounded, overlapping chunks for embedding.
+
+Tokens are whitespace separated words, a close enough proxy for model tokens
+to bound chunk size. Consecutive chunks share EMBEDDING_CHUNK_OVERLAP tokens
+so text cut at a chunk boundary is still seen whole by one of them. Pages are
+consumed one at a time, so memory is bounded by a chunk, not the document.
+"""
+import re
+from collections import namedtuple
+
+from django.conf import settings
+
+from .document_processing import strip_page_heading
+
+TOKEN_RE = re.compile(r'\S+')
+
+Chunk = namedtuple('Chunk', ['index', 'first_page', 'last_page', 'text', 'token_count'])
+
+
+def make_chunk(index, window):
+    return Chunk(
+        index=index,
+        first_page=window[0][1],
+        last_page=window[-1][1],
+        text=' '.join(token for token, _ in window),
+        token_count=len(window),
+    )
+
+
+def iter_chunks(pages, max_tokens=None, overlap=None):
+    """Yield Chunks for (page_number, markdown) pairs given in page order"""
+    max_tokens = max_tokens or settings.EMBEDDING_CHUNK_TOKENS
+    overlap = settings.EMBEDDING_CHUNK_OVERLAP if overlap is None else overlap
+    if not 0 <= overlap < max_tokens:
+        raise ValueError("overlap must be smaller than max_tokens")
+
+    window = []  # (token, page_number)
+    index = 0
+    for page_number, markdown in pages:
+        for token in TOKEN_RE.findall(strip_page_heading(markdown)):
+            window.append((token, page_number))
+            if len(window) == max_tokens:
+                yield make_chunk(index, window)
+                index += 1
+                window = window[max_tokens - overlap:]
+    # The tail, unless it is only the overlap of the last full chunk
+    if window and (index == 0 or len(window) > overlap):
+        yield make_chunk(index, window)
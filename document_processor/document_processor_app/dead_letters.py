@@ -0,0 +1,121 @@
+"""
+Dead letters: documents whose processing failed for good.
+
+A DeadLetter row keeps the hash, the error class and the attempt history of
+the failure, so failed documents can be found by cause and replayed once the
+cause is fixed. Replays go through the outbox under their own fair
+scheduling client and are published in rate-limited batches.
+"""
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .cache_utils import set_document_cache
+from .models import DeadLetter, Document
+
+REPLAY_CLIENT_ID = 'dead-letter-replay'
+
+
+def attempt_entry(task_id, attempt, error_kind, error, **extra):
+    """One item of a dead letter's attempt history"""
+    return {
+        'task_id': task_id,
+        'attempt': attempt,
+        'error_kind': error_kind,
+        'error': error,
+        'at': timezone.now().isoformat(),
+        **extra,
+    }
+
+
+def record_dead_letter(file_hash, task_id, task_args, queue, error_kind, error_class, error_message,
+                       attempts, document_id=None):
+    """Create the dead letter of a hash, or update it when a replay failed again"""
+    storage_ref, file_name = task_args[0], task_args[1]
+    engine = task_args[3] if len(task_args) > 3 else None
+    fields = {
+        'document_id': document_id,
+        'task_id': task_id,
+        'file_name': file_name,
+        'storage_ref': storage_ref,
+        'extraction_engine': engine or '',
+        'queue': queue,
+        'error_kind': error_kind,
+        'error_class': error_class,
+        'error_message': error_message,
+    }
+    with transaction.atomic():
+        dead_letter, created = DeadLetter.objects.select_for_update().get_or_create(
+            content_hash=file_hash,
+            defaults={**fields, 'attempts': attempts[-settings.DEAD_LETTER_MAX_ATTEMPTS:]}
+        )
+        if created:
+            return dead_letter
+        for name, value in fields.items():
+            setattr(dead_letter, name, value)
+        dead_letter.attempts = (dead_letter.attempts + attempts)[-settings.DEAD_LETTER_MAX_ATTEMPTS:]
+        dead_letter.failure_count += 1
+        dead_letter.status = DeadLetter.STATUS_DEAD
+        dead_letter.save()
+    return dead_letter
+
+
+def filter_dead_letters(queryset, error_class=None, error_kind=None, status=DeadLetter.STATUS_DEAD):
+    if status:
+        queryset = queryset.filter(status=status)
+    if error_class:
+        queryset = queryset.filter(error_class=error_class)
+    if error_kind:
+        queryset = queryset.filter(error_kind=error_kind)
+    return queryset
+
+
+def replay_batch(error_class=None, error_kind=None, after_id=0, batch_size=None, ids=None):
+    """
+    Replay the next batch of dead letters with an id above after_id. Each
+    document is reset to pending and a new task is recorded in the outbox.
+    Returns (replayed, last_id); last_id is None once nothing is left.
+    """
+    # Imported here because utils imports the tasks module
+    from .utils import publish_document_tasks
+
+    batch_size = batch_size or settings.DEAD_LETTER_REPLAY_BATCH_SIZE
+    queryset = filter_dead_letters(DeadLetter.objects.all(), error_class, error_kind)
+    if ids is not None:
+        queryset = queryset.filter(pk__in=ids)
+
+    with transaction.atomic():
+        dead_letters = list(
+            queryset.select_for_update(skip_locked=True).filter(pk__gt=after_id).order_by('id')[:batch_size]
+        )
+        if not dead_letters:
+            return 0, None
+
+        entries = []
+        for dead_letter in dead_letters:
+            entries.append({
+                "hash": dead_letter.content_hash,
+                "task_id": str(uuid.uuid4()),
+                "queue": dead_letter.queue,
+                "task_args": (
+                    dead_letter.storage_ref, dead_letter.file_name,
+                    dead_letter.content_hash, dead_letter.extraction_engine or None
+                ),
+            })
+        # Let the new tasks claim the documents again, whatever the earlier failure was
+        Document.objects.filter(content_hash__in=[entry["hash"] for entry in entries]).update(
+            status=Document.STATUS_PENDING, failure_reason='', updated_at=timezone.now()
+        )
+        publish_document_tasks(entries, REPLAY_CLIENT_ID)
+        DeadLetter.objects.filter(pk__in=[dead_letter.pk for dead_letter in dead_letters]).update(
+            status=DeadLetter.STATUS_REPLAYED,
+            replay_count=F('replay_count') + 1,
+            replayed_at=timezone.now()
+        )
+
+    for entry in entries:
+        set_document_cache(entry["hash"], "queued", entry["task_id"])
+    return len(dead_letters), dead_letters[-1].pk
@@ -1,21 +1,40 @@
-import pdfplumber
-
-def pdf_to_markdown(file_obj):
-    full_text = ""
-    basic_info = {
-        "title": None,
-        "author": None,
-        "pages": 0,
-        "subject": None,
-        "creator": None,
-    }
-
-    with pdfplumber.open(file_obj) as pdf:
-        basic_info["pages"] = len(pdf.pages)
-
-        for i, page in enumerate(pdf.pages):
-            text = page.extract_text()
-            if text:
-                full_text += f"\n\n## Page {i + 1}\n\n{text.strip()}"
-
-    return basic_info, full_text
\ No newline at end of file
+import re
+
+from pypdf import PdfReader
+from .extraction_engines import get_engine
+
+PAGE_HEADING_RE = re.compile(r'^\s*## Page \d+\s*')
+
+
+def get_page_count(file_obj):
+    """
+    Read the page count from the /Count entry of the root page tree, which only
+    needs the trailer, the xref table and two objects. Falls back to walking
+    the page tree when the entry is missing or broken.
+    """
+    reader = PdfReader(file_obj, strict=False)
+    try:
+        return int(reader.trailer['/Root']['/Pages']['/Count'])
+    except (KeyError, TypeError, ValueError):
+        return len(reader.pages)
+
+
+def format_page(page_number, text):
+    return f"\n\n## Page {page_number}\n\n{text.strip()}"
+
+
+def strip_page_heading(markdown):
+    """Inverse of format_page: the page text without its heading"""
+    return PAGE_HEADING_RE.sub('', markdown, count=1)
+
+
+def iter_markdown_pages(file_obj, first_page=None, last_page=None, engine=None, cache_stats=None):
+    """
+    Yield (page_number, markdown) for every page with text, one page at a time.
+    first_page and last_page (1-based, inclusive) restrict extraction to a page
+    range. engine selects the extraction engine, see extraction_engines.ENGINES.
+    cache_stats, a dict, receives the page cache 'hits' and 'misses'.
+    """
+    for page_number, text in get_engine(engine).iter_pages(file_obj, first_page, last_page, cache_stats):
+        if text and text.strip():
+            yield page_number, format_page(page_number, text)
@@ -0,0 +1,171 @@
+"""
+Embedding of document chunks.
+
+Embedders are pluggable: EMBEDDING_BACKEND names one of EMBEDDERS or gives the
+dotted path of an Embedder subclass. The default 'hashing' embedder works
+offline and is deterministic across processes: every word and word bigram is
+hashed to a few signed dimensions (a sparse random projection of the bag of
+words), weighted by sublinear term frequency and L2 normalized.
+
+Completed documents are embedded by embed_pending_documents, which batches the
+chunks of many documents per embedder call and stores each vector as packed
+little-endian float32 bytes in DocumentChunk.vector.
+"""
+import hashlib
+import math
+import re
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+from celery import current_app
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .chunking import iter_chunks
+from .models import DocumentChunk, DocumentPage, ProcessedDocument
+
+VECTOR_DTYPE = np.dtype('<f4')
+WORD_RE = re.compile(r'\w+')
+EMBED_KICK_KEY = 'embeddings:kick'
+
+
+def pack_vector(vector):
+    return np.asarray(vector, dtype=VECTOR_DTYPE).tobytes()
+
+
+def unpack_vector(data):
+    return np.frombuffer(data, dtype=VECTOR_DTYPE)
+
+
+class Embedder:
+    """Interface implemented by every embedder."""
+    name = None
+
+    def __init__(self, dimensions=None):
+        self.dimensions = dimensions or settings.EMBEDDING_DIMENSIONS
+
+    def embed(self, texts):
+        """Return a float32 array of shape (len(texts), dimensions) with unit rows"""
+        raise NotImplementedError
+
+
+@lru_cache(maxsize=100000)
+def hashed_projection(feature, dimensions, nonzeros):
+    """The dimensions and signs a feature is projected to"""
+    digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=4 * nonzeros).digest()
+    values = np.frombuffer(digest, dtype='<u4')
+    indices = values % dimensions
+    signs = np.where(values & 0x80000000, -1.0, 1.0).astype(VECTOR_DTYPE)
+    return indices, signs
+
+
+class HashingEmbedder(Embedder):
+    name = 'hashing'
+    nonzeros = 4  # Dimensions each feature is spread over
+
+    def features(self, text):
+        words = WORD_RE.findall(text.lower())
+        return Counter(words + [f"{first} {second}" for first, second in zip(words, words[1:])])
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dimensions), dtype=VECTOR_DTYPE)
+        for row, text in enumerate(texts):
+            for feature, count in self.features(text).items():
+                indices, signs = hashed_projection(feature, self.dimensions, self.nonzeros)
+                np.add.at(vectors[row], indices, signs * (1 + math.log(count)))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+
+EMBEDDERS = {
+    embedder.name: embedder
+    for embedder in (HashingEmbedder,)
+}
+
+
+@lru_cache(maxsize=None)
+def get_embedder(name=None):
+    name = name or settings.EMBEDDING_BACKEND
+    if name in EMBEDDERS:
+        return EMBEDDERS[name]()
+    try:
+        return import_string(name)()
+    except ImportError:
+        raise ValueError(f"Unknown embedder: {name}")
+
+
+def schedule_embedding():
+    """Embed recently completed documents soon, batched with whatever else completes meanwhile"""
+    if cache.add(EMBED_KICK_KEY, 1, timeout=settings.EMBEDDING_BATCH_DELAY):
+        current_app.send_task(
+            'document_processor_app.tasks.embed_documents', countdown=settings.EMBEDDING_BATCH_DELAY
+        )
+
+
+def iter_document_pages(processed_document):
+    if processed_document.markdown_content is not None:
+        # Legacy rows keep the whole markdown in one field
+        yield 1, processed_document.markdown_content
+        return
+    pages = (
+        DocumentPage.objects.filter(document_id=processed_document.document_id)
+        .order_by('page_number')
+        .values_list('page_number', 'content')
+    )
+    yield from pages.iterator()
+
+
+def write_chunks(chunks, embedder):
+    vectors = embedder.embed([chunk.content for chunk in chunks])
+    for chunk, vector in zip(chunks, vectors):
+        chunk.vector = pack_vector(vector)
+    DocumentChunk.objects.bulk_create(chunks)
+
+
+def embed_pending_documents(limit=None):
+    """
+    Chunk and embed up to limit documents that have no embeddings yet, calling
+    the embedder with batches of EMBEDDING_BATCH_SIZE chunks across documents.
+    Returns the number of documents embedded.
+    """
+    limit = limit or settings.EMBEDDING_MAX_DOCUMENTS
+    embedder = get_embedder()
+    with transaction.atomic():
+        processed_documents = list(
+            ProcessedDocument.objects.select_for_update(skip_locked=True)
+            .filter(embedded_at__isnull=True)
+            .order_by('id')[:limit]
+        )
+        if not processed_documents:
+            return 0
+        document_ids = [processed_document.document_id for processed_document in processed_documents]
+        DocumentChunk.objects.filter(document_id__in=document_ids).delete()
+
+        batch = []
+        for processed_document in processed_documents:
+            for chunk in iter_chunks(iter_document_pages(processed_document)):
+                batch.append(DocumentChunk(
+                    document_id=processed_document.document_id,
+                    chunk_index=chunk.index,
+                    first_page=chunk.first_page,
+                    last_page=chunk.last_page,
+                    content=chunk.text,
+                    token_count=chunk.token_count,
+                    embedder=embedder.name,
+                    dimensions=embedder.dimensions,
+                ))
+                if len(batch) >= settings.EMBEDDING_BATCH_SIZE:
+                    write_chunks(batch, embedder)
+                    batch = []
+        if batch:
+            write_chunks(batch, embedder)
+
+        ProcessedDocument.objects.filter(
+            pk__in=[processed_document.pk for processed_document in processed_documents]
+        ).update(embedded_at=timezone.now(), embedder=embedder.name)
+    return len(processed_documents)
@@ -0,0 +1,208 @@
+"""
+Text extraction engines used by document_processing.
+
+Every engine yields (page_number, text) pairs for a 1-based inclusive page
+range. The 'auto' engine uses PyMuPDF and falls back to pdfplumber's
+layout-aware extraction only for pages whose fast output looks degraded.
+Pages found in the page cache (see page_cache.py) are not extracted at all.
+"""
+import os
+from contextlib import contextmanager
+
+import fitz
+import pdfplumber
+from django.conf import settings
+from pypdf import PdfReader
+
+from .page_cache import PageCache
+
+
+def is_path(file_obj):
+    return isinstance(file_obj, (str, os.PathLike))
+
+
+class ExtractionEngine:
+    """Interface implemented by every extraction engine."""
+    name = None
+
+    @contextmanager
+    def open(self, file_obj):
+        """Yield an engine-specific handle for the document"""
+        raise NotImplementedError
+
+    def page_count(self, handle):
+        raise NotImplementedError
+
+    def extract_page(self, handle, page_number):
+        raise NotImplementedError
+
+    def iter_pages(self, file_obj, first_page=None, last_page=None, cache_stats=None):
+        """cache_stats, a dict, receives the page cache 'hits' and 'misses'"""
+        with self.open(file_obj) as handle, self.open_page_cache(file_obj, cache_stats) as page_cache:
+            page_count = self.page_count(handle)
+            first_page = first_page or 1
+            last_page = min(last_page or page_count, page_count)
+            for page_number in range(first_page, last_page + 1):
+                text = page_cache.get(page_number, last_page) if page_cache else None
+                if text is None:
+                    text = self.extract_page(handle, page_number)
+                    if page_cache:
+                        page_cache.put(page_number, text)
+                yield page_number, text
+
+    @contextmanager
+    def open_page_cache(self, file_obj, stats):
+        """Pages are fingerprinted through PyMuPDF whatever the engine"""
+        if not settings.PAGE_CACHE_ENABLED:
+            yield None
+            return
+        with FitzEngine().open(file_obj) as doc:
+            page_cache = PageCache(doc, self.name, stats)
+            yield page_cache
+            page_cache.flush()
+
+
+class FitzEngine(ExtractionEngine):
+    name = 'fitz'
+
+    @contextmanager
+    def open(self, file_obj):
+        if is_path(file_obj):
+            doc = fitz.open(file_obj)
+        else:
+            file_obj.seek(0)
+            doc = fitz.open(stream=file_obj.read(), filetype='pdf')
+        try:
+            yield doc
+        finally:
+            doc.close()
+
+    def page_count(self, handle):
+        return handle.page_count
+
+    def extract_page(self, handle, page_number):
+        return handle[page_number - 1].get_text('text')
+
+
+class PypdfEngine(ExtractionEngine):
+    name = 'pypdf'
+
+    @contextmanager
+    def open(self, file_obj):
+        yield PdfReader(file_obj)
+
+    def page_count(self, handle):
+        return len(handle.pages)
+
+    def extract_page(self, handle, page_number):
+        return handle.pages[page_number - 1].extract_text()
+
+
+class PdfplumberEngine(ExtractionEngine):
+    name = 'pdfplumber'
+
+    @contextmanager
+    def open(self, file_obj):
+        with pdfplumber.open(file_obj) as pdf:
+            yield pdf
+
+    def page_count(self, handle):
+        return len(handle.pages)
+
+    def extract_page(self, handle, page_number):
+        page = handle.pages[page_number - 1]
+        text = page.extract_text()
+        page.flush_cache()  # Release the parsed layout objects of this page
+        return text
+
+
+def looks_degraded(text):
+    """
+    Heuristic for fast-engine output that is worth re-extracting with layout
+    analysis: replacement/control characters or text broken into single letters.
+    """
+    stripped = text.strip() if text else ''
+    if not stripped:
+        return False  # Nothing to recover, most likely an image-only page
+
+    bad_chars = sum(1 for char in stripped if char == '\ufffd' or (ord(char) < 32 and char not in '\n\t'))
+    if bad_chars / len(stripped) > settings.EXTRACTION_DEGRADED_CHAR_RATIO:
+        return True
+
+    tokens = stripped.split()
+    single_chars = sum(1 for token in tokens if len(token) == 1)
+    return len(tokens) >= 20 and single_chars / len(tokens) > settings.EXTRACTION_DEGRADED_TOKEN_RATIO
+
+
+class AutoEngine(ExtractionEngine):
+    name = 'auto'
+
+    def __init__(self):
+        self.fast = FitzEngine()
+        self.fallback = PdfplumberEngine()
+
+    @contextmanager
+    def open(self, file_obj):
+        with self.fast.open(file_obj) as fast_handle, _LazyHandle(self.fallback, file_obj) as fallback_handle:
+            yield fast_handle, fallback_handle
+
+    def page_count(self, handle):
+        fast_handle, _ = handle
+        return self.fast.page_count(fast_handle)
+
+    def extract_page(self, handle, page_number):
+        fast_handle, fallback_handle = handle
+        text = self.fast.extract_page(fast_handle, page_number)
+        if looks_degraded(text):
+            text = self.fallback.extract_page(fallback_handle.get(), page_number)
+        return text
+
+
+class _LazyHandle:
+    """Open the fallback engine only once a page actually needs it."""
+
+    def __init__(self, engine, file_obj):
+        self.engine = engine
+        self.file_obj = file_obj
+        self._context = None
+        self._handle = None
+
+    def get(self):
+        if self._context is None:
+            self._context = self.engine.open(self.file_obj)
+            self._handle = self._context.__enter__()
+        return self._handle
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._context is not None:
+            self._context.__exit__(*exc_info)
+
+
+ENGINES = {
+    engine.name: engine
+    for engine in (FitzEngine, PypdfEngine, PdfplumberEngine, AutoEngine)
+}
+
+ENGINE_CHOICES = list(ENGINES)
+
+
+def resolve_engine_name(engine=None, document_class=None):
+    """Explicit engine first, then the per document class mapping, then the default"""
+    if engine:
+        return engine
+    if document_class:
+        engine = settings.EXTRACTION_ENGINE_BY_DOCUMENT_CLASS.get(document_class)
+        if engine:
+            return engine
+    return settings.EXTRACTION_ENGINE
+
+
+def get_engine(name=None):
+    name = name or settings.EXTRACTION_ENGINE
+    try:
+        return ENGINES[name]()
+    except KeyError:
+        raise ValueError(f"Unknown extraction engine: {name}")
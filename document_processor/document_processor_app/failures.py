@@ -0,0 +1,73 @@
+"""
+Classification of document processing failures.
+
+Transient failures (database, blob storage, broker, cache) are worth retrying
+with backoff. Everything else raised while processing a document, such as an
+encrypted or corrupt PDF or a parser error, fails the same way on every
+attempt and is treated as permanent, so it fails fast with a recorded reason.
+
+Two resource failures are permanent on purpose. A MemoryError comes from a
+page that exhausts the worker on every parse, and SoftTimeLimitExceeded
+would recur under the same queue's limit (documents routed by file size can
+hit the small queue's two minutes). Such documents are dead-lettered to the
+queue with the highest limits, so a replay gets more time.
+"""
+import random
+
+from celery.exceptions import OperationalError as BrokerOperationalError, SoftTimeLimitExceeded
+from django.conf import settings
+from django.db import InterfaceError, OperationalError as DatabaseOperationalError
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+
+ERROR_PERMANENT = 'permanent'
+ERROR_TRANSIENT = 'transient'
+
+TRANSIENT_ERRORS = (
+    DatabaseOperationalError,
+    InterfaceError,
+    BrokerOperationalError,
+    RedisConnectionError,
+    RedisTimeoutError,
+    ConnectionError,
+    TimeoutError,
+)
+# Retrying on the same queue fails the same way, see the module docstring
+RESOURCE_LIMIT_ERRORS = (MemoryError, SoftTimeLimitExceeded)
+
+try:
+    # Only installed with the S3 blob store backend
+    from botocore.exceptions import ConnectionError as BotocoreConnectionError, HTTPClientError
+
+    TRANSIENT_ERRORS += (BotocoreConnectionError, HTTPClientError)
+except ImportError:
+    pass
+
+
+def classify_error(exc):
+    if isinstance(exc, RESOURCE_LIMIT_ERRORS):
+        return ERROR_PERMANENT
+    if isinstance(exc, TRANSIENT_ERRORS):
+        return ERROR_TRANSIENT
+    # S3 throttling and server errors arrive as ClientError with a status code
+    response = getattr(exc, 'response', None)
+    if isinstance(response, dict):
+        status_code = response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+        if status_code == 429 or status_code >= 500:
+            return ERROR_TRANSIENT
+    return ERROR_PERMANENT
+
+
+def describe_error(exc):
+    return f"{exc.__class__.__name__}: {exc}"
+
+
+def retry_delay(retries, base_delay=None, max_delay=None):
+    """
+    Exponential backoff with jitter: a random delay between half and all of
+    base_delay * 2**retries, capped at max_delay, so retries of documents that
+    failed together do not hit the recovering service at the same moment.
+    """
+    base_delay = base_delay or settings.DOCUMENT_RETRY_BASE_DELAY
+    max_delay = max_delay or settings.DOCUMENT_RETRY_MAX_DELAY
+    delay = min(base_delay * 2 ** retries, max_delay)
+    return random.uniform(delay / 2, delay)
@@ -0,0 +1,281 @@
+"""
+Weighted fair dispatch of document tasks across clients.
+
+Uploads are not published to the broker directly. Each client gets its own
+Redis list and a single dispatcher drains those lists with deficit round
+robin: per round every client may dispatch as many tasks as its weight,
+bounded by its own concurrency cap and by the free capacity of the target
+document queue. A bulk backfill therefore only ever occupies its share of
+the workers and interactive uploads keep a bounded wait.
+
+The dispatcher moves each task it takes into a processing list with LMOVE
+and clears the list only once the broker accepted the batch. A dispatcher
+that dies in between leaves the list behind and the next run puts those
+tasks back at the head of their clients' lists, so a task is dispatched at
+least once.
+"""
+import json
+import logging
+import time
+
+from celery import current_app
+from django.conf import settings
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+CLIENT_QUEUE_KEY = 'fair:queue:{client_id}'
+ACTIVE_CLIENTS_KEY = 'fair:clients'
+DEFICIT_KEY = 'fair:deficit'
+CLIENT_IN_FLIGHT_KEY = 'fair:inflight:client:{client_id}'
+QUEUE_IN_FLIGHT_KEY = 'fair:inflight:queue:{queue}'
+TASK_KEY = 'fair:task:{task_id}'
+DISPATCH_LOCK_KEY = 'fair:dispatch-lock'
+DISPATCH_KICK_KEY = 'fair:dispatch-kick'
+PROCESSING_KEY = 'fair:processing'  # Only the dispatcher holding the lock uses it
+SUBMITTED_KEY = 'fair:submitted:{task_id}'
+
+# Drop a client from the active set only if its list is still empty, so a
+# concurrent submit can never leave work behind in an inactive list
+DEACTIVATE_CLIENT_SCRIPT = """
+if redis.call('llen', KEYS[1]) == 0 then
+    return redis.call('srem', KEYS[2], ARGV[1])
+end
+return 0
+"""
+
+# Queue a message only if its task id was not submitted before
+SUBMIT_SCRIPT = """
+if redis.call('set', KEYS[2], 1, 'NX', 'EX', ARGV[2]) then
+    return redis.call('rpush', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+DEFAULT_CLIENT_ID = 'anonymous'
+
+
+def get_redis():
+    return get_redis_connection('default')
+
+
+def get_client_weight(client_id):
+    return settings.FAIR_CLIENT_WEIGHTS.get(client_id, settings.FAIR_DEFAULT_WEIGHT)
+
+
+def get_client_concurrency(client_id):
+    return settings.FAIR_CLIENT_CONCURRENCY.get(client_id, settings.FAIR_DEFAULT_CONCURRENCY)
+
+
+def count_in_flight(redis, key, now):
+    # Entries older than the longest task time limit belong to lost workers
+    redis.zremrangebyscore(key, 0, now - settings.FAIR_IN_FLIGHT_TIMEOUT)
+    return redis.zcard(key)
+
+
+def submit(entries, client_id=None):
+    """
+    Append prepared entries to the client's list and wake the dispatcher.
+    Entries whose task id was already submitted are skipped, so a relay that
+    hands over the same outbox row twice does not queue it twice.
+    """
+    if not entries:
+        return
+    client_id = client_id or DEFAULT_CLIENT_ID
+    redis = get_redis()
+    pipe = redis.pipeline()
+    for entry in entries:
+        pipe.eval(
+            SUBMIT_SCRIPT, 2,
+            CLIENT_QUEUE_KEY.format(client_id=client_id), SUBMITTED_KEY.format(task_id=entry['task_id']),
+            json.dumps({
+                'task_id': entry['task_id'],
+                'task_args': list(entry['task_args']),
+                'queue': entry['queue'],
+                'client_id': client_id,
+            }),
+            settings.FAIR_SUBMIT_DEDUP_TTL
+        )
+    pipe.sadd(ACTIVE_CLIENTS_KEY, client_id)
+    pipe.execute()
+    kick()
+
+
+def kick():
+    """Schedule a dispatch run soon, at most once per FAIR_DISPATCH_KICK_INTERVAL"""
+    redis = get_redis()
+    if not redis.set(DISPATCH_KICK_KEY, 1, nx=True, px=int(settings.FAIR_DISPATCH_KICK_INTERVAL * 1000)):
+        return
+    try:
+        current_app.send_task('document_processor_app.tasks.dispatch_fair_queue')
+    except Exception:
+        # The periodic dispatch picks the work up anyway
+        logger.warning("Could not schedule a fair queue dispatch", exc_info=True)
+
+
+def acquire_subtasks(parent_task_id, task_ids, queue):
+    """
+    Count subtasks published outside the dispatcher, such as the page ranges
+    of a fanned-out document, against the client of their parent task and
+    against their queue until each one is released.
+    """
+    if not settings.FAIR_SCHEDULING_ENABLED or not task_ids:
+        return
+    redis = get_redis()
+    slot = redis.hgetall(TASK_KEY.format(task_id=parent_task_id))
+    client_id = slot[b'client_id'].decode() if slot else DEFAULT_CLIENT_ID
+    now = time.time()
+    pipe = redis.pipeline()
+    pipe.zadd(CLIENT_IN_FLIGHT_KEY.format(client_id=client_id), {task_id: now for task_id in task_ids})
+    pipe.zadd(QUEUE_IN_FLIGHT_KEY.format(queue=queue), {task_id: now for task_id in task_ids})
+    for task_id in task_ids:
+        pipe.hset(TASK_KEY.format(task_id=task_id), mapping={'client_id': client_id, 'queue': queue})
+        pipe.expire(TASK_KEY.format(task_id=task_id), settings.FAIR_IN_FLIGHT_TIMEOUT)
+    pipe.execute()
+
+
+def release(task_id):
+    """Free the client and queue slots held by a finished task"""
+    if not settings.FAIR_SCHEDULING_ENABLED:
+        return
+    redis = get_redis()
+    task_key = TASK_KEY.format(task_id=task_id)
+    slot = redis.hgetall(task_key)
+    if not slot:
+        return
+    pipe = redis.pipeline()
+    pipe.zrem(CLIENT_IN_FLIGHT_KEY.format(client_id=slot[b'client_id'].decode()), task_id)
+    pipe.zrem(QUEUE_IN_FLIGHT_KEY.format(queue=slot[b'queue'].decode()), task_id)
+    pipe.delete(task_key)
+    pipe.execute()
+    kick()
+
+
+def backlog():
+    """Number of tasks waiting in client lists or dispatched and not yet finished"""
+    redis = get_redis()
+    clients = [client_id.decode() for client_id in redis.smembers(ACTIVE_CLIENTS_KEY)]
+    pipe = redis.pipeline()
+    for client_id in clients:
+        pipe.llen(CLIENT_QUEUE_KEY.format(client_id=client_id))
+    for queue in settings.FAIR_QUEUE_CAPACITY:
+        pipe.zcard(QUEUE_IN_FLIGHT_KEY.format(queue=queue))
+    return sum(pipe.execute())
+
+
+def client_backlog(client_id):
+    """Backlog of a single client"""
+    redis = get_redis()
+    pipe = redis.pipeline()
+    pipe.llen(CLIENT_QUEUE_KEY.format(client_id=client_id))
+    pipe.zcard(CLIENT_IN_FLIGHT_KEY.format(client_id=client_id))
+    return sum(pipe.execute())
+
+
+def dispatch(publish):
+    """
+    Move waiting tasks to the broker in weighted round-robin order. publish is
+    called once as publish(batch, on_published), where on_published must be
+    called with the task id of every message the broker accepted. Returns the
+    number of tasks dispatched.
+    """
+    redis = get_redis()
+    if not redis.set(DISPATCH_LOCK_KEY, 1, nx=True, ex=60):
+        return 0  # Another dispatcher is running
+    try:
+        recover(redis)
+        return _dispatch(redis, publish)
+    finally:
+        redis.delete(DISPATCH_LOCK_KEY)
+
+
+def push_back(redis, messages):
+    """Return messages to the head of their clients' lists, in order, and free their slots"""
+    pipe = redis.pipeline()
+    for message in reversed(messages):
+        client_id = message['client_id']
+        pipe.lpush(CLIENT_QUEUE_KEY.format(client_id=client_id), json.dumps(message))
+        pipe.zrem(CLIENT_IN_FLIGHT_KEY.format(client_id=client_id), message['task_id'])
+        pipe.zrem(QUEUE_IN_FLIGHT_KEY.format(queue=message['queue']), message['task_id'])
+        pipe.delete(TASK_KEY.format(task_id=message['task_id']))
+        pipe.sadd(ACTIVE_CLIENTS_KEY, client_id)
+    pipe.delete(PROCESSING_KEY)
+    pipe.execute()
+
+
+def recover(redis):
+    """Put back the tasks a dead dispatcher took but may not have published"""
+    messages = [json.loads(raw) for raw in redis.lrange(PROCESSING_KEY, 0, -1)]
+    if messages:
+        logger.warning(f"Requeueing {len(messages)} tasks left by an interrupted dispatch")
+        push_back(redis, messages)
+
+
+def _dispatch(redis, publish):
+    now = time.time()
+    queue_capacity = {
+        queue: capacity - count_in_flight(redis, QUEUE_IN_FLIGHT_KEY.format(queue=queue), now)
+        for queue, capacity in settings.FAIR_QUEUE_CAPACITY.items()
+    }
+    clients = sorted(client_id.decode() for client_id in redis.smembers(ACTIVE_CLIENTS_KEY))
+    client_capacity = {
+        client_id: get_client_concurrency(client_id)
+        - count_in_flight(redis, CLIENT_IN_FLIGHT_KEY.format(client_id=client_id), now)
+        for client_id in clients
+    }
+    deficits = {
+        client_id: float(redis.hget(DEFICIT_KEY, client_id) or 0)
+        for client_id in clients
+    }
+
+    batch = []
+    progress = True
+    while progress and clients and any(capacity > 0 for capacity in queue_capacity.values()):
+        progress = False
+        for client_id in list(clients):
+            queue_key = CLIENT_QUEUE_KEY.format(client_id=client_id)
+            weight = get_client_weight(client_id)
+            # Unused credit is capped so a blocked client cannot burst later
+            deficits[client_id] = min(deficits[client_id] + weight, 2 * weight)
+            while deficits[client_id] >= 1 and client_capacity[client_id] > 0:
+                raw = redis.lindex(queue_key, 0)
+                if raw is None:
+                    redis.eval(DEACTIVATE_CLIENT_SCRIPT, 2, queue_key, ACTIVE_CLIENTS_KEY, client_id)
+                    clients.remove(client_id)
+                    deficits[client_id] = 0
+                    break
+                message = json.loads(raw)
+                if queue_capacity.get(message['queue'], 0) <= 0:
+                    break  # The client's next task targets a full queue
+                redis.lmove(queue_key, PROCESSING_KEY, 'LEFT', 'RIGHT')
+                batch.append(message)
+                deficits[client_id] -= 1
+                client_capacity[client_id] -= 1
+                queue_capacity[message['queue']] -= 1
+                progress = True
+
+    if deficits:
+        redis.hset(DEFICIT_KEY, mapping={client_id: deficit for client_id, deficit in deficits.items()})
+    if not batch:
+        return 0
+
+    pipe = redis.pipeline()
+    for message in batch:
+        pipe.zadd(CLIENT_IN_FLIGHT_KEY.format(client_id=message['client_id']), {message['task_id']: now})
+        pipe.zadd(QUEUE_IN_FLIGHT_KEY.format(queue=message['queue']), {message['task_id']: now})
+        pipe.hset(TASK_KEY.format(task_id=message['task_id']), mapping={
+            'client_id': message['client_id'],
+            'queue': message['queue'],
+        })
+        pipe.expire(TASK_KEY.format(task_id=message['task_id']), settings.FAIR_IN_FLIGHT_TIMEOUT)
+    pipe.execute()
+
+    published = set()
+    try:
+        publish(batch, published.add)
+    except Exception:
+        # Only what the broker did not accept goes back, or it would run twice
+        push_back(redis, [message for message in batch if message['task_id'] not in published])
+        raise
+    redis.delete(PROCESSING_KEY)
+    return len(batch)
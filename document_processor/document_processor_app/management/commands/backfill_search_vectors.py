@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchVector
+from django.core.management.base import BaseCommand
+
+from document_processor_app.models import DocumentPage
+
+
+class Command(BaseCommand):
+    help = "Fill DocumentPage.search_vector for pages written before the search trigger existed"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.SEARCH_BACKFILL_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        # Short batches in id order keep each update's locks and WAL small
+        after_id = 0
+        total = 0
+        while True:
+            ids = list(
+                DocumentPage.objects.filter(id__gt=after_id, search_vector__isnull=True)
+                .order_by('id')
+                .values_list('id', flat=True)[:options['batch_size']]
+            )
+            if not ids:
+                break
+            total += DocumentPage.objects.filter(pk__in=ids).update(
+                search_vector=SearchVector('content', config=settings.SEARCH_CONFIG)
+            )
+            after_id = ids[-1]
+            self.stdout.write(f"Backfilled {total} pages")
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {total} pages"))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from document_processor_app.models import Document
+from document_processor_app.near_duplicates import record_signature
+from document_processor_app.tasks import iter_page_texts
+
+
+class Command(BaseCommand):
+    help = "Compute MinHash signatures of completed documents processed before near-duplicate detection"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, help="At most this many documents")
+
+    def handle(self, *args, **options):
+        # Oldest first, so later copies are linked to the earliest document
+        documents = Document.objects.filter(
+            status=Document.STATUS_COMPLETED, signature__isnull=True
+        ).order_by('id').only('id')
+        if options['limit']:
+            documents = documents[:options['limit']]
+        total = duplicates = 0
+        for document in documents.iterator():
+            if record_signature(document, iter_page_texts(document)):
+                duplicates += 1
+            total += 1
+            if total % 1000 == 0:
+                self.stdout.write(f"Signed {total} documents, {duplicates} near-duplicates")
+        self.stdout.write(self.style.SUCCESS(f"Signed {total} documents, {duplicates} near-duplicates"))
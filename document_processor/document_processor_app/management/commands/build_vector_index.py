@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from document_processor_app.vector_index import get_index, update_index
+
+
+class Command(BaseCommand):
+    help = "Add newly embedded chunks to the vector index, or rebuild it"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help="Build a new index from all chunks")
+
+    def handle(self, *args, **options):
+        added = update_index(rebuild=options['rebuild'])
+        index = get_index()
+        size = index.size if index else 0
+        self.stdout.write(self.style.SUCCESS(f"Added {added} chunks, the index holds {size}"))
@@ -0,0 +1,70 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from document_processor_app.dead_letters import filter_dead_letters, replay_batch
+from document_processor_app.failures import ERROR_PERMANENT, ERROR_TRANSIENT
+from document_processor_app.models import DeadLetter
+
+
+class Command(BaseCommand):
+    help = "List dead letters by error class, or replay them in rate-limited batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['summary', 'list', 'replay'])
+        parser.add_argument('--error-class')
+        parser.add_argument('--error-kind', choices=[ERROR_PERMANENT, ERROR_TRANSIENT])
+        parser.add_argument('--limit', type=int, help="At most this many dead letters")
+        parser.add_argument('--batch-size', type=int, default=settings.DEAD_LETTER_REPLAY_BATCH_SIZE)
+        parser.add_argument('--rate', type=float, default=settings.DEAD_LETTER_REPLAY_RATE,
+                            help="Replayed documents per second")
+        parser.add_argument('--dry-run', action='store_true', help="Only count what would be replayed")
+
+    def handle(self, *args, **options):
+        queryset = filter_dead_letters(DeadLetter.objects.all(), options['error_class'], options['error_kind'])
+        getattr(self, options['action'])(queryset, options)
+
+    def summary(self, queryset, options):
+        rows = queryset.values('error_kind', 'error_class').annotate(count=Count('id')).order_by('-count')
+        for row in rows:
+            self.stdout.write(f"{row['count']:>8}  {row['error_kind']:<10} {row['error_class']}")
+
+    def list(self, queryset, options):
+        queryset = queryset.order_by('id')
+        if options['limit']:
+            queryset = queryset[:options['limit']]
+        for dead_letter in queryset.iterator():
+            self.stdout.write(
+                f"{dead_letter.id:>8}  {dead_letter.content_hash}  {dead_letter.error_kind:<10} "
+                f"{dead_letter.error_class}: {dead_letter.error_message[:100]}  "
+                f"(failed {dead_letter.failure_count}x, {len(dead_letter.attempts)} attempts) {dead_letter.file_name}"
+            )
+
+    def replay(self, queryset, options):
+        if options['dry_run']:
+            count = queryset.count()
+            if options['limit']:
+                count = min(count, options['limit'])
+            self.stdout.write(f"Would replay {count} dead letters")
+            return
+
+        remaining = options['limit']
+        after_id = 0
+        total = 0
+        while remaining is None or remaining > 0:
+            batch_size = options['batch_size'] if remaining is None else min(options['batch_size'], remaining)
+            started = time.monotonic()
+            replayed, after_id = replay_batch(
+                options['error_class'], options['error_kind'], after_id, batch_size
+            )
+            if after_id is None:
+                break
+            total += replayed
+            if remaining is not None:
+                remaining -= replayed
+            self.stdout.write(f"Replayed {total} dead letters")
+            # Keep to the requested rate across batches
+            time.sleep(max(0, replayed / options['rate'] - (time.monotonic() - started)))
+        self.stdout.write(self.style.SUCCESS(f"Replayed {total} dead letters"))
@@ -0,0 +1,42 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from document_processor_app.outbox import relay_batch
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Publish document tasks recorded in the outbox to the broker"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.OUTBOX_BATCH_SIZE)
+        parser.add_argument('--once', action='store_true', help="Exit once the outbox is empty")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        retry_delay = settings.OUTBOX_POLL_INTERVAL
+        while True:
+            close_old_connections()
+            try:
+                relayed = relay_batch(batch_size)
+            except Exception:
+                if options['once']:
+                    raise
+                # Back off while the broker is down; uploads keep landing in the outbox
+                logger.exception(f"Relaying outbox messages failed, retrying in {retry_delay:.1f}s")
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, settings.OUTBOX_MAX_RETRY_DELAY)
+                continue
+
+            retry_delay = settings.OUTBOX_POLL_INTERVAL
+            if relayed:
+                logger.info(f"Relayed {relayed} outbox messages")
+            if relayed < batch_size:
+                if options['once']:
+                    return
+                time.sleep(settings.OUTBOX_POLL_INTERVAL)
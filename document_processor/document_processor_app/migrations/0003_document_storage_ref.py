@@ -0,0 +1,23 @@
+# Generated by Django 4.2.21 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document_processor_app', '0002_alter_document_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='storage_ref',
+            field=models.CharField(blank=True, default='', max_length=512),
+        ),
+        migrations.AlterField(
+            model_name='document',
+            name='file_content',
+            field=models.BinaryField(null=True),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.21 on 2026-10-18 10:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document_processor_app', '0003_document_storage_ref'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentPageRange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_page', models.PositiveIntegerField()),
+                ('last_page', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('markdown_content', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='page_ranges', to='document_processor_app.document')),
+            ],
+            options={
+                'db_table': 'DocumentPageRange',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='documentpagerange',
+            constraint=models.UniqueConstraint(fields=('document', 'first_page'), name='unique_document_page_range'),
+        ),
+    ]
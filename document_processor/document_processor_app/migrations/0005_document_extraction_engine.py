@@ -0,0 +1,18 @@
+# Generated by Django 4.2.21 on 2026-10-18 10:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document_processor_app', '0004_documentpagerange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='extraction_engine',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.21 on 2026-10-18 11:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document_processor_app', '0005_document_extraction_engine'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='processeddocument',
+            name='markdown_content',
+            field=models.TextField(null=True),
+        ),
+        migrations.RemoveField(
+            model_name='documentpagerange',
+            name='markdown_content',
+        ),
+        migrations.CreateModel(
+            name='DocumentPage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page_number', models.PositiveIntegerField()),
+                ('content', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pages', to='document_processor_app.document')),
+            ],
+            options={
+                'db_table': 'DocumentPage',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='documentpage',
+            constraint=models.UniqueConstraint(fields=('document', 'page_number'), name='unique_document_page'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.21 on 2026-10-18 12:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document_processor_app', '0006_documentpage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentpage',
+            name='char_offset',
+            field=models.PositiveBigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='documentpage',
+            name='page_hash',
+            field=models.CharField(default='', max_length=64),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.21 on 2026-10-18 12:40
+
+import os
+import tempfile
+
+from django.conf import settings
+from django.db import migrations
+
+
+def move_file_content_to_blob_store(apps, schema_editor):
+    """Copy legacy file_content bytes into the blob store, one row at a time"""
+    from document_processor_app.storage import get_blob_store
+
+    Document = apps.get_model('document_processor_app', 'Document')
+    store = get_blob_store()
+    pending = Document.objects.filter(file_content__isnull=False).values_list('id', flat=True)
+    for document_id in list(pending.iterator()):
+        document = Document.objects.only('content_hash', 'file_content').get(pk=document_id)
+        fd, path = tempfile.mkstemp(dir=settings.UPLOAD_SPOOL_DIR, suffix='.pdf')
+        with os.fdopen(fd, 'wb') as spool_file:
+            spool_file.write(document.file_content)
+        storage_ref = store.put_file(document.content_hash, path)
+        Document.objects.filter(pk=document_id).update(storage_ref=storage_ref, file_content=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document_processor_app', '0007_documentpage_offset_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_file_content_to_blob_store, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='document',
+            name='file_content',
+        ),
+    ]
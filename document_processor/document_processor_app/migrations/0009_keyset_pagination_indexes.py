@@ -0,0 +1,29 @@
+# Generated by Django 4.2.21 on 2026-10-18 13:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document_processor_app', '0008_move_file_content_to_blob_store'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['created_at', 'id'], name='document_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['status', 'created_at', 'id'], name='document_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['file_name'], name='document_file_name_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='processeddocument',
+            index=models.Index(fields=['created_at', 'id'], name='processed_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.21 on 2026-10-18 14:20
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document_processor_app', '0009_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('file_name', models.CharField(max_length=255)),
+                ('engine', models.CharField(blank=True, default='', max_length=20)),
+                ('document_class', models.CharField(blank=True, default='', max_length=50)),
+                ('chunk_size', models.PositiveIntegerField()),
+                ('total_size', models.PositiveBigIntegerField(null=True)),
+                ('received_bytes', models.PositiveBigIntegerField(default=0)),
+                ('status', models.CharField(choices=[('open', 'Open'), ('finalizing', 'Finalizing'), ('completed', 'Completed'), ('failed', 'Failed')], default='open', max_length=20)),
+                ('file_hash', models.CharField(blank=True, default='', max_length=64)),
+                ('task_id', models.CharField(blank=True, default='', max_length=255)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'UploadSession',
+            },
+        ),
+    ]
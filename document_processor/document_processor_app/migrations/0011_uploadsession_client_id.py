@@ -0,0 +1,18 @@
+# Generated by Django 4.2.21 on 2026-10-18 15:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document_processor_app', '0010_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='client_id',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
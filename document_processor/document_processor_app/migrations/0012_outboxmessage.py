@@ -0,0 +1,35 @@
+# Generated by Django 4.2.21 on 2026-10-18 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document_processor_app', '0011_uploadsession_client_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_id', models.CharField(max_length=255, unique=True)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('client_id', models.CharField(blank=True, default='', max_length=255)),
+                ('queue', models.CharField(max_length=50)),
+                ('task_args', models.JSONField()),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'OutboxMessage',
+                'indexes': [
+                    models.Index(condition=models.Q(('sent_at__isnull', True)), fields=['id'], name='outbox_pending_idx'),
+                    models.Index(fields=['sent_at'], name='outbox_sent_at_idx'),
+                ],
+            },
+        ),
+    ]
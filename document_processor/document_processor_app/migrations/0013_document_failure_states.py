@@ -0,0 +1,41 @@
+# Generated by Django 4.2.21 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+def split_failed_status(apps, schema_editor):
+    # The old 'failed' status did not tell why; let those documents be retried
+    Document = apps.get_model('document_processor_app', 'Document')
+    Document.objects.filter(status='failed').update(status='failed_transient')
+
+
+def merge_failed_status(apps, schema_editor):
+    Document = apps.get_model('document_processor_app', 'Document')
+    Document.objects.filter(status__in=['failed_transient', 'failed_permanent']).update(status='failed')
+    Document.objects.filter(status__in=['processing', 'retrying']).update(status='pending')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document_processor_app', '0012_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='failure_reason',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='task_id',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='document',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('retrying', 'Retrying'), ('completed', 'Completed'), ('failed_transient', 'Failed (transient)'), ('failed_permanent', 'Failed (permanent)')], default='pending', max_length=20),
+        ),
+        migrations.RunPython(split_failed_status, merge_failed_status),
+    ]
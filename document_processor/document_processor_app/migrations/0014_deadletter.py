@@ -0,0 +1,44 @@
+# Generated by Django 4.2.21 on 2026-10-18 16:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document_processor_app', '0013_document_failure_states'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeadLetter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64, unique=True)),
+                ('task_id', models.CharField(max_length=255)),
+                ('file_name', models.CharField(max_length=255)),
+                ('storage_ref', models.CharField(max_length=512)),
+                ('extraction_engine', models.CharField(blank=True, default='', max_length=20)),
+                ('queue', models.CharField(max_length=50)),
+                ('error_kind', models.CharField(max_length=20)),
+                ('error_class', models.CharField(max_length=255)),
+                ('error_message', models.TextField(blank=True, default='')),
+                ('attempts', models.JSONField(default=list)),
+                ('failure_count', models.PositiveIntegerField(default=1)),
+                ('replay_count', models.PositiveIntegerField(default=0)),
+                ('status', models.CharField(choices=[('dead', 'Dead'), ('replayed', 'Replayed')], default='dead', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('replayed_at', models.DateTimeField(blank=True, null=True)),
+                ('document', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='dead_letters', to='document_processor_app.document')),
+            ],
+            options={
+                'db_table': 'DeadLetter',
+                'indexes': [
+                    models.Index(fields=['created_at', 'id'], name='deadletter_created_id_idx'),
+                    models.Index(fields=['status', 'error_class', 'id'], name='deadletter_status_class_idx'),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.21 on 2026-10-18 17:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document_processor_app', '0014_deadletter'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['task_id'], name='document_task_id_idx'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.21 on 2026-10-18 17:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document_processor_app', '0015_document_task_id_idx'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='processeddocument',
+            name='embeddings',
+        ),
+        migrations.AddField(
+            model_name='processeddocument',
+            name='embedded_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='processeddocument',
+            name='embedder',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='processeddocument',
+            index=models.Index(condition=models.Q(('embedded_at__isnull', True)), fields=['id'], name='processed_embed_pending_idx'),
+        ),
+        migrations.CreateModel(
+            name='DocumentChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chunk_index', models.PositiveIntegerField()),
+                ('first_page', models.PositiveIntegerField()),
+                ('last_page', models.PositiveIntegerField()),
+                ('content', models.TextField()),
+                ('token_count', models.PositiveIntegerField()),
+                ('embedder', models.CharField(max_length=255)),
+                ('dimensions', models.PositiveSmallIntegerField()),
+                ('vector', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='document_processor_app.document')),
+            ],
+            options={
+                'db_table': 'DocumentChunk',
+                'constraints': [models.UniqueConstraint(fields=('document', 'chunk_index'), name='unique_document_chunk')],
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.21 on 2026-10-18 19:05
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Keep the configuration in step with settings.SEARCH_CONFIG
+CREATE_TRIGGER = """
+CREATE FUNCTION documentpage_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := to_tsvector('pg_catalog.english', coalesce(NEW.content, ''));
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER documentpage_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF content ON "DocumentPage"
+    FOR EACH ROW EXECUTE PROCEDURE documentpage_search_vector_update();
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER IF EXISTS documentpage_search_vector_trigger ON "DocumentPage";
+DROP FUNCTION IF EXISTS documentpage_search_vector_update();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document_processor_app', '0016_documentchunk'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentpage',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        # Existing pages are filled in by the backfill_search_vectors command
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+        migrations.AddIndex(
+            model_name='documentpage',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='page_search_vector_idx'),
+        ),
+    ]
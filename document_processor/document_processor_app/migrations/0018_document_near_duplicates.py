@@ -0,0 +1,49 @@
+# Generated by Django 4.2.21 on 2026-10-18 19:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document_processor_app', '0017_documentpage_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='near_duplicates', to='document_processor_app.document'),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='duplicate_similarity',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='DocumentSignature',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('minhash', models.BinaryField()),
+                ('shingle_count', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='signature', to='document_processor_app.document')),
+            ],
+            options={
+                'db_table': 'DocumentSignature',
+            },
+        ),
+        migrations.CreateModel(
+            name='DocumentSignatureBand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.BigIntegerField()),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='signature_bands', to='document_processor_app.document')),
+            ],
+            options={
+                'db_table': 'DocumentSignatureBand',
+                'indexes': [models.Index(fields=['bucket'], name='signature_band_bucket_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.21 on 2026-10-18 20:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document_processor_app', '0018_document_near_duplicates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='page_cache_hits',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='page_cache_misses',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='CachedPage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('text', models.TextField()),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'CachedPage',
+                'indexes': [models.Index(fields=['last_used_at'], name='cached_page_last_used_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.21 on 2026-10-18 23:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document_processor_app', '0019_cachedpage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='claim_token',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
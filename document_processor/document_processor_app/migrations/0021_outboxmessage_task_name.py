@@ -0,0 +1,18 @@
+# Generated by Django 4.2.21 on 2026-10-18 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document_processor_app', '0020_document_claim_token'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxmessage',
+            name='task_name',
+            field=models.CharField(default='document_processor_app.tasks.process_document', max_length=255),
+        ),
+    ]
@@ -1,30 +1,65 @@
+import uuid
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import Q
 
 class Document(models.Model):
     # Define status choices as constants
     STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_RETRYING = 'retrying'
     STATUS_COMPLETED = 'completed'
-    STATUS_FAILED = 'failed'
+    STATUS_FAILED_TRANSIENT = 'failed_transient'  # Gave up retrying, may succeed later
+    STATUS_FAILED_PERMANENT = 'failed_permanent'  # Corrupt, encrypted or unparseable
     
     STATUS_CHOICES = [
         (STATUS_PENDING, 'Pending'),
+        (STATUS_PROCESSING, 'Processing'),
+        (STATUS_RETRYING, 'Retrying'),
         (STATUS_COMPLETED, 'Completed'),
-        (STATUS_FAILED, 'Failed'),
+        (STATUS_FAILED_TRANSIENT, 'Failed (transient)'),
+        (STATUS_FAILED_PERMANENT, 'Failed (permanent)'),
     ]
+    FAILED_STATUSES = [STATUS_FAILED_TRANSIENT, STATUS_FAILED_PERMANENT]
+    # A worker may take the document over from these states
+    CLAIMABLE_STATUSES = [STATUS_PENDING, STATUS_RETRYING, STATUS_FAILED_TRANSIENT]
     
     file_name = models.CharField(max_length=255)
-    file_content = models.BinaryField()
     content_hash = models.CharField(max_length=64, unique=True)  # SHA-256 = 64 chars
+    storage_ref = models.CharField(max_length=512, blank=True, default='')
+    extraction_engine = models.CharField(max_length=20, blank=True, default='')
     status = models.CharField(
         max_length=20, 
         choices=STATUS_CHOICES,
         default=STATUS_PENDING
     )
+    failure_reason = models.TextField(blank=True, default='')
+    task_id = models.CharField(max_length=255, blank=True, default='')  # Task currently processing the document
+    # Set anew by every execution that claims the document; only its holder may write the results
+    claim_token = models.CharField(max_length=32, blank=True, default='')
+    # Earlier document with near-identical text, see near_duplicates.py
+    duplicate_of = models.ForeignKey(
+        'self', on_delete=models.SET_NULL, null=True, blank=True, related_name='near_duplicates'
+    )
+    duplicate_similarity = models.FloatField(null=True, blank=True)
+    # Pages served from the page cache instead of being extracted, see page_cache.py
+    page_cache_hits = models.PositiveIntegerField(default=0)
+    page_cache_misses = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'Document'
+        indexes = [
+            # Keyset pagination and its filters, see pagination.py
+            models.Index(fields=['created_at', 'id'], name='document_created_id_idx'),
+            models.Index(fields=['status', 'created_at', 'id'], name='document_status_created_idx'),
+            models.Index(fields=['file_name'], name='document_file_name_prefix_idx',
+                          opclasses=['varchar_pattern_ops']),
+            # Task status lookups, see TaskStatus
+            models.Index(fields=['task_id'], name='document_task_id_idx'),
+        ]
     
     def get_status_display(self):
         """Override the default get_status_display to ensure it works in all contexts"""
@@ -32,10 +67,246 @@ class Document(models.Model):
 
 class ProcessedDocument(models.Model):
     document = models.OneToOneField(Document, on_delete=models.CASCADE)
-    markdown_content = models.TextField()
-    embeddings = models.JSONField(null=True)
+    markdown_content = models.TextField(null=True)  # Legacy, new output is stored per page
+    embedded_at = models.DateTimeField(null=True, blank=True)  # Set once its DocumentChunk rows exist
+    embedder = models.CharField(max_length=255, blank=True, default='')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'ProcessedDocument'
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='processed_created_id_idx'),
+            # Documents still waiting for embeddings, see embeddings.embed_pending_documents
+            models.Index(fields=['id'], condition=Q(embedded_at__isnull=True), name='processed_embed_pending_idx'),
+        ]
+
+    def get_markdown_content(self):
+        """Assemble the document markdown from its pages, only when asked for"""
+        if self.markdown_content is not None:
+            return self.markdown_content
+        pages = DocumentPage.objects.filter(document_id=self.document_id).order_by('page_number')
+        return ''.join(pages.values_list('content', flat=True).iterator())
+
+
+class DocumentPage(models.Model):
+    """Markdown output of a single page, written as extraction progresses"""
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='pages')
+    page_number = models.PositiveIntegerField()
+    char_offset = models.PositiveBigIntegerField(null=True)  # Offset of the page in the assembled markdown
+    page_hash = models.CharField(max_length=64)  # SHA-256 of content
+    content = models.TextField()
+    # to_tsvector of content, set by a database trigger on every write (migration 0017)
+    search_vector = SearchVectorField(null=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'DocumentPage'
+        constraints = [
+            models.UniqueConstraint(fields=['document', 'page_number'], name='unique_document_page'),
+        ]
+        indexes = [
+            GinIndex(fields=['search_vector'], name='page_search_vector_idx'),
+        ]
+
+class DocumentChunk(models.Model):
+    """
+    A token-bounded chunk of a document and its embedding, stored as packed
+    little-endian float32 bytes (see embeddings.pack_vector).
+    """
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='chunks')
+    chunk_index = models.PositiveIntegerField()
+    first_page = models.PositiveIntegerField()
+    last_page = models.PositiveIntegerField()
+    content = models.TextField()
+    token_count = models.PositiveIntegerField()
+    embedder = models.CharField(max_length=255)
+    dimensions = models.PositiveSmallIntegerField()
+    vector = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'DocumentChunk'
+        constraints = [
+            models.UniqueConstraint(fields=['document', 'chunk_index'], name='unique_document_chunk'),
+        ]
+
+
+class DocumentSignature(models.Model):
+    """MinHash signature of a document's extracted text, one little-endian uint32 per permutation"""
+    document = models.OneToOneField(Document, on_delete=models.CASCADE, related_name='signature')
+    minhash = models.BinaryField()
+    shingle_count = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'DocumentSignature'
+
+
+class DocumentSignatureBand(models.Model):
+    """An LSH band of a signature; documents sharing a bucket are near-duplicate candidates"""
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='signature_bands')
+    bucket = models.BigIntegerField()  # Hash of the band number and its rows
+
+    class Meta:
+        db_table = 'DocumentSignatureBand'
+        indexes = [
+            models.Index(fields=['bucket'], name='signature_band_bucket_idx'),
+        ]
+
+
+class CachedPage(models.Model):
+    """Extracted text of a page, keyed by the fingerprint of its content (see page_cache.py)"""
+    key = models.CharField(max_length=64, unique=True)
+    text = models.TextField()
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now_add=True)  # Refreshed when read back from Postgres
+
+    class Meta:
+        db_table = 'CachedPage'
+        indexes = [
+            models.Index(fields=['last_used_at'], name='cached_page_last_used_idx'),
+        ]
+
+
+class DocumentPageRange(models.Model):
+    """
+    A slice of a large document extracted by its own subtask. Pages are written
+    to DocumentPage directly; rows are kept until the merge succeeds so only
+    failed ranges need to be retried.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='page_ranges')
+    first_page = models.PositiveIntegerField()
+    last_page = models.PositiveIntegerField()
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default=STATUS_PENDING
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'DocumentPageRange'
+        constraints = [
+            models.UniqueConstraint(fields=['document', 'first_page'], name='unique_document_page_range'),
+        ]
+
+class UploadSession(models.Model):
+    """
+    A resumable upload. Chunks are appended in order to a spool file shared
+    with the workers; the finalized file is handed to the processing pipeline.
+    """
+    STATUS_OPEN = 'open'
+    STATUS_FINALIZING = 'finalizing'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (STATUS_OPEN, 'Open'),
+        (STATUS_FINALIZING, 'Finalizing'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    file_name = models.CharField(max_length=255)
+    engine = models.CharField(max_length=20, blank=True, default='')
+    document_class = models.CharField(max_length=50, blank=True, default='')
+    client_id = models.CharField(max_length=255, blank=True, default='')
+    chunk_size = models.PositiveIntegerField()
+    total_size = models.PositiveBigIntegerField(null=True)
+    received_bytes = models.PositiveBigIntegerField(default=0)
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default=STATUS_OPEN
+    )
+    file_hash = models.CharField(max_length=64, blank=True, default='')
+    task_id = models.CharField(max_length=255, blank=True, default='')
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'UploadSession'
+
+
+class OutboxMessage(models.Model):
+    """
+    A task waiting to be published, usually a document task. Rows are written
+    in the upload's transaction and published by the relay_outbox command.
+    """
+    DOCUMENT_TASK = 'document_processor_app.tasks.process_document'
+
+    task_id = models.CharField(max_length=255, unique=True)
+    task_name = models.CharField(max_length=255, default=DOCUMENT_TASK)
+    content_hash = models.CharField(max_length=64)  # Empty for tasks other than process_document
+    client_id = models.CharField(max_length=255, blank=True, default='')
+    queue = models.CharField(max_length=50)  # Empty to use CELERY_TASK_ROUTES
+    task_args = models.JSONField()
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'OutboxMessage'
+        indexes = [
+            # Only unsent rows are scanned by the relay, keep that index small
+            models.Index(fields=['id'], condition=Q(sent_at__isnull=True), name='outbox_pending_idx'),
+            models.Index(fields=['sent_at'], name='outbox_sent_at_idx'),
+        ]
+
+
+class DeadLetter(models.Model):
+    """
+    A document whose processing failed for good, with what is needed to find
+    and replay it. There is one row per content hash; failing again after a
+    replay updates the row and extends its attempt history.
+    """
+    STATUS_DEAD = 'dead'
+    STATUS_REPLAYED = 'replayed'
+
+    STATUS_CHOICES = [
+        (STATUS_DEAD, 'Dead'),
+        (STATUS_REPLAYED, 'Replayed'),
+    ]
+
+    document = models.ForeignKey(Document, null=True, on_delete=models.SET_NULL, related_name='dead_letters')
+    content_hash = models.CharField(max_length=64, unique=True)
+    task_id = models.CharField(max_length=255)  # Last task that failed
+    file_name = models.CharField(max_length=255)
+    storage_ref = models.CharField(max_length=512)
+    extraction_engine = models.CharField(max_length=20, blank=True, default='')
+    queue = models.CharField(max_length=50)
+    error_kind = models.CharField(max_length=20)  # permanent or transient, see failures.py
+    error_class = models.CharField(max_length=255)
+    error_message = models.TextField(blank=True, default='')
+    attempts = models.JSONField(default=list)  # One entry per failed attempt, oldest first
+    failure_count = models.PositiveIntegerField(default=1)
+    replay_count = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_DEAD)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    replayed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'DeadLetter'
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='deadletter_created_id_idx'),
+            models.Index(fields=['status', 'error_class', 'id'], name='deadletter_status_class_idx'),
+        ]
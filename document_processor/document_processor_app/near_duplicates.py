@@ -0,0 +1,193 @@
+"""
+Near-duplicate detection with MinHash signatures and LSH banding.
+
+A document's extracted text is reduced to word shingles (MINHASH_SHINGLE_SIZE
+consecutive words); its signature is the minimum of MINHASH_PERMUTATIONS
+universal hashes over the shingle hashes, so the share of equal positions in
+two signatures estimates the Jaccard similarity of their shingle sets.
+
+The signature is cut into MINHASH_BANDS bands and each band is hashed to a
+bucket in DocumentSignatureBand. Documents sharing any bucket are candidates,
+found with one index lookup per batch of documents, and a candidate is a
+near-duplicate when the estimated similarity reaches NEAR_DUPLICATE_THRESHOLD.
+With 16 bands of 8 rows, pairs above ~0.7 similarity are very likely to
+become candidates.
+"""
+import hashlib
+import re
+from collections import deque, namedtuple
+from functools import lru_cache
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .document_processing import strip_page_heading
+from .models import Document, DocumentSignature, DocumentSignatureBand
+
+WORD_RE = re.compile(r'\w+')
+SIGNATURE_DTYPE = np.dtype('<u4')
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64(0xFFFFFFFF)
+HASH_BLOCK_SIZE = 8192  # Shingle hashes permuted at a time, bounds memory for long documents
+# ProcessedDocument.embedder of documents that reuse the chunks of their duplicate_of
+REUSED_EMBEDDER = 'near-duplicate'
+
+Signature = namedtuple('Signature', ['minhash', 'shingle_count', 'buckets'])
+
+
+@lru_cache(maxsize=None)
+def permutations(count):
+    """Coefficients of the universal hashes (a * x + b) mod p, the same in every process"""
+    rng = np.random.default_rng(0x5eed)
+    # With x < 2**32 and a, b < 2**31 the products fit in 64 bits
+    a = rng.integers(1, 1 << 31, count, dtype=np.uint64)
+    b = rng.integers(0, 1 << 31, count, dtype=np.uint64)
+    return a, b
+
+
+def shingle_hash(shingle):
+    return int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=4).digest(), 'little')
+
+
+def iter_shingle_hashes(texts, size):
+    window = deque(maxlen=size)
+    words = 0
+    for text in texts:
+        for word in WORD_RE.findall(strip_page_heading(text).lower()):
+            window.append(word)
+            words += 1
+            if words >= size:
+                yield shingle_hash(' '.join(window))
+    if 0 < words < size:
+        yield shingle_hash(' '.join(window))  # Shorter than one shingle
+
+
+def minhash(texts, count=None, size=None):
+    """Return (signature, shingle_count) for the given texts, read once"""
+    count = count or settings.MINHASH_PERMUTATIONS
+    size = size or settings.MINHASH_SHINGLE_SIZE
+    a, b = permutations(count)
+    signature = np.full(count, MAX_HASH, dtype=np.uint64)
+    shingles = 0
+    block = []
+
+    def update(block):
+        hashes = np.unique(np.array(block, dtype=np.uint64))[:, None]
+        np.minimum(signature, ((hashes * a + b) % MERSENNE_PRIME & MAX_HASH).min(axis=0), out=signature)
+
+    for value in iter_shingle_hashes(texts, size):
+        block.append(value)
+        shingles += 1
+        if len(block) >= HASH_BLOCK_SIZE:
+            update(block)
+            block = []
+    if block:
+        update(block)
+    return signature.astype(SIGNATURE_DTYPE), shingles
+
+
+def band_buckets(signature, bands=None):
+    bands = bands or settings.MINHASH_BANDS
+    rows = len(signature) // bands
+    return [
+        int.from_bytes(hashlib.blake2b(
+            band.to_bytes(2, 'little') + signature[band * rows:(band + 1) * rows].tobytes(), digest_size=8
+        ).digest(), 'little', signed=True)
+        for band in range(bands)
+    ]
+
+
+def similarity(signature, other):
+    """Estimated Jaccard similarity of the shingle sets"""
+    return float(np.mean(signature == other))
+
+
+def compute_signature(texts):
+    """MinHash signature and LSH buckets of the texts; CPU only, nothing is stored"""
+    signature, shingle_count = minhash(texts)
+    return Signature(signature, shingle_count, band_buckets(signature))
+
+
+def find_near_duplicates(signatures):
+    """
+    Match signatures, given as {document_id: Signature}, against completed
+    documents with two queries for the whole batch. Returns
+    {document_id: (duplicate_of_id, similarity)} for the most similar match
+    of each, linked to the original rather than to another copy of it.
+    """
+    # Too little text (e.g. scanned pages without OCR) would match every other such document
+    matchable = {
+        document_id: signature for document_id, signature in signatures.items()
+        if signature.shingle_count >= settings.MINHASH_MIN_SHINGLES
+    }
+    if not matchable:
+        return {}
+    bucket_documents = {}
+    bands = DocumentSignatureBand.objects.filter(
+        bucket__in={bucket for signature in matchable.values() for bucket in signature.buckets}
+    ).exclude(document_id__in=list(signatures)).values_list('bucket', 'document_id')
+    for bucket, document_id in bands:
+        bucket_documents.setdefault(bucket, set()).add(document_id)
+    if not bucket_documents:
+        return {}
+    candidates = {
+        candidate_id: (original_id or candidate_id, np.frombuffer(candidate_minhash, dtype=SIGNATURE_DTYPE))
+        for candidate_id, original_id, candidate_minhash in DocumentSignature.objects.filter(
+            document_id__in=set().union(*bucket_documents.values()), document__status=Document.STATUS_COMPLETED
+        ).values_list('document_id', 'document__duplicate_of_id', 'minhash')
+    }
+
+    duplicates = {}
+    for document_id, signature in matchable.items():
+        best = None
+        candidate_ids = set().union(*(bucket_documents.get(bucket, ()) for bucket in signature.buckets))
+        for candidate_id in candidate_ids & candidates.keys():
+            original_id, candidate_minhash = candidates[candidate_id]
+            score = similarity(signature.minhash, candidate_minhash)
+            if score >= settings.NEAR_DUPLICATE_THRESHOLD and (best is None or score > best[1]):
+                best = (original_id, score)
+        if best:
+            duplicates[document_id] = best
+    return duplicates
+
+
+def save_signatures(signatures):
+    """Store signatures and their LSH buckets, given as {document_id: Signature}, replacing earlier ones"""
+    DocumentSignature.objects.bulk_create(
+        [
+            DocumentSignature(
+                document_id=document_id, minhash=signature.minhash.tobytes(), shingle_count=signature.shingle_count
+            )
+            for document_id, signature in signatures.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['document'],
+        update_fields=['minhash', 'shingle_count']
+    )
+    DocumentSignatureBand.objects.filter(document_id__in=list(signatures)).delete()
+    DocumentSignatureBand.objects.bulk_create([
+        DocumentSignatureBand(document_id=document_id, bucket=bucket)
+        for document_id, signature in signatures.items()
+        if signature.shingle_count >= settings.MINHASH_MIN_SHINGLES
+        for bucket in signature.buckets
+    ])
+
+
+def record_signature(document, texts):
+    """
+    Store the signature and LSH buckets of a document's text and link it to
+    its closest near-duplicate. Returns the id of that document, or None.
+    Buffered documents go through the write buffer's flush instead.
+    """
+    signature = compute_signature(texts)
+    with transaction.atomic():
+        duplicate = find_near_duplicates({document.pk: signature}).get(document.pk)
+        save_signatures({document.pk: signature})
+        duplicate_of_id, duplicate_similarity = duplicate or (None, None)
+        Document.objects.filter(pk=document.pk).update(
+            duplicate_of_id=duplicate_of_id, duplicate_similarity=duplicate_similarity
+        )
+    document.duplicate_of_id = duplicate_of_id
+    document.duplicate_similarity = duplicate_similarity
+    return duplicate_of_id
@@ -0,0 +1,132 @@
+"""
+Transactional outbox for document tasks.
+
+Uploads only insert OutboxMessage rows, in the same transaction as the rest
+of their writes, so a request never waits on the broker. The relay_outbox
+command reads unsent rows in id order, publishes them in batches and marks
+them sent. Rows are locked with SKIP LOCKED, so several relays can run side
+by side without publishing the same row twice. Other tasks a request starts,
+such as finalizing an upload session, go through the outbox too and are
+published straight to the broker.
+
+Only rows the broker, or the fair scheduler, accepted are marked sent; when
+a batch fails part way the rest keep last_error and are retried alone. The
+fair scheduler ignores task ids it has already queued. Only a relay dying
+between handing over a batch and committing it can publish a row twice; the
+repeated message finds its document claimed by the running execution, or
+already completed, and exits without touching it (see tasks.claim_document).
+"""
+import uuid
+
+from celery import current_app
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import fair_scheduling
+from .models import OutboxMessage
+
+
+def add_messages(entries, client_id=None):
+    """Record the tasks of prepared entries, in the caller's transaction if there is one"""
+    OutboxMessage.objects.bulk_create([
+        OutboxMessage(
+            task_id=entry["task_id"],
+            content_hash=entry["hash"],
+            client_id=client_id or '',
+            queue=entry["queue"],
+            task_args=list(entry["task_args"]),
+        )
+        for entry in entries
+    ])
+
+
+def add_task(task_name, args, queue=''):
+    """Record any other task, in the caller's transaction if there is one"""
+    return OutboxMessage.objects.create(
+        task_id=str(uuid.uuid4()), task_name=task_name, content_hash='', queue=queue, task_args=list(args)
+    )
+
+
+def pending_count():
+    """Document tasks not published yet"""
+    return OutboxMessage.objects.filter(sent_at__isnull=True, task_name=OutboxMessage.DOCUMENT_TASK).count()
+
+
+def publish_tasks(messages, on_published):
+    """Publish messages of tasks other than process_document over one broker connection"""
+    if not messages:
+        return  # Most batches hold document tasks only, do not connect for nothing
+    with current_app.producer_or_acquire() as producer:
+        for message in messages:
+            options = {'queue': message.queue} if message.queue else {}
+            current_app.send_task(
+                message.task_name, args=message.task_args, task_id=message.task_id,
+                producer=producer, retry=False, **options
+            )
+            on_published(message.task_id)
+
+
+def deliver(messages):
+    """
+    Hand messages to the fair scheduler, or straight to the broker. Returns
+    (task ids accepted, the error that stopped delivery or None).
+    """
+    # Imported here because utils imports this module
+    from .utils import publish_to_broker
+
+    accepted = set()
+    documents = [message for message in messages if message.task_name == OutboxMessage.DOCUMENT_TASK]
+    try:
+        publish_tasks([message for message in messages if message.task_name != OutboxMessage.DOCUMENT_TASK],
+                      accepted.add)
+        if not settings.FAIR_SCHEDULING_ENABLED:
+            publish_to_broker([
+                {"task_id": message.task_id, "task_args": message.task_args, "queue": message.queue}
+                for message in documents
+            ], on_published=accepted.add)
+            return accepted, None
+
+        entries_by_client = {}
+        for message in documents:
+            entries_by_client.setdefault(message.client_id, []).append({
+                "task_id": message.task_id,
+                "task_args": message.task_args,
+                "queue": message.queue,
+            })
+        for client_id, entries in entries_by_client.items():
+            # A client's entries are queued in one Redis transaction, all or none
+            fair_scheduling.submit(entries, client_id or None)
+            accepted.update(entry["task_id"] for entry in entries)
+    except Exception as e:
+        return accepted, e
+    return accepted, None
+
+
+def relay_batch(batch_size=None):
+    """
+    Publish one batch of unsent messages and mark the accepted ones sent. A
+    failed publish is recorded on the rows it did not reach and re-raised.
+    Returns the number of messages sent.
+    """
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    with transaction.atomic():
+        messages = list(
+            OutboxMessage.objects.select_for_update(skip_locked=True)
+            .filter(sent_at__isnull=True)
+            .order_by('id')[:batch_size]
+        )
+        if not messages:
+            return 0
+        batch = OutboxMessage.objects.filter(pk__in=[message.pk for message in messages])
+        accepted, error = deliver(messages)
+        if accepted:
+            batch.filter(task_id__in=accepted).update(attempts=F('attempts') + 1, sent_at=timezone.now())
+        if error is not None:
+            batch.exclude(task_id__in=accepted).update(
+                attempts=F('attempts') + 1, last_error=f"{error.__class__.__name__}: {error}"
+            )
+    if error is not None:
+        raise error
+    return len(accepted)
@@ -0,0 +1,199 @@
+"""
+Page-level extraction cache.
+
+Identical pages (cover sheets, terms and conditions, signature blocks) recur
+across many PDFs. A page's key is a SHA-256 over what determines its text:
+the decompressed content streams, the form XObjects it draws and, per font,
+its resource name, type, encoding and ToUnicode map, plus the engine name.
+Fingerprinting only reads streams, it does no layout analysis.
+
+Extracted text is kept in the 'pages' cache, a Redis instance with
+allkeys-lru eviction, and in the CachedPage table. Lookups go to Redis first,
+in batches of PAGE_CACHE_LOOKUP_BATCH pages, then to Postgres; pages found
+only in Postgres are copied back into Redis. Cache failures count as misses.
+
+Documents bound for the write buffer defer their CachedPage writes: the rows
+are collected in their stats and written for the whole buffer at flush.
+"""
+import hashlib
+import logging
+import re
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+from django.utils import timezone
+
+from .models import CachedPage
+
+logger = logging.getLogger(__name__)
+
+SUBSET_TAG_RE = re.compile(r'^[A-Z]{6}\+')
+# Bump to invalidate every cached page, e.g. after an engine upgrade
+PAGE_CACHE_VERSION = 1
+
+
+def get_page_cache_backend():
+    return caches['pages']
+
+
+def page_cache_key(key):
+    return f"page:{key}"
+
+
+def deferred_stats():
+    """Stats for a PageCache that leaves its CachedPage writes to write_deferred"""
+    return {'deferred': {'pages': {}, 'used': set()}}
+
+
+def write_deferred(deferred):
+    """Write the CachedPage rows deferred by several documents, with one insert and one update"""
+    pages, used = {}, set()
+    for rows in deferred:
+        pages.update(rows['pages'])
+        used.update(rows['used'])
+    try:
+        if pages:
+            CachedPage.objects.bulk_create(
+                [CachedPage(key=key, text=text) for key, text in pages.items()],
+                ignore_conflicts=True, batch_size=1000
+            )
+        if used:
+            CachedPage.objects.filter(key__in=used).update(last_used_at=timezone.now(), hits=F('hits') + 1)
+    except Exception:
+        logger.warning("Page cache write failed", exc_info=True)
+
+
+def referenced_stream(doc, xref, name):
+    """The bytes of the stream or object the font dictionary key refers to, if any"""
+    kind, value = doc.xref_get_key(xref, name)
+    if kind == 'xref':
+        referenced = int(value.split()[0])
+        return doc.xref_stream(referenced) if doc.xref_is_stream(referenced) else doc.xref_object(referenced).encode()
+    if kind != 'null':
+        return value.encode()
+    return b''
+
+
+def fingerprint_page(doc, page_number, engine_name):
+    page = doc[page_number - 1]
+    digest = hashlib.sha256(f"{PAGE_CACHE_VERSION}:{engine_name}:{page.rotation}".encode())
+    digest.update(page.read_contents())
+    for xref, _, font_type, basefont, name, encoding, *_ in sorted(page.get_fonts(full=True)):
+        to_unicode = referenced_stream(doc, xref, 'ToUnicode')
+        if to_unicode:
+            # Text is decoded through the ToUnicode map, so the random subset tag does not matter
+            basefont = SUBSET_TAG_RE.sub('', basefont)
+        digest.update(f"\0{name}\0{font_type}\0{basefont}\0{encoding}\0".encode())
+        digest.update(hashlib.sha256(to_unicode).digest())
+        digest.update(hashlib.sha256(referenced_stream(doc, xref, 'Encoding')).digest())
+    for xref, name, *_ in sorted(page.get_xobjects()):
+        digest.update(f"\0{name}\0".encode())
+        digest.update(hashlib.sha256(doc.xref_stream(xref) or b'').digest())
+    return digest.hexdigest()
+
+
+class PageCache:
+    """
+    Cached page text for one document. Call get before extracting a page and
+    put after; hits and misses are counted in stats. With deferred_stats()
+    the CachedPage writes are collected in stats['deferred'] instead.
+    """
+
+    def __init__(self, doc, engine_name, stats=None):
+        self.doc = doc
+        self.engine_name = engine_name
+        self.stats = stats if stats is not None else {}
+        self.stats.setdefault('hits', 0)
+        self.stats.setdefault('misses', 0)
+        self.deferred = self.stats.get('deferred')
+        self.keys = {}  # page_number -> key, for the pages looked up last
+        self.prefetched_to = 0
+        self.found = {}  # key -> text
+        self.pending = {}  # key -> text, written by flush
+
+    def prefetch(self, first_page, last_page):
+        keys = {}
+        for page_number in range(first_page, last_page + 1):
+            try:
+                keys[page_number] = fingerprint_page(self.doc, page_number, self.engine_name)
+            except Exception:
+                logger.warning(f"Could not fingerprint page {page_number}, extracting it uncached", exc_info=True)
+        self.keys = keys
+        self.found = {}
+        if not keys:
+            return
+
+        cache_keys = {page_cache_key(key): key for key in keys.values()}
+        try:
+            found = get_page_cache_backend().get_many(list(cache_keys))
+            self.found = {cache_keys[cache_key]: text for cache_key, text in found.items()}
+        except Exception:
+            logger.warning("Page cache lookup failed", exc_info=True)
+
+        missing = set(cache_keys.values()) - set(self.found)
+        if not missing:
+            return
+        try:
+            from_database = dict(CachedPage.objects.filter(key__in=missing).values_list('key', 'text'))
+        except Exception:
+            logger.warning("Page cache lookup failed", exc_info=True)
+            return
+        if not from_database:
+            return
+        self.found.update(from_database)
+        if self.deferred is not None:
+            self.deferred['used'].update(from_database)
+        else:
+            try:
+                CachedPage.objects.filter(key__in=list(from_database)).update(
+                    last_used_at=timezone.now(), hits=F('hits') + 1
+                )
+            except Exception:
+                logger.warning("Page cache write failed", exc_info=True)
+        self.set_many(from_database)
+
+    def get(self, page_number, last_page):
+        """Cached text of the page, or None. Looks up the next batch of pages on demand."""
+        if page_number > self.prefetched_to:
+            self.flush()
+            self.prefetched_to = min(last_page, page_number + settings.PAGE_CACHE_LOOKUP_BATCH - 1)
+            self.prefetch(page_number, self.prefetched_to)
+        key = self.keys.get(page_number)
+        if key is not None and key in self.found:
+            self.stats['hits'] += 1
+            return self.found[key]
+        self.stats['misses'] += 1
+        return None
+
+    def put(self, page_number, text):
+        key = self.keys.get(page_number)
+        text = text or ''
+        if key is not None and len(text) <= settings.PAGE_CACHE_MAX_TEXT_SIZE:
+            self.pending[key] = text
+            self.found[key] = text  # Repeats later in the batch hit too
+
+    def set_many(self, pages):
+        try:
+            get_page_cache_backend().set_many(
+                {page_cache_key(key): text for key, text in pages.items()}, timeout=settings.PAGE_CACHE_TTL
+            )
+        except Exception:
+            logger.warning("Page cache write failed", exc_info=True)
+
+    def flush(self):
+        pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        if self.deferred is not None:
+            self.deferred['pages'].update(pending)
+            self.set_many(pending)
+            return
+        try:
+            CachedPage.objects.bulk_create(
+                [CachedPage(key=key, text=text) for key, text in pending.items()],
+                ignore_conflicts=True
+            )
+        except Exception:
+            logger.warning("Page cache write failed", exc_info=True)
+        self.set_many(pending)
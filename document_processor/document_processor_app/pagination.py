@@ -0,0 +1,127 @@
+"""
+Keyset (cursor) pagination on (created_at, id), or on (rank, id) for search
+results.
+
+Each page is fetched with an index range scan that starts right after the last
+row of the previous page, so the cost of a page does not depend on how deep
+into the table it is.
+"""
+import base64
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+
+
+def encode_cursor(created_at, pk):
+    payload = json.dumps({'c': created_at.isoformat(), 'i': pk})
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        created_at = parse_datetime(payload['c'])
+        pk = int(payload['i'])
+    except (ValueError, KeyError, TypeError):
+        raise ValidationError({'cursor': 'Invalid cursor'})
+    if created_at is None:
+        raise ValidationError({'cursor': 'Invalid cursor'})
+    return created_at, pk
+
+
+def get_page_size(request):
+    try:
+        page_size = int(request.query_params.get('limit', settings.KEYSET_PAGE_SIZE))
+    except ValueError:
+        raise ValidationError({'limit': 'limit must be an integer'})
+    return max(1, min(page_size, settings.KEYSET_MAX_PAGE_SIZE))
+
+
+def parse_date_param(request, name):
+    """Accept either a date or a datetime in ISO format"""
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = parse_datetime(value) or parse_date(value)
+    except ValueError:
+        parsed = None  # Well formed but impossible, e.g. 2024-02-30
+    if parsed is None:
+        raise ValidationError({name: 'Expected an ISO date or datetime'})
+    return parsed
+
+
+def filter_created_range(queryset, request, field='created_at'):
+    created_after = parse_date_param(request, 'created_after')
+    created_before = parse_date_param(request, 'created_before')
+    if created_after:
+        queryset = queryset.filter(**{f'{field}__gte': created_after})
+    if created_before:
+        queryset = queryset.filter(**{f'{field}__lt': created_before})
+    return queryset
+
+
+def paginate_keyset(queryset, request, ascending=False):
+    """
+    Return (rows, next_cursor) for the page after ?cursor=, ordered by
+    (created_at, id). next_cursor is None on the last page.
+    """
+    page_size = get_page_size(request)
+    cursor = request.query_params.get('cursor')
+
+    if ascending:
+        queryset = queryset.order_by('created_at', 'id')
+    else:
+        queryset = queryset.order_by('-created_at', '-id')
+
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        if ascending:
+            queryset = queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+        else:
+            queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+    # Fetch one extra row to know whether another page exists
+    rows = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].pk)
+    return rows, next_cursor
+
+
+def encode_rank_cursor(rank, pk):
+    payload = json.dumps({'r': rank, 'i': pk})
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def decode_rank_cursor(cursor):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return float(payload['r']), int(payload['i'])
+    except (ValueError, KeyError, TypeError):
+        raise ValidationError({'cursor': 'Invalid cursor'})
+
+
+def paginate_ranked(queryset, request):
+    """
+    Return (rows, next_cursor) for the page after ?cursor= of a queryset
+    annotated with a double precision rank, best ranked first.
+    """
+    page_size = get_page_size(request)
+    cursor = request.query_params.get('cursor')
+
+    queryset = queryset.order_by('-rank', '-id')
+    if cursor:
+        rank, pk = decode_rank_cursor(cursor)
+        queryset = queryset.filter(Q(rank__lt=rank) | Q(rank=rank, id__lt=pk))
+
+    rows = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_rank_cursor(rows[-1].rank, rows[-1].pk)
+    return rows, next_cursor
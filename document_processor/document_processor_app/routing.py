@@ -0,0 +1,34 @@
+"""
+Route document tasks to size classed queues so small documents never wait
+behind large ones. Each queue has its own worker pool and time limits.
+"""
+from django.conf import settings
+
+
+def select_queue(page_count, file_size):
+    """
+    Pick the first queue whose limits fit the document. The page count is
+    preferred; the file size is used when the page count could not be read.
+    """
+    for queue, options in settings.DOCUMENT_QUEUES.items():
+        if page_count is not None:
+            if page_count <= options['max_pages']:
+                return queue
+        elif file_size <= options['max_bytes']:
+            return queue
+    return list(settings.DOCUMENT_QUEUES)[-1]
+
+
+def fallback_queue():
+    """The queue with the highest limits, for documents of unknown size"""
+    return list(settings.DOCUMENT_QUEUES)[-1]
+
+
+def get_queue_options(queue):
+    """apply_async options for a document queue"""
+    options = settings.DOCUMENT_QUEUES[queue]
+    return {
+        'queue': queue,
+        'time_limit': options['time_limit'],
+        'soft_time_limit': options['soft_time_limit'],
+    }
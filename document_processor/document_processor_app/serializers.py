@@ -1,25 +1,197 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import Document, ProcessedDocument
-from document_processor_app.utils import enqueue_document
+from .models import DeadLetter, Document, DocumentChunk, DocumentPage, ProcessedDocument, UploadSession
+from document_processor_app.utils import enqueue_document, enqueue_documents
+from .archives import iter_archive_members, iter_member_names
+from .upload_sessions import next_chunk_index
+from .extraction_engines import ENGINE_CHOICES
+from .failures import ERROR_PERMANENT, ERROR_TRANSIENT
+from .vector_index import SEARCH_MODES
 
 class DocumentSerializer(serializers.ModelSerializer):
     status = serializers.CharField(source='get_status_display', read_only=True)
+    page_cache_hit_ratio = serializers.SerializerMethodField()
 
     class Meta:
         model = Document
-        fields = '__all__'
+        # Original bytes are served by the download endpoint, never inlined here.
+        # The views load only these columns.
+        model_fields = [
+            'id', 'file_name', 'content_hash', 'status', 'failure_reason', 'extraction_engine',
+            'duplicate_of', 'duplicate_similarity', 'page_cache_hits', 'page_cache_misses',
+            'created_at', 'updated_at'
+        ]
+        fields = model_fields + ['page_cache_hit_ratio']
+        read_only_fields = [
+            'content_hash', 'extraction_engine', 'duplicate_of', 'duplicate_similarity',
+            'page_cache_hits', 'page_cache_misses'
+        ]
+
+    def get_page_cache_hit_ratio(self, obj):
+        pages = obj.page_cache_hits + obj.page_cache_misses
+        return round(obj.page_cache_hits / pages, 4) if pages else None
 
 
 class DocumentUploadSerializer(serializers.Serializer):
     file = serializers.FileField()
+    engine = serializers.ChoiceField(choices=ENGINE_CHOICES, required=False)
+    document_class = serializers.CharField(max_length=50, required=False)
 
     def create(self, validated_data):
         uploaded_file = validated_data['file']
-        result = enqueue_document(uploaded_file)
+        result = enqueue_document(
+            uploaded_file,
+            engine=validated_data.get('engine'),
+            document_class=validated_data.get('document_class'),
+            client_id=validated_data.get('client_id')
+        )
         return result  # Returns dict with hash and task_id
     
 
+class BulkDocumentUploadSerializer(serializers.Serializer):
+    """Accepts several 'files' parts or a single ZIP/TAR 'archive'"""
+    files = serializers.ListField(child=serializers.FileField(), required=False, allow_empty=False)
+    archive = serializers.FileField(required=False)
+    engine = serializers.ChoiceField(choices=ENGINE_CHOICES, required=False)
+    document_class = serializers.CharField(max_length=50, required=False)
+
+    def validate(self, attrs):
+        if bool(attrs.get('files')) == bool(attrs.get('archive')):
+            raise serializers.ValidationError('Provide either files or an archive')
+        return attrs
+
+    def document_count(self):
+        """Documents the upload can enqueue, counted before anything is read"""
+        if self.validated_data.get('archive'):
+            names = iter_member_names(self.validated_data['archive'])
+        else:
+            names = (file.name for file in self.validated_data['files'])
+        pdfs = sum(1 for name in names if name.lower().endswith('.pdf'))
+        return min(pdfs, settings.BULK_UPLOAD_MAX_FILES)
+
+    def create(self, validated_data):
+        if validated_data.get('archive'):
+            members = iter_archive_members(validated_data['archive'])
+        else:
+            members = ((file.name, file.size, file) for file in validated_data['files'])
+        return enqueue_documents(
+            members,
+            engine=validated_data.get('engine'),
+            document_class=validated_data.get('document_class'),
+            client_id=validated_data.get('client_id')
+        )
+
+
 class ProcessedDocumentSerializer(serializers.ModelSerializer):
+    markdown_content = serializers.CharField(source='get_markdown_content', read_only=True)
+
+    class Meta:
+        model = ProcessedDocument
+        fields = '__all__'
+
+
+class ProcessedDocumentListSerializer(serializers.ModelSerializer):
+    """List projection without the markdown, which is assembled only in detail views"""
+
     class Meta:
         model = ProcessedDocument
-        fields = '__all__'
\ No newline at end of file
+        exclude = ['markdown_content']
+
+
+class DocumentPageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DocumentPage
+        fields = ['page_number', 'char_offset', 'page_hash', 'content']
+
+
+class DocumentHashCheckSerializer(serializers.Serializer):
+    hashes = serializers.ListField(
+        child=serializers.RegexField(r'^[0-9a-f]{64}$', error_messages={'invalid': 'Expected a lowercase SHA-256 hex digest'}),
+        allow_empty=False,
+        max_length=settings.HASH_CHECK_MAX_BATCH
+    )
+
+
+class UploadSessionCreateSerializer(serializers.Serializer):
+    file_name = serializers.CharField(max_length=255)
+    total_size = serializers.IntegerField(min_value=1, required=False)
+    chunk_size = serializers.IntegerField(
+        min_value=settings.UPLOAD_SESSION_MIN_CHUNK_SIZE,
+        max_value=settings.UPLOAD_SESSION_MAX_CHUNK_SIZE,
+        default=settings.UPLOAD_SESSION_CHUNK_SIZE
+    )
+    engine = serializers.ChoiceField(choices=ENGINE_CHOICES, required=False)
+    document_class = serializers.CharField(max_length=50, required=False)
+
+    def create(self, validated_data):
+        return UploadSession.objects.create(**validated_data)
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    next_chunk = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadSession
+        fields = [
+            'id', 'file_name', 'status', 'chunk_size', 'total_size', 'received_bytes',
+            'next_chunk', 'file_hash', 'task_id', 'error', 'created_at', 'updated_at'
+        ]
+
+    def get_next_chunk(self, obj):
+        return next_chunk_index(obj)
+
+
+class DeadLetterSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DeadLetter
+        fields = [
+            'id', 'document', 'content_hash', 'task_id', 'file_name', 'queue', 'error_kind',
+            'error_class', 'error_message', 'attempts', 'failure_count', 'replay_count',
+            'status', 'created_at', 'updated_at', 'replayed_at'
+        ]
+
+
+class DeadLetterReplaySerializer(serializers.Serializer):
+    """Replay the dead letters matching the filters, or the listed ids"""
+    error_class = serializers.CharField(max_length=255, required=False)
+    error_kind = serializers.ChoiceField(choices=[ERROR_PERMANENT, ERROR_TRANSIENT], required=False)
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, allow_empty=False)
+    limit = serializers.IntegerField(min_value=1, required=False)
+
+
+class SemanticSearchSerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=2000)
+    k = serializers.IntegerField(min_value=1, max_value=settings.SEMANTIC_SEARCH_MAX_K, default=10)
+    mode = serializers.ChoiceField(choices=SEARCH_MODES, default='auto')
+    nprobe = serializers.IntegerField(min_value=1, required=False)
+
+
+class SemanticSearchResultSerializer(serializers.ModelSerializer):
+    file_name = serializers.CharField(source='document.file_name')
+    score = serializers.SerializerMethodField()
+
+    class Meta:
+        model = DocumentChunk
+        fields = ['id', 'document', 'file_name', 'chunk_index', 'first_page', 'last_page', 'content', 'score']
+
+    def get_score(self, obj):
+        return self.context['scores'][obj.id]
+
+
+class FullTextSearchSerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=1000)
+    document = serializers.IntegerField(min_value=1, required=False)
+
+
+class FullTextSearchResultSerializer(serializers.ModelSerializer):
+    """A matching page; fetch it with /processed_documents/<processed_document>/pages/?from=<page_number>"""
+    file_name = serializers.CharField(source='document.file_name')
+    # None while the document is still being extracted
+    processed_document = serializers.IntegerField(source='processed_document_id', allow_null=True)
+    rank = serializers.FloatField()
+    headline = serializers.CharField()
+
+    class Meta:
+        model = DocumentPage
+        fields = ['id', 'document', 'processed_document', 'file_name', 'page_number', 'char_offset',
+                  'rank', 'headline']
@@ -0,0 +1,173 @@
+"""
+Content-addressed blob storage for original document bytes.
+
+Blobs are keyed by the SHA-256 of their content, so storing the same file twice
+is a no-op. Celery tasks receive only the hash and a storage reference (a
+claim check) instead of the file bytes.
+"""
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from functools import lru_cache
+
+from django.conf import settings
+
+
+def blob_key(file_hash):
+    # Fan out into sub-directories so no single directory grows unbounded
+    return f"{file_hash[:2]}/{file_hash[2:4]}/{file_hash}"
+
+
+class BlobStore:
+    """Interface implemented by every blob storage backend."""
+    scheme = None
+
+    def put_file(self, file_hash, path):
+        """Move the file at path into the store and return its storage reference"""
+        raise NotImplementedError
+
+    def exists(self, file_hash):
+        raise NotImplementedError
+
+    def open(self, storage_ref):
+        """Return a readable binary file object for the blob"""
+        raise NotImplementedError
+
+    @contextmanager
+    def local_path(self, storage_ref):
+        """Yield a local filesystem path holding the blob content"""
+        raise NotImplementedError
+
+    def delete(self, storage_ref):
+        raise NotImplementedError
+
+    def make_ref(self, key):
+        return f"{self.scheme}://{key}"
+
+    def parse_ref(self, storage_ref):
+        scheme, _, key = storage_ref.partition('://')
+        if scheme != self.scheme:
+            raise ValueError(f"Storage reference {storage_ref!r} does not belong to the {self.scheme} backend")
+        return key
+
+
+class LocalBlobStore(BlobStore):
+    scheme = 'local'
+
+    def __init__(self, root):
+        self.root = str(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def put_file(self, file_hash, path):
+        key = blob_key(file_hash)
+        target = self._path(key)
+        if os.path.exists(target):
+            os.remove(path)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(path, target)  # A rename when on the same filesystem
+        return self.make_ref(key)
+
+    def exists(self, file_hash):
+        return os.path.exists(self._path(blob_key(file_hash)))
+
+    def open(self, storage_ref):
+        return open(self._path(self.parse_ref(storage_ref)), 'rb')
+
+    @contextmanager
+    def local_path(self, storage_ref):
+        yield self._path(self.parse_ref(storage_ref))
+
+    def delete(self, storage_ref):
+        try:
+            os.remove(self._path(self.parse_ref(storage_ref)))
+        except FileNotFoundError:
+            pass
+
+
+class S3BlobStore(BlobStore):
+    """
+    S3-compatible backend. Point endpoint_url at MinIO (or any other S3
+    stand-in) for local development.
+    """
+    scheme = 's3'
+
+    def __init__(self, bucket, endpoint_url=None, access_key=None, secret_key=None, region=None):
+        import boto3  # Optional dependency, only needed for this backend
+
+        self.bucket = bucket
+        self.client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            region_name=region,
+        )
+
+    def make_ref(self, key):
+        return f"{self.scheme}://{self.bucket}/{key}"
+
+    def parse_ref(self, storage_ref):
+        bucket_and_key = super().parse_ref(storage_ref)
+        bucket, _, key = bucket_and_key.partition('/')
+        if bucket != self.bucket:
+            raise ValueError(f"Storage reference {storage_ref!r} does not belong to bucket {self.bucket}")
+        return key
+
+    def exists(self, file_hash):
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=blob_key(file_hash))
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def put_file(self, file_hash, path):
+        key = blob_key(file_hash)
+        if not self.exists(file_hash):
+            # upload_file streams the file in parts, it is never loaded whole
+            self.client.upload_file(path, self.bucket, key)
+        os.remove(path)
+        return self.make_ref(key)
+
+    def open(self, storage_ref):
+        response = self.client.get_object(Bucket=self.bucket, Key=self.parse_ref(storage_ref))
+        return response['Body']
+
+    @contextmanager
+    def local_path(self, storage_ref):
+        # PDF parsers need random access, so download to a temporary file first
+        fd, path = tempfile.mkstemp(dir=settings.UPLOAD_SPOOL_DIR, suffix='.pdf')
+        os.close(fd)
+        try:
+            self.client.download_file(self.bucket, self.parse_ref(storage_ref), path)
+            yield path
+        finally:
+            os.remove(path)
+
+    def delete(self, storage_ref):
+        self.client.delete_object(Bucket=self.bucket, Key=self.parse_ref(storage_ref))
+
+
+@lru_cache(maxsize=None)
+def get_blob_store():
+    """Return the configured blob store, created once per process"""
+    backend = settings.BLOB_STORAGE_BACKEND
+    if backend == 'local':
+        return LocalBlobStore(settings.BLOB_STORAGE_ROOT)
+    if backend == 's3':
+        return S3BlobStore(
+            bucket=settings.BLOB_STORAGE_S3_BUCKET,
+            endpoint_url=settings.BLOB_STORAGE_S3_ENDPOINT_URL,
+            access_key=settings.BLOB_STORAGE_S3_ACCESS_KEY,
+            secret_key=settings.BLOB_STORAGE_S3_SECRET_KEY,
+            region=settings.BLOB_STORAGE_S3_REGION,
+        )
+    raise ValueError(f"Unknown blob storage backend: {backend}")
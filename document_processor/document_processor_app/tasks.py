@@ -1,51 +1,718 @@
-from celery import shared_task
-from .models import Document, ProcessedDocument
-from .document_processing import pdf_to_markdown
-from io import BytesIO
+from celery import chord, group, shared_task
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import Length
+from django.utils import timezone
+from datetime import timedelta
+from functools import partial
+import os
+import hashlib
+import uuid
+from .models import (
+    CachedPage, Document, DocumentPage, DocumentPageRange, OutboxMessage, ProcessedDocument, UploadSession
+)
+from .document_processing import get_page_count, iter_markdown_pages
 from .cache_utils import set_document_cache
+from .storage import get_blob_store
+from .write_buffer import get_write_buffer
+from .embeddings import embed_pending_documents, schedule_embedding
+from .routing import fallback_queue, get_queue_options, select_queue
+from .dead_letters import attempt_entry, record_dead_letter, replay_batch
+from . import admission, fair_scheduling, vector_index
+from .failures import (
+    ERROR_PERMANENT, ERROR_TRANSIENT, RESOURCE_LIMIT_ERRORS, classify_error, describe_error, retry_delay
+)
+from .page_cache import deferred_stats
+from .near_duplicates import REUSED_EMBEDDER, compute_signature, record_signature
 
+logger = get_task_logger(__name__)
 
-@shared_task(bind=True, max_retries=3)
-def process_document(self, file_content, file_name, file_hash):
+STALE_REQUEUE_CLIENT_ID = 'stale-requeue'
+
+
+def build_pages(document, pages, char_offset=None):
+    """Turn (page_number, markdown) pairs into unsaved DocumentPage rows"""
+    for page_number, content in pages:
+        yield DocumentPage(
+            document=document,
+            page_number=page_number,
+            char_offset=char_offset,
+            page_hash=hashlib.sha256(content.encode('utf-8')).hexdigest(),
+            content=content
+        )
+        if char_offset is not None:
+            char_offset += len(content)
+
+
+def write_pages(document, pages, char_offset=None):
+    """
+    Persist (page_number, markdown) pairs as they are produced, in small
+    batches, so worker memory is bounded by a batch rather than the document.
+    Pass char_offset=0 when writing a whole document in order; otherwise the
+    offsets are filled in later by assign_char_offsets.
+    """
+    batch = []
+    for page in build_pages(document, pages, char_offset):
+        batch.append(page)
+        if len(batch) >= settings.PAGE_WRITE_BATCH_SIZE:
+            DocumentPage.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        DocumentPage.objects.bulk_create(batch)
+
+
+def assign_char_offsets(document):
+    """Compute page offsets once all pages exist, reading only their lengths"""
+    pages = (
+        DocumentPage.objects.filter(document=document)
+        .order_by('page_number')
+        .annotate(length=Length('content'))
+        .values_list('id', 'length')
+    )
+    char_offset = 0
+    batch = []
+    for page_id, length in pages.iterator():
+        batch.append(DocumentPage(id=page_id, char_offset=char_offset))
+        char_offset += length
+        if len(batch) >= 1000:
+            DocumentPage.objects.bulk_update(batch, ['char_offset'])
+            batch = []
+    if batch:
+        DocumentPage.objects.bulk_update(batch, ['char_offset'])
+
+
+def finish_document_task(task_id):
+    """Free the task's scheduling slot and count it towards the drain rate"""
+    fair_scheduling.release(task_id)
+    admission.record_drained()
+
+
+def claim_document(storage_ref, file_name, file_hash, engine, task_id):
+    """
+    Create the document, or take over one whose earlier attempt did not finish.
+    Returns (document, claimed); claimed is False when the document is done or
+    an execution is processing it. Every claim gets a new claim_token, so a
+    duplicate delivery of the same task cannot take over a running execution:
+    a task only claims its own document again once it is retrying or has made
+    no progress for DOCUMENT_STALE_AFTER. get_or_create absorbs the unique
+    constraint race instead of failing.
+    """
+    claim_token = uuid.uuid4().hex
+    document, created = Document.objects.get_or_create(
+        content_hash=file_hash,
+        defaults={
+            'file_name': file_name,
+            'storage_ref': storage_ref,
+            'extraction_engine': engine or '',
+            'status': Document.STATUS_PROCESSING,
+            'task_id': task_id,
+            'claim_token': claim_token
+        }
+    )
+    if created:
+        return document, True
+    stale_before = timezone.now() - timedelta(seconds=settings.DOCUMENT_STALE_AFTER)
+    claimed = Document.objects.filter(
+        Q(status__in=Document.CLAIMABLE_STATUSES)
+        | Q(status=Document.STATUS_PROCESSING, task_id=task_id, updated_at__lt=stale_before),
+        pk=document.pk
+    ).update(
+        status=Document.STATUS_PROCESSING, task_id=task_id, claim_token=claim_token, failure_reason='',
+        page_cache_hits=0, page_cache_misses=0, updated_at=timezone.now()
+    )
+    if not claimed:
+        return document, False
+    # Drop the output of the interrupted attempt before starting over
+    DocumentPage.objects.filter(document=document).delete()
+    document.page_ranges.all().delete()
+    document.status = Document.STATUS_PROCESSING
+    document.task_id = task_id
+    document.claim_token = claim_token
+    return document, True
+
+
+def holds_claim(document):
+    return Document.objects.filter(pk=document.pk, claim_token=document.claim_token).exists()
+
+
+def complete_claimed_document(document):
+    """Mark the document completed if this execution still holds its claim"""
+    return Document.objects.filter(pk=document.pk, claim_token=document.claim_token).update(
+        status=Document.STATUS_COMPLETED, updated_at=timezone.now()
+    ) > 0
+
+
+def drop_superseded_attempt(document_id, task_id):
+    """
+    Another execution took the document over. Its results stand; this task
+    only frees its scheduling slot, unless that execution is the same task.
+    """
+    holder = Document.objects.filter(pk=document_id).values_list('task_id', flat=True).first()
+    logger.warning(f"Document {document_id} was taken over by task {holder}, dropping this attempt")
+    if holder != task_id:
+        finish_document_task(task_id)
+
+
+def record_page_cache_stats(document_id, cache_stats, pages=''):
+    hits, misses = cache_stats.get('hits', 0), cache_stats.get('misses', 0)
+    if not hits + misses:
+        return
+    # Increments, page ranges of one document report separately
+    Document.objects.filter(pk=document_id).update(
+        page_cache_hits=F('page_cache_hits') + hits, page_cache_misses=F('page_cache_misses') + misses
+    )
+    logger.info(f"Page cache hit {hits}/{hits + misses} pages{pages} of document {document_id}")
+
+
+def mark_document_failed(document_id, status, reason, claim_token=None):
+    if document_id is None:
+        return  # Failed before the row existed
+    documents = Document.objects.filter(pk=document_id)
+    if claim_token:
+        documents = documents.filter(claim_token=claim_token)
     try:
-        # Step 1: Check if document already exists
-        if Document.objects.filter(content_hash=file_hash).exists():
-            set_document_cache(file_hash, "processed")
-            return file_hash
+        documents.update(
+            status=status, failure_reason=reason, updated_at=timezone.now()
+        )
+    except Exception:
+        # The database may be what failed; the stale document sweep requeues it
+        logger.exception(f"Could not record the failure of document {document_id}")
 
-        # Create document instance
-        document = Document.objects.create(
-            file_name=file_name,
-            file_content=file_content,
-            content_hash=file_hash
+
+def send_to_dead_letters(file_hash, task_id, task_args, queue, error_kind, error_class, error_message,
+                         attempts, document_id=None):
+    try:
+        record_dead_letter(
+            file_hash, task_id, task_args, queue, error_kind, error_class, error_message,
+            attempts, document_id=document_id
         )
+    except Exception:
+        logger.exception(f"Could not record the dead letter of {file_hash}")
+
+
+def check_near_duplicate(document, texts):
+    """
+    Record the MinHash signature of the document's text and link it to a
+    near-duplicate. Returns True when it should reuse that document's embeddings.
+    """
+    if not settings.NEAR_DUPLICATE_DETECTION_ENABLED:
+        return False
+    try:
+        duplicate_of_id = record_signature(document, texts)
+    except Exception:
+        # Detection only saves work, it never fails the document
+        logger.exception(f"Near-duplicate detection failed for document {document.pk}")
+        return False
+    if not duplicate_of_id:
+        return False
+    logger.info(
+        f"Document {document.pk} is a near-duplicate of {duplicate_of_id} "
+        f"(similarity {document.duplicate_similarity:.2f})"
+    )
+    return settings.NEAR_DUPLICATE_ACTION == 'reuse'
+
+
+def near_duplicate_signature(document, texts):
+    """Signature of a buffered document; the write buffer stores and matches it when it flushes"""
+    if not settings.NEAR_DUPLICATE_DETECTION_ENABLED:
+        return None
+    try:
+        return compute_signature(texts)
+    except Exception:
+        logger.exception(f"Near-duplicate detection failed for document {document.pk}")
+        return None
+
+
+def iter_page_texts(document):
+    pages = DocumentPage.objects.filter(document=document).order_by('page_number')
+    return pages.values_list('content', flat=True).iterator()
+
+
+def processed_document_defaults(reuse_embeddings):
+    """A document reusing its near-duplicate's embeddings is never chunked and embedded itself"""
+    if reuse_embeddings:
+        return {'markdown_content': None, 'embedded_at': timezone.now(), 'embedder': REUSED_EMBEDDER}
+    return {'markdown_content': None, 'embedded_at': None, 'embedder': ''}
+
+
+def complete_document_task(file_hash, task_id):
+    # Update cache with completed status
+    set_document_cache(file_hash, "processed", task_id)
+    finish_document_task(task_id)
+    schedule_embedding()
+
+
+@shared_task(bind=True, max_retries=settings.DOCUMENT_MAX_RETRIES)
+def process_document(self, storage_ref, file_name, file_hash, engine=None, attempt_history=None):
+    # attempt_history carries the errors of earlier attempts across retries
+    document, claimed = None, False
+    try:
+        # Step 1: Create or claim the document. The original bytes stay in the blob store.
+        document, claimed = claim_document(storage_ref, file_name, file_hash, engine, self.request.id)
+        if not claimed:
+            if document.task_id == self.request.id and document.status == Document.STATUS_PROCESSING:
+                # A repeated delivery; the running execution finishes the task
+                logger.info(f"Document {document.pk} is already being processed by task {self.request.id}")
+                return file_hash
+            if document.status == Document.STATUS_COMPLETED:
+                set_document_cache(file_hash, "processed")
+            elif document.status in Document.FAILED_STATUSES:
+                set_document_cache(file_hash, "failed")
+            finish_document_task(self.request.id)
+            return file_hash
 
-        # Create BytesIO object for PDF processing
-        file_obj = BytesIO(file_content)
-        
         # Extract information and convert to markdown
-        basic_info, markdown_content = pdf_to_markdown(file_obj)
+        with get_blob_store().local_path(storage_ref) as file_path:
+            page_count = get_page_count(file_path)
+            if page_count > settings.PAGE_FANOUT_THRESHOLD:
+                # Large documents are split into page ranges processed in parallel
+                dispatch_page_ranges(document, page_count, self.request.id)
+                return file_hash
+            buffered = page_count <= settings.WRITE_BUFFER_MAX_PAGES
+            # Buffered documents leave their page cache and stats writes to the flush
+            cache_stats = deferred_stats() if buffered else {}
+            markdown_pages = iter_markdown_pages(file_path, engine=engine, cache_stats=cache_stats)
+            if buffered:
+                pages = list(build_pages(document, markdown_pages, char_offset=0))
+            else:
+                write_pages(document, markdown_pages, char_offset=0)
 
-        # Create embeddings
-        embeddings = None  # Implement embedding creation logic here
+        if buffered:
+            # Small documents are written together with others from this worker;
+            # the cache and scheduling slot are updated once they are committed
+            get_write_buffer().add(
+                document, pages,
+                ProcessedDocument(document=document, **processed_document_defaults(False)),
+                on_flushed=partial(complete_document_task, file_hash, self.request.id),
+                signature=near_duplicate_signature(document, (page.content for page in pages)),
+                cache_stats=cache_stats
+            )
+            return file_hash
+
+        record_page_cache_stats(document.pk, cache_stats)
         
-        ProcessedDocument.objects.create(
+        # The document markdown is assembled from its pages on request
+        reuse_embeddings = check_near_duplicate(document, iter_page_texts(document))
+        ProcessedDocument.objects.update_or_create(
             document=document,
-            markdown_content=markdown_content,
-            embeddings=embeddings
+            defaults=processed_document_defaults(reuse_embeddings)
         )
         
-        document.status = 'completed'
-        document.save()
+        if not complete_claimed_document(document):
+            drop_superseded_attempt(document.pk, self.request.id)
+            return file_hash
         
-        # Update cache with completed status
-        set_document_cache(file_hash, "processed", self.request.id)
+        complete_document_task(file_hash, self.request.id)
         return file_hash
     except Exception as e:
-        document = Document.objects.get(content_hash=file_hash)
-        document.status = 'failed'
-        document.save()
-        
-        # Update cache with failed status
+        # Only the execution holding the claim may record a failure on the document
+        claim_token = document.claim_token if claimed else None
+        try:
+            superseded = bool(claim_token) and not holds_claim(document)
+        except Exception:
+            superseded = False  # The database is down; handle the error as ours
+        if superseded:
+            # Likely caused by the other execution replacing this one's pages
+            logger.warning(f"Processing {file_hash} failed after it was taken over: {describe_error(e)}")
+            drop_superseded_attempt(document.pk, self.request.id)
+            return file_hash
+
+        error_kind = classify_error(e)
+        reason = describe_error(e)
+        document_id = document.pk if claimed else None
+        history = list(attempt_history or []) + [
+            attempt_entry(self.request.id, self.request.retries + 1, error_kind, reason)
+        ]
+        if error_kind == ERROR_TRANSIENT and self.request.retries < self.max_retries:
+            countdown = retry_delay(self.request.retries)
+            logger.warning(f"Processing {file_hash} failed transiently, retrying in {countdown:.0f}s: {reason}")
+            mark_document_failed(document_id, Document.STATUS_RETRYING, reason, claim_token)
+            set_document_cache(file_hash, "retrying", self.request.id)
+            raise self.retry(
+                exc=e, countdown=countdown,
+                kwargs=dict(self.request.kwargs or {}, attempt_history=history)
+            )
+
+        logger.exception(f"Processing {file_hash} failed ({error_kind})")
+        if error_kind == ERROR_TRANSIENT:
+            mark_document_failed(document_id, Document.STATUS_FAILED_TRANSIENT, reason, claim_token)
+        else:
+            mark_document_failed(document_id, Document.STATUS_FAILED_PERMANENT, reason, claim_token)
+        queue = (self.request.delivery_info or {}).get('routing_key')
+        if queue not in settings.DOCUMENT_QUEUES or isinstance(e, RESOURCE_LIMIT_ERRORS):
+            queue = fallback_queue()
+        send_to_dead_letters(
+            file_hash, self.request.id, (storage_ref, file_name, file_hash, engine), queue,
+            error_kind, e.__class__.__name__, str(e), history, document_id=document_id
+        )
         set_document_cache(file_hash, "failed", self.request.id)
-        raise self.retry(exc=e, countdown=60)  # Retry after 60 seconds
+        finish_document_task(self.request.id)
+        raise
+
+
+def dispatch_page_ranges(document, page_count, task_id):
+    """Split the document into page ranges and fan them out as a chord"""
+    range_size = settings.PAGE_RANGE_SIZE
+    DocumentPageRange.objects.bulk_create([
+        DocumentPageRange(
+            document=document,
+            first_page=first_page,
+            last_page=min(first_page + range_size - 1, page_count)
+        )
+        for first_page in range(1, page_count + 1, range_size)
+    ], ignore_conflicts=True)
+    page_ranges = document.page_ranges.exclude(status=DocumentPageRange.STATUS_COMPLETED)
+    run_page_ranges(document, page_ranges, task_id)
+
+
+def run_page_ranges(document, page_ranges, task_id, countdown=None):
+    # The ranges bypass the fair dispatcher, so they hold slots of the
+    # parent's client and of their queue until each one finishes
+    subtask_ids = [str(uuid.uuid4()) for _ in page_ranges]
+    fair_scheduling.acquire_subtasks(task_id, subtask_ids, settings.PAGE_RANGE_QUEUE)
+    header = group(
+        extract_page_range.s(page_range.id).set(
+            task_id=subtask_id, countdown=countdown, **get_queue_options(settings.PAGE_RANGE_QUEUE)
+        )
+        for page_range, subtask_id in zip(page_ranges, subtask_ids)
+    )
+    try:
+        chord(header)(merge_page_ranges.s(document.id, task_id, document.claim_token).set(
+            **get_queue_options(settings.PAGE_RANGE_QUEUE)
+        ))
+    except Exception:
+        for subtask_id in subtask_ids:
+            fair_scheduling.release(subtask_id)
+        raise
+
+
+@shared_task(bind=True)
+def extract_page_range(self, page_range_id):
+    """
+    Extract one page range. Failures are recorded on the range instead of being
+    raised, so the chord callback always runs and can retry just this range.
+    """
+    page_range = DocumentPageRange.objects.select_related('document').get(pk=page_range_id)
+    page_range.attempts += 1
+    try:
+        # Drop pages left behind by a previous failed attempt of this range
+        DocumentPage.objects.filter(
+            document_id=page_range.document_id,
+            page_number__range=(page_range.first_page, page_range.last_page)
+        ).delete()
+        cache_stats = {}
+        with get_blob_store().local_path(page_range.document.storage_ref) as file_path:
+            write_pages(page_range.document, iter_markdown_pages(
+                file_path,
+                first_page=page_range.first_page,
+                last_page=page_range.last_page,
+                engine=page_range.document.extraction_engine,
+                cache_stats=cache_stats
+            ))
+        record_page_cache_stats(
+            page_range.document_id, cache_stats, pages=f" {page_range.first_page}-{page_range.last_page}"
+        )
+        page_range.status = DocumentPageRange.STATUS_COMPLETED
+        page_range.error = ''
+    except Exception as e:
+        logger.exception(
+            f"Extraction of pages {page_range.first_page}-{page_range.last_page} "
+            f"of document {page_range.document_id} failed"
+        )
+        page_range.status = DocumentPageRange.STATUS_FAILED
+        page_range.error = describe_error(e)
+        if classify_error(e) == ERROR_PERMANENT:
+            # No point retrying the other ranges either, merge_page_ranges fails the document
+            mark_document_failed(page_range.document_id, Document.STATUS_FAILED_PERMANENT, page_range.error)
+    page_range.save(update_fields=['status', 'error', 'attempts', 'updated_at'])
+    fair_scheduling.release(self.request.id)
+    return {'id': page_range.id, 'status': page_range.status}
+
+
+@shared_task(bind=True)
+def merge_page_ranges(self, results, document_id, task_id, claim_token=None):
+    """Complete the document once every range is extracted, or retry the ranges that failed"""
+    document = Document.objects.get(pk=document_id)
+    if claim_token and document.claim_token != claim_token:
+        drop_superseded_attempt(document_id, task_id)
+        return document.content_hash
+    page_ranges = document.page_ranges.order_by('first_page')
+
+    failed_ranges = [page_range for page_range in page_ranges if page_range.status != DocumentPageRange.STATUS_COMPLETED]
+    if failed_ranges:
+        permanent = document.status == Document.STATUS_FAILED_PERMANENT
+        if not permanent and all(page_range.attempts < settings.PAGE_RANGE_MAX_ATTEMPTS for page_range in failed_ranges):
+            countdown = retry_delay(
+                min(page_range.attempts for page_range in failed_ranges) - 1,
+                base_delay=settings.PAGE_RANGE_RETRY_DELAY
+            )
+            logger.warning(
+                f"Retrying {len(failed_ranges)} failed page ranges of document {document_id} in {countdown:.0f}s"
+            )
+            run_page_ranges(document, failed_ranges, task_id, countdown=countdown)
+            return document.content_hash
+
+        if not permanent:
+            mark_document_failed(document.pk, Document.STATUS_FAILED_TRANSIENT, failed_ranges[0].error)
+        error_class, _, error_message = failed_ranges[0].error.partition(': ')
+        send_to_dead_letters(
+            document.content_hash, task_id,
+            (document.storage_ref, document.file_name, document.content_hash, document.extraction_engine or None),
+            select_queue(max(page_range.last_page for page_range in page_ranges), 0),
+            ERROR_PERMANENT if permanent else ERROR_TRANSIENT, error_class, error_message,
+            [
+                attempt_entry(task_id, page_range.attempts, ERROR_PERMANENT if permanent else ERROR_TRANSIENT,
+                              page_range.error, pages=f"{page_range.first_page}-{page_range.last_page}")
+                for page_range in failed_ranges
+            ],
+            document_id=document.pk
+        )
+        set_document_cache(document.content_hash, "failed", task_id)
+        finish_document_task(task_id)
+        return document.content_hash
+
+    # Pages are already stored, the markdown is assembled from them on request
+    assign_char_offsets(document)
+    reuse_embeddings = check_near_duplicate(document, iter_page_texts(document))
+    ProcessedDocument.objects.update_or_create(
+        document=document,
+        defaults=processed_document_defaults(reuse_embeddings)
+    )
+    document.page_ranges.all().delete()
+
+    if not complete_claimed_document(document):
+        drop_superseded_attempt(document_id, task_id)
+        return document.content_hash
+    complete_document_task(document.content_hash, task_id)
+    return document.content_hash
+
+
+@shared_task(ignore_result=True)
+def dispatch_fair_queue():
+    """Publish waiting document tasks in weighted fair order across clients"""
+    # Imported here because utils imports this module
+    from .utils import publish_to_broker
+
+    return fair_scheduling.dispatch(publish_to_broker)
+
+
+@shared_task(bind=True, max_retries=settings.DOCUMENT_MAX_RETRIES)
+def finalize_upload_session(self, session_id):
+    """
+    Hash the assembled upload in one streaming pass and hand it to the
+    processing pipeline, exactly like a single-request upload. Transient
+    failures are retried; if they persist the session is reopened so the
+    client can finalize it again instead of re-uploading.
+    """
+    # Imported here because utils imports this module
+    from .upload_sessions import UploadSessionError, session_spool_path
+    from .utils import hash_spooled_file, prepare_spooled_document, prepare_stored_document, publish_document_tasks
+
+    session = UploadSession.objects.get(pk=session_id)
+    try:
+        spool_path = session_spool_path(session.pk)
+        if os.path.exists(spool_path):
+            # Kept on the session in case the file is moved and publishing then fails
+            session.file_hash = hash_spooled_file(spool_path)
+            session.save(update_fields=['file_hash', 'updated_at'])
+            entry = prepare_spooled_document(
+                session.file_hash, spool_path, session.file_name,
+                engine=session.engine or None,
+                document_class=session.document_class or None
+            )
+        elif session.file_hash and get_blob_store().exists(session.file_hash):
+            # An earlier attempt moved the file into the blob store before failing
+            entry = prepare_stored_document(
+                session.file_hash, session.file_name, session.received_bytes,
+                engine=session.engine or None,
+                document_class=session.document_class or None
+            )
+        else:
+            raise UploadSessionError("The uploaded file is gone")
+        if not entry["duplicate"]:
+            publish_document_tasks([entry], session.client_id or None)
+    except Exception as e:
+        transient = classify_error(e) == ERROR_TRANSIENT
+        if transient and self.request.retries < self.max_retries:
+            countdown = retry_delay(self.request.retries)
+            logger.warning(f"Finalizing upload session {session_id} failed, retrying in {countdown:.0f}s: {e}")
+            raise self.retry(exc=e, countdown=countdown)
+        logger.exception(f"Finalizing upload session {session_id} failed")
+        session.status = UploadSession.STATUS_OPEN if transient else UploadSession.STATUS_FAILED
+        session.error = describe_error(e)
+        session.save(update_fields=['status', 'error', 'updated_at'])
+        raise
+
+    session.file_hash = entry["hash"]
+    session.task_id = entry["task_id"] or ''
+    session.status = UploadSession.STATUS_COMPLETED
+    session.save(update_fields=['file_hash', 'task_id', 'status', 'updated_at'])
+    return entry["hash"]
+
+
+@shared_task(ignore_result=True)
+def expire_upload_sessions():
+    """Delete abandoned upload sessions and their partial files"""
+    from .upload_sessions import session_files
+
+    now = timezone.now()
+    expired = UploadSession.objects.filter(
+        Q(
+            status__in=[UploadSession.STATUS_OPEN, UploadSession.STATUS_FAILED],
+            updated_at__lt=now - timedelta(seconds=settings.UPLOAD_SESSION_TTL)
+        )
+        # The finalize task was lost, e.g. with its worker
+        | Q(
+            status=UploadSession.STATUS_FINALIZING,
+            updated_at__lt=now - timedelta(seconds=settings.UPLOAD_SESSION_FINALIZE_TIMEOUT)
+        )
+    )
+    expired_ids = list(expired.values_list('id', flat=True)[:1000])
+    for session_id in expired_ids:
+        for path in session_files(session_id):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    UploadSession.objects.filter(pk__in=expired_ids).delete()
+    return len(expired_ids)
+
+
+@shared_task(ignore_result=True)
+def purge_outbox():
+    """Delete outbox messages sent longer than OUTBOX_RETENTION ago"""
+    cutoff = timezone.now() - timedelta(seconds=settings.OUTBOX_RETENTION)
+    sent_ids = list(
+        OutboxMessage.objects.filter(sent_at__lt=cutoff).values_list('id', flat=True)[:10000]
+    )
+    OutboxMessage.objects.filter(pk__in=sent_ids).delete()
+    return len(sent_ids)
+
+
+@shared_task(ignore_result=True)
+def purge_page_cache():
+    """Delete cached pages not read back from Postgres for PAGE_CACHE_RETENTION"""
+    cutoff = timezone.now() - timedelta(seconds=settings.PAGE_CACHE_RETENTION)
+    deleted = 0
+    while True:
+        ids = list(
+            CachedPage.objects.filter(last_used_at__lt=cutoff)
+            .values_list('id', flat=True)[:settings.PAGE_CACHE_PURGE_BATCH_SIZE]
+        )
+        if not ids:
+            break
+        deleted += CachedPage.objects.filter(pk__in=ids).delete()[0]
+    if deleted:
+        logger.info(f"Purged {deleted} cached pages")
+    return deleted
+
+
+@shared_task(ignore_result=True)
+def replay_dead_letters(error_class=None, error_kind=None, ids=None, limit=None, after_id=0):
+    """
+    Replay matching dead letters one batch per run, rescheduling itself so
+    replays are published at no more than DEAD_LETTER_REPLAY_RATE per second.
+    """
+    batch_size = settings.DEAD_LETTER_REPLAY_BATCH_SIZE
+    if limit is not None:
+        batch_size = min(batch_size, limit)
+    replayed, last_id = replay_batch(error_class, error_kind, after_id, batch_size, ids)
+    if last_id is None:
+        return replayed
+    if limit is not None:
+        limit -= replayed
+        if limit <= 0:
+            return replayed
+    replay_dead_letters.apply_async(
+        kwargs={'error_class': error_class, 'error_kind': error_kind, 'ids': ids, 'limit': limit, 'after_id': last_id},
+        countdown=replayed / settings.DEAD_LETTER_REPLAY_RATE
+    )
+    return replayed
+
+
+@shared_task(ignore_result=True)
+def requeue_stale_documents():
+    """
+    Requeue documents left 'processing' or 'retrying' by a worker that died,
+    including buffered documents that were never flushed. Fanned-out documents
+    whose page ranges are still making progress are left alone.
+    """
+    # Imported here because utils imports this module
+    from .utils import publish_document_tasks
+
+    cutoff = timezone.now() - timedelta(seconds=settings.DOCUMENT_STALE_AFTER)
+    with transaction.atomic():
+        stale = list(
+            Document.objects.select_for_update(skip_locked=True)
+            .filter(status__in=[Document.STATUS_PROCESSING, Document.STATUS_RETRYING], updated_at__lt=cutoff)
+            .exclude(page_ranges__updated_at__gte=cutoff)
+            .only('id', 'content_hash', 'file_name', 'storage_ref', 'extraction_engine')
+            .order_by('updated_at')[:settings.STALE_REQUEUE_BATCH_SIZE]
+        )
+        if not stale:
+            return 0
+        entries = [
+            {
+                "hash": document.content_hash,
+                "task_id": str(uuid.uuid4()),
+                "queue": fallback_queue(),
+                "task_args": (
+                    document.storage_ref, document.file_name,
+                    document.content_hash, document.extraction_engine or None
+                ),
+            }
+            for document in stale
+        ]
+        # Pending lets the new task claim the document from the lost one
+        Document.objects.filter(pk__in=[document.pk for document in stale]).update(
+            status=Document.STATUS_PENDING, updated_at=timezone.now()
+        )
+        publish_document_tasks(entries, STALE_REQUEUE_CLIENT_ID)
+
+    logger.warning(f"Requeued {len(stale)} stale documents")
+    for entry in entries:
+        set_document_cache(entry["hash"], "queued", entry["task_id"])
+    return len(stale)
+
+
+@shared_task(ignore_result=True)
+def purge_task_results():
+    """
+    Drain the rows left by the old django-db result backend, a bounded number
+    of small batches per run so the deletes never hold long locks.
+    """
+    from django_celery_results.models import GroupResult, TaskResult
+
+    batch_size = settings.TASK_RESULTS_PURGE_BATCH_SIZE
+    deleted = 0
+    for model in (TaskResult, GroupResult):
+        for _ in range(settings.TASK_RESULTS_PURGE_MAX_BATCHES):
+            ids = list(model.objects.order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            deleted += model.objects.filter(pk__in=ids).delete()[0]
+    if deleted:
+        logger.info(f"Purged {deleted} django-db task results")
+    return deleted
+
+
+@shared_task(ignore_result=True)
+def embed_documents():
+    """Embed documents completed since the last run, EMBEDDING_MAX_DOCUMENTS at a time"""
+    embedded = embed_pending_documents()
+    if embedded >= settings.EMBEDDING_MAX_DOCUMENTS:
+        embed_documents.delay()  # More are waiting
+    elif embedded:
+        update_vector_index.delay()
+    return embedded
+
+
+@shared_task(ignore_result=True)
+def update_vector_index(rebuild=False):
+    """Append newly embedded chunks to the vector index, rebuilding it when stale"""
+    added = vector_index.update_index(rebuild=rebuild)
+    if added:
+        logger.info(f"Added {added} chunks to the vector index")
+    return added
@@ -1,3 +1,508 @@
-from django.test import TestCase
+import base64
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import fakeredis
+import numpy as np
+from celery.exceptions import SoftTimeLimitExceeded
+from django.conf import settings
+from django.core.cache import cache
+from django.db import OperationalError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone as django_timezone
+from rest_framework.exceptions import ValidationError
+
+from . import admission, fair_scheduling, outbox
+from .chunking import Chunk, iter_chunks
+from .document_processing import format_page
+from .failures import ERROR_PERMANENT, ERROR_TRANSIENT, classify_error
+from .models import Document, DocumentPage, OutboxMessage, ProcessedDocument
+from .near_duplicates import SIGNATURE_DTYPE, band_buckets, minhash, similarity
+from .pagination import (
+    decode_cursor, decode_rank_cursor, encode_cursor, encode_rank_cursor, parse_date_param
+)
+from .tasks import (
+    build_pages, claim_document, complete_claimed_document, holds_claim, mark_document_failed,
+    processed_document_defaults
+)
+from .views import admission_rejected_response
+from .write_buffer import WriteBuffer
+
+
+def query(**params):
+    return SimpleNamespace(query_params=params)
+
+
+class CursorTests(SimpleTestCase):
+
+    def test_round_trip(self):
+        created_at = datetime(2024, 5, 17, 8, 30, 15, 123456, tzinfo=timezone.utc)
+        self.assertEqual(decode_cursor(encode_cursor(created_at, 42)), (created_at, 42))
+
+    def test_rank_round_trip(self):
+        rank = 0.060792710632085800
+        self.assertEqual(decode_rank_cursor(encode_rank_cursor(rank, 7)), (rank, 7))
+
+    def test_tampered_cursor_is_rejected(self):
+        cursor = encode_cursor(datetime(2024, 5, 17, tzinfo=timezone.utc), 42)
+        tampered = [
+            cursor[:-4],
+            'not base64!',
+            base64.urlsafe_b64encode(b'{"c": "yesterday", "i": 1}').decode(),
+            base64.urlsafe_b64encode(b'{"c": "2024-05-17T00:00:00+00:00", "i": "x"}').decode(),
+            base64.urlsafe_b64encode(json.dumps({'i': 1}).encode()).decode(),
+            base64.urlsafe_b64encode(b'[1, 2]').decode(),
+        ]
+        for value in tampered:
+            with self.subTest(cursor=value), self.assertRaises(ValidationError):
+                decode_cursor(value)
+
+    def test_tampered_rank_cursor_is_rejected(self):
+        for value in ['', 'garbage', base64.urlsafe_b64encode(b'{"r": "high", "i": 1}').decode()]:
+            with self.subTest(cursor=value), self.assertRaises(ValidationError):
+                decode_rank_cursor(value)
+
+
+class DateParamTests(SimpleTestCase):
+
+    def test_date_and_datetime(self):
+        self.assertEqual(parse_date_param(query(created_after='2024-02-29'), 'created_after').day, 29)
+        self.assertEqual(parse_date_param(query(created_after='2024-02-29T10:00:00Z'), 'created_after').hour, 10)
+        self.assertIsNone(parse_date_param(query(), 'created_after'))
+
+    def test_impossible_date_is_a_validation_error(self):
+        for value in ['2024-02-30', '2023-13-01', '2024-01-01T25:00:00', 'soon']:
+            with self.subTest(value=value), self.assertRaises(ValidationError):
+                parse_date_param(query(created_after=value), 'created_after')
+
+
+class ClaimDocumentTests(TestCase):
+
+    def claim(self, task_id):
+        return claim_document('blob/a', 'a.pdf', 'a' * 64, None, task_id)
+
+    def test_first_claim_creates_the_document(self):
+        document, claimed = self.claim('task-1')
+        self.assertTrue(claimed)
+        self.assertEqual(document.status, Document.STATUS_PROCESSING)
+        self.assertTrue(holds_claim(document))
+
+    def test_repeated_delivery_leaves_the_running_execution_alone(self):
+        running, _ = self.claim('task-1')
+        DocumentPage.objects.create(document=running, page_number=1, page_hash='h', content='page')
+        _, claimed = self.claim('task-1')
+        self.assertFalse(claimed)
+        self.assertTrue(holds_claim(running))
+        self.assertEqual(DocumentPage.objects.filter(document=running).count(), 1)
+
+    def test_retry_takes_over_with_a_new_token(self):
+        failed, _ = self.claim('task-1')
+        mark_document_failed(failed.pk, Document.STATUS_RETRYING, 'OperationalError: gone', failed.claim_token)
+        retry, claimed = self.claim('task-1')
+        self.assertTrue(claimed)
+        self.assertNotEqual(retry.claim_token, failed.claim_token)
+        self.assertFalse(complete_claimed_document(failed))
+        self.assertTrue(complete_claimed_document(retry))
+        self.assertEqual(Document.objects.get(pk=retry.pk).status, Document.STATUS_COMPLETED)
+
+    def test_stale_execution_is_taken_over(self):
+        stale, _ = self.claim('task-1')
+        Document.objects.filter(pk=stale.pk).update(
+            updated_at=django_timezone.now() - timedelta(seconds=settings.DOCUMENT_STALE_AFTER + 1)
+        )
+        _, claimed = self.claim('task-2')
+        self.assertFalse(claimed)  # Other tasks wait for the stale document sweep
+        _, claimed = self.claim('task-1')
+        self.assertTrue(claimed)
+        self.assertFalse(holds_claim(stale))
+
+    def test_superseded_execution_cannot_record_a_failure(self):
+        superseded, _ = self.claim('task-1')
+        Document.objects.filter(pk=superseded.pk).update(status=Document.STATUS_RETRYING)
+        self.claim('task-1')
+        mark_document_failed(superseded.pk, Document.STATUS_FAILED_PERMANENT, 'IntegrityError', superseded.claim_token)
+        self.assertEqual(Document.objects.get(pk=superseded.pk).status, Document.STATUS_PROCESSING)
+
+    def test_finished_documents_are_not_claimed(self):
+        document, _ = self.claim('task-1')
+        for status in [Document.STATUS_COMPLETED, Document.STATUS_FAILED_PERMANENT]:
+            Document.objects.filter(pk=document.pk).update(status=status)
+            with self.subTest(status=status):
+                self.assertFalse(self.claim('task-2')[1])
+
+
+class ChunkingTests(SimpleTestCase):
+
+    def chunks(self, pages, max_tokens=4, overlap=1):
+        return list(iter_chunks(
+            [(page_number, format_page(page_number, text)) for page_number, text in pages],
+            max_tokens=max_tokens, overlap=overlap
+        ))
+
+    def test_boundaries_and_overlap(self):
+        chunks = self.chunks([(1, 'a b c d'), (2, 'e f g h i j k')])
+        self.assertEqual([chunk.text for chunk in chunks], ['a b c d', 'd e f g', 'g h i j', 'j k'])
+        self.assertEqual([chunk.index for chunk in chunks], [0, 1, 2, 3])
+        self.assertEqual([(chunk.first_page, chunk.last_page) for chunk in chunks], [(1, 1), (1, 2), (2, 2), (2, 2)])
+        self.assertEqual([chunk.token_count for chunk in chunks], [4, 4, 4, 2])
+
+    def test_tail_that_is_only_overlap_is_dropped(self):
+        chunks = self.chunks([(1, 'a b c d e f g')])
+        self.assertEqual([chunk.text for chunk in chunks], ['a b c d', 'd e f g'])
+
+    def test_short_document_is_one_chunk(self):
+        self.assertEqual(self.chunks([(3, 'only two')]), [Chunk(0, 3, 3, 'only two', 2)])
+        self.assertEqual(self.chunks([(1, '')]), [])
+
+    def test_overlap_must_be_smaller_than_chunk(self):
+        with self.assertRaises(ValueError):
+            self.chunks([(1, 'a b')], max_tokens=4, overlap=4)
+
+
+class MinHashTests(SimpleTestCase):
+
+    def signature(self, words):
+        signature, _ = minhash([' '.join(words)], count=128, size=5)
+        return signature, band_buckets(signature, bands=16)
+
+    def setUp(self):
+        self.words = [f"word{i}" for i in range(300)]
+
+    def test_identical_text_lands_in_the_same_buckets(self):
+        signature, buckets = self.signature(self.words)
+        # Page headings and case do not change the text
+        other, other_buckets = self.signature(['## Page 1'] + [word.upper() for word in self.words])
+        self.assertEqual(buckets, other_buckets)
+        self.assertEqual(similarity(signature, other), 1.0)
+
+    def test_near_identical_text_shares_buckets(self):
+        signature, buckets = self.signature(self.words)
+        edited = self.words[:150] + ['changed'] + self.words[151:]
+        other, other_buckets = self.signature(edited)
+        self.assertTrue(set(buckets) & set(other_buckets))
+        self.assertGreater(similarity(signature, other), 0.9)
+        self.assertLess(similarity(signature, other), 1.0)
+
+    def test_disjoint_text_shares_no_bucket(self):
+        signature, buckets = self.signature(self.words)
+        other, other_buckets = self.signature([f"other{i}" for i in range(300)])
+        self.assertFalse(set(buckets) & set(other_buckets))
+        self.assertLess(similarity(signature, other), 0.1)
+
+    def test_equal_rows_in_different_bands_do_not_collide(self):
+        self.assertEqual(len(set(band_buckets(np.zeros(128, dtype=SIGNATURE_DTYPE), bands=16))), 16)
+
+
+class ClassifyErrorTests(SimpleTestCase):
+
+    def test_resource_limits_are_permanent(self):
+        # Retrying on the same queue would exhaust memory or time again
+        self.assertEqual(classify_error(MemoryError()), ERROR_PERMANENT)
+        self.assertEqual(classify_error(SoftTimeLimitExceeded()), ERROR_PERMANENT)
+
+    def test_infrastructure_errors_are_transient(self):
+        self.assertEqual(classify_error(OperationalError('server closed the connection')), ERROR_TRANSIENT)
+        self.assertEqual(classify_error(ConnectionResetError()), ERROR_TRANSIENT)
+
+    def test_throttled_storage_is_transient(self):
+        error = Exception('SlowDown')
+        error.response = {'ResponseMetadata': {'HTTPStatusCode': 503}}
+        self.assertEqual(classify_error(error), ERROR_TRANSIENT)
+        error.response = {'ResponseMetadata': {'HTTPStatusCode': 403}}
+        self.assertEqual(classify_error(error), ERROR_PERMANENT)
+
+    def test_parser_errors_are_permanent(self):
+        self.assertEqual(classify_error(ValueError('Invalid PDF header')), ERROR_PERMANENT)
+
+
+@override_settings(
+    FAIR_SCHEDULING_ENABLED=True, FAIR_DEFAULT_WEIGHT=1, FAIR_CLIENT_WEIGHTS={'b': 2},
+    FAIR_DEFAULT_CONCURRENCY=100, FAIR_CLIENT_CONCURRENCY={},
+    FAIR_QUEUE_CAPACITY={'documents_small': 100, 'documents_large': 1}
+)
+class FairSchedulingTests(SimpleTestCase):
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        for patcher in [
+            mock.patch.object(fair_scheduling, 'get_redis', return_value=self.redis),
+            mock.patch.object(fair_scheduling, 'kick'),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def submit(self, client_id, count, queue='documents_small'):
+        fair_scheduling.submit([
+            {'task_id': f"{client_id}-{i}", 'task_args': ['blob/x', 'x.pdf', 'x' * 64, None], 'queue': queue}
+            for i in range(count)
+        ], client_id)
+
+    def dispatch(self, fail_after=None):
+        published = []
+
+        def publish(batch, on_published):
+            for message in batch:
+                if fail_after is not None and len(published) == fail_after:
+                    raise ConnectionError('broker went away')
+                published.append(message['task_id'])
+                on_published(message['task_id'])
+
+        fair_scheduling.dispatch(publish)
+        return published
+
+    def queued(self, client_id):
+        key = fair_scheduling.CLIENT_QUEUE_KEY.format(client_id=client_id)
+        return [json.loads(raw)['task_id'] for raw in self.redis.lrange(key, 0, -1)]
+
+    def in_flight(self, client_id):
+        return self.redis.zcard(fair_scheduling.CLIENT_IN_FLIGHT_KEY.format(client_id=client_id))
+
+    def test_deficit_round_robin_follows_weights(self):
+        self.submit('a', 3)
+        self.submit('b', 3)
+        self.assertEqual(self.dispatch(), ['a-0', 'b-0', 'b-1', 'a-1', 'b-2', 'a-2'])
+        self.assertFalse(self.redis.smembers(fair_scheduling.ACTIVE_CLIENTS_KEY))
+
+    @override_settings(FAIR_CLIENT_CONCURRENCY={'a': 2})
+    def test_client_concurrency_cap(self):
+        self.submit('a', 5)
+        self.assertEqual(self.dispatch(), ['a-0', 'a-1'])
+        self.assertEqual(self.in_flight('a'), 2)
+        fair_scheduling.release('a-0')
+        self.assertEqual(self.dispatch(), ['a-2'])
+        self.assertEqual(self.queued('a'), ['a-3', 'a-4'])
+
+    def test_full_queue_holds_only_the_tasks_bound_for_it(self):
+        self.submit('a', 2, queue='documents_large')
+        self.submit('b', 1)
+        self.assertEqual(self.dispatch(), ['a-0', 'b-0'])
+        self.assertEqual(self.queued('a'), ['a-1'])
+
+    def test_resubmitted_task_is_queued_once(self):
+        self.submit('a', 2)
+        self.submit('a', 2)
+        self.assertEqual(self.queued('a'), ['a-0', 'a-1'])
+
+    def test_failed_publish_pushes_back_only_unpublished_tasks(self):
+        self.submit('a', 3)
+        with self.assertRaises(ConnectionError):
+            self.dispatch(fail_after=1)
+        self.assertEqual(self.queued('a'), ['a-1', 'a-2'])
+        self.assertEqual(self.in_flight('a'), 1)
+        self.assertFalse(self.redis.exists(fair_scheduling.PROCESSING_KEY))
+        self.assertEqual(self.dispatch(), ['a-1', 'a-2'])
+
+    def test_tasks_left_by_a_dead_dispatcher_are_recovered(self):
+        self.submit('a', 3)
+        queue_key = fair_scheduling.CLIENT_QUEUE_KEY.format(client_id='a')
+        for _ in range(2):
+            self.redis.lmove(queue_key, fair_scheduling.PROCESSING_KEY, 'LEFT', 'RIGHT')
+        self.assertEqual(self.dispatch(), ['a-0', 'a-1', 'a-2'])
+        self.assertFalse(self.redis.exists(fair_scheduling.PROCESSING_KEY))
+
+    def test_subtasks_count_against_the_parent_client(self):
+        self.submit('a', 1)
+        self.dispatch()
+        fair_scheduling.acquire_subtasks('a-0', ['range-1', 'range-2'], 'documents_small')
+        self.assertEqual(self.in_flight('a'), 3)
+        fair_scheduling.release('range-1')
+        self.assertEqual(self.in_flight('a'), 2)
+
+
+@override_settings(
+    ADMISSION_CONTROL_ENABLED=True, FAIR_SCHEDULING_ENABLED=True,
+    ADMISSION_MAX_BACKLOG=100, ADMISSION_MAX_CLIENT_BACKLOG=10,
+    ADMISSION_MIN_RETRY_AFTER=5, ADMISSION_MAX_RETRY_AFTER=900, ADMISSION_BROKER_RETRY_AFTER=30,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class AdmissionTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def check(self, backlog=0, client_backlog=0, drain_rate=1.0, cost=1):
+        with mock.patch.object(admission, 'get_backlog', return_value=backlog), \
+                mock.patch.object(fair_scheduling, 'client_backlog', return_value=client_backlog), \
+                mock.patch.object(admission, 'get_drain_rate', return_value=drain_rate):
+            admission.check_admission('ip:10.0.0.1', cost=cost)
+
+    def rejection(self, **kwargs):
+        with self.assertRaises(admission.AdmissionRejected) as raised:
+            self.check(**kwargs)
+        return raised.exception
+
+    def test_admitted_up_to_the_limits(self):
+        self.check(backlog=99, client_backlog=9)
+        self.check(backlog=90, cost=10)
+
+    def test_retry_after_is_excess_over_drain_rate(self):
+        rejected = self.rejection(backlog=150, drain_rate=2.0)
+        self.assertEqual(rejected.retry_after, 26)  # ceil(51 / 2)
+        self.assertIn("Too many documents", str(rejected))
+
+    def test_client_limit_wins_when_its_excess_is_larger(self):
+        rejected = self.rejection(backlog=50, client_backlog=30)
+        self.assertEqual(rejected.retry_after, 21)
+        self.assertIn("your documents", str(rejected))
+
+    def test_bulk_cost_counts_every_document(self):
+        self.assertEqual(self.rejection(backlog=95, cost=15, drain_rate=0.5).retry_after, 20)
+
+    def test_retry_after_is_clamped(self):
+        self.assertEqual(self.rejection(backlog=101, drain_rate=10.0).retry_after, 5)
+        self.assertEqual(self.rejection(backlog=10000, drain_rate=1.0).retry_after, 900)
+        self.assertEqual(self.rejection(backlog=101, drain_rate=0).retry_after, 900)
+
+    def test_known_broker_outage_rejects_until_it_ends(self):
+        cache.set(admission.BROKER_DOWN_CACHE_KEY, time.time() + 30)
+        self.assertIn(self.rejection().retry_after, (29, 30))
+
+    def test_unmeasurable_backlog_counts_as_broker_outage(self):
+        with mock.patch.object(admission, 'get_backlog', side_effect=ConnectionError):
+            with self.assertRaises(admission.AdmissionRejected) as raised:
+                admission.check_admission('ip:10.0.0.1')
+        self.assertEqual(raised.exception.retry_after, 30)
+        self.assertIsNotNone(cache.get(admission.BROKER_DOWN_CACHE_KEY))
+
+    def test_rejection_is_a_429_with_retry_after(self):
+        response = admission_rejected_response(admission.AdmissionRejected("Too many documents", 26))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '26')
+        self.assertEqual(response.data['status'], 'error')
+
+
+class OutboxRelayTests(TestCase):
+
+    def setUp(self):
+        self.add('a', 2)
+        self.add('b', 1)
+
+    def add(self, client_id, count):
+        outbox.add_messages([
+            {'hash': f"{client_id}{i}" * 32, 'task_id': f"{client_id}-{i}", 'queue': 'documents_small',
+             'task_args': ['blob/x', 'x.pdf', f"{client_id}{i}" * 32, None]}
+            for i in range(count)
+        ], client_id)
+
+    def sent(self):
+        return set(OutboxMessage.objects.filter(sent_at__isnull=False).values_list('task_id', flat=True))
+
+    def publisher(self, fail_at=None):
+        """A publish_to_broker that accepts tasks until fail_at"""
+        published = []
+
+        def publish(entries, on_published=None):
+            for entry in entries:
+                if entry['task_id'] == fail_at:
+                    raise ConnectionError('broker went away')
+                published.append(entry['task_id'])
+                on_published(entry['task_id'])
+
+        return published, publish
+
+    @override_settings(FAIR_SCHEDULING_ENABLED=False)
+    def test_batch_is_marked_sent(self):
+        published, publish = self.publisher()
+        with mock.patch('document_processor_app.utils.publish_to_broker', publish):
+            self.assertEqual(outbox.relay_batch(), 3)
+        self.assertEqual(published, ['a-0', 'a-1', 'b-0'])
+        self.assertEqual(self.sent(), {'a-0', 'a-1', 'b-0'})
+        self.assertEqual(outbox.pending_count(), 0)
+
+    @override_settings(FAIR_SCHEDULING_ENABLED=False)
+    def test_partial_publish_marks_only_accepted_rows(self):
+        _, publish = self.publisher(fail_at='a-1')
+        with mock.patch('document_processor_app.utils.publish_to_broker', publish):
+            with self.assertRaises(ConnectionError):
+                outbox.relay_batch()
+        self.assertEqual(self.sent(), {'a-0'})
+        failed = OutboxMessage.objects.get(task_id='a-1')
+        self.assertEqual((failed.attempts, failed.last_error), (1, 'ConnectionError: broker went away'))
+
+        published, publish = self.publisher()
+        with mock.patch('document_processor_app.utils.publish_to_broker', publish):
+            self.assertEqual(outbox.relay_batch(), 2)
+        self.assertEqual(published, ['a-1', 'b-0'])
+
+    @override_settings(FAIR_SCHEDULING_ENABLED=True)
+    def test_failed_client_submit_keeps_only_its_rows(self):
+        def submit(entries, client_id=None):
+            if client_id == 'b':
+                raise ConnectionError('redis went away')
+
+        with mock.patch.object(fair_scheduling, 'submit', side_effect=submit):
+            with self.assertRaises(ConnectionError):
+                outbox.relay_batch()
+        self.assertEqual(self.sent(), {'a-0', 'a-1'})
+
+    @override_settings(FAIR_SCHEDULING_ENABLED=True)
+    def test_other_tasks_bypass_fair_scheduling(self):
+        OutboxMessage.objects.all().delete()
+        message = outbox.add_task('document_processor_app.tasks.finalize_upload_session', ['session-id'])
+
+        def publish_tasks(messages, on_published):
+            for queued in messages:
+                on_published(queued.task_id)
+
+        with mock.patch.object(outbox, 'publish_tasks', side_effect=publish_tasks) as publish, \
+                mock.patch.object(fair_scheduling, 'submit') as submit:
+            self.assertEqual(outbox.relay_batch(), 1)
+        self.assertEqual([queued.task_id for queued in publish.call_args[0][0]], [message.task_id])
+        self.assertEqual(submit.call_count, 0)
+        self.assertEqual(outbox.pending_count(), 0)
+
+
+class WriteBufferTests(TestCase):
+
+    def setUp(self):
+        self.buffer = WriteBuffer(max_rows=1000, max_delay=60)
+
+    def claim(self, name):
+        return claim_document(f"blob/{name}", f"{name}.pdf", name * 64, None, f"task-{name}")[0]
+
+    def add(self, document, **kwargs):
+        on_flushed = mock.Mock()
+        self.buffer.add(
+            document, list(build_pages(document, [(1, '## Page 1\n\nfirst'), (2, '## Page 2\n\nsecond')], 0)),
+            ProcessedDocument(document=document, **processed_document_defaults(False)),
+            on_flushed=on_flushed, **kwargs
+        )
+        return on_flushed
+
+    def test_flush_completes_documents_in_one_go(self):
+        document = self.claim('a')
+        on_flushed = self.add(document, cache_stats={'hits': 2, 'misses': 1})
+        self.buffer.flush()
+        document.refresh_from_db()
+        self.assertEqual(document.status, Document.STATUS_COMPLETED)
+        self.assertEqual((document.page_cache_hits, document.page_cache_misses), (2, 1))
+        self.assertEqual(DocumentPage.objects.filter(document=document).count(), 2)
+        self.assertTrue(ProcessedDocument.objects.filter(document=document).exists())
+        on_flushed.assert_called_once_with()
+        self.assertEqual(self.buffer.entries, [])
+
+    def test_taken_over_document_is_dropped(self):
+        kept, taken_over = self.claim('a'), self.claim('b')
+        kept_flushed, taken_over_flushed = self.add(kept), self.add(taken_over)
+        # A retry claims the document while its earlier output waits in the buffer
+        Document.objects.filter(pk=taken_over.pk).update(status=Document.STATUS_RETRYING)
+        self.assertNotEqual(self.claim('b').claim_token, taken_over.claim_token)
+        self.buffer.flush()
+
+        self.assertEqual(Document.objects.get(pk=kept.pk).status, Document.STATUS_COMPLETED)
+        self.assertEqual(Document.objects.get(pk=taken_over.pk).status, Document.STATUS_PROCESSING)
+        self.assertFalse(DocumentPage.objects.filter(document=taken_over).exists())
+        self.assertFalse(ProcessedDocument.objects.filter(document=taken_over).exists())
+        kept_flushed.assert_called_once_with()
+        taken_over_flushed.assert_not_called()
+
+    def test_failed_flush_leaves_documents_processing(self):
+        document = self.claim('a')
+        on_flushed = self.add(document)
+        with mock.patch.object(DocumentPage.objects, 'bulk_create', side_effect=ConnectionError):
+            self.buffer.flush()
+        self.assertEqual(Document.objects.get(pk=document.pk).status, Document.STATUS_PROCESSING)
+        on_flushed.assert_not_called()
@@ -0,0 +1,137 @@
+"""
+Resumable chunked uploads.
+
+A client creates a session, PUTs numbered chunks of session.chunk_size bytes
+(the last one may be shorter), checks the received offset after a
+disconnect, and finally asks for the session to be finalized. Each request
+only ever handles one chunk, so no request holds a web worker for longer
+than a chunk takes to arrive.
+"""
+import glob
+import hashlib
+import os
+import shutil
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import UploadSession
+
+STREAM_READ_SIZE = 64 * 1024
+
+
+class UploadSessionError(Exception):
+    """Raised when a chunk or finalize request does not fit the session state"""
+
+
+def session_spool_path(session_id):
+    return os.path.join(settings.UPLOAD_SESSION_DIR, f"{session_id}.part")
+
+
+def next_chunk_index(session):
+    return session.received_bytes // session.chunk_size
+
+
+def chunk_attempt_path(session_id):
+    """A file of its own for each chunk request, so concurrent retries never share one"""
+    return os.path.join(settings.UPLOAD_SESSION_DIR, f"{session_id}.{uuid.uuid4().hex}.chunk")
+
+
+def session_files(session_id):
+    """The spool file and any chunk files left by interrupted requests"""
+    return [session_spool_path(session_id)] + glob.glob(
+        os.path.join(settings.UPLOAD_SESSION_DIR, f"{session_id}.*.chunk")
+    )
+
+
+def chunk_received(session, index):
+    """True when the chunk is already in the spool file; raises when it cannot be appended yet"""
+    if session.status != UploadSession.STATUS_OPEN:
+        raise UploadSessionError(f"Upload session is {session.status}")
+    offset = index * session.chunk_size
+    if offset < session.received_bytes:
+        return True
+    if offset > session.received_bytes:
+        raise UploadSessionError(f"Expected chunk {next_chunk_index(session)}")
+    return False
+
+
+def receive_chunk(stream, path, chunk_size):
+    """Copy the request body to path; returns (bytes written, SHA-256 hex digest)"""
+    hasher = hashlib.sha256()
+    written = 0
+    with open(path, 'wb') as chunk_file:
+        while True:
+            data = stream.read(STREAM_READ_SIZE)
+            if not data:
+                break
+            written += len(data)
+            if written > chunk_size:
+                raise UploadSessionError(f"Chunks must not exceed {chunk_size} bytes")
+            hasher.update(data)
+            chunk_file.write(data)
+    return written, hasher.hexdigest()
+
+
+def append_chunk(session_id, index, stream, chunk_sha256=None):
+    """
+    Append chunk number index (0-based) to the session's spool file. Chunks
+    must arrive in order; re-sending an already received chunk is a no-op so
+    clients can safely retry. chunk_sha256, when given, is verified.
+
+    The body is read into a chunk file of its own outside any transaction, so
+    a slow client never holds a connection or the session lock. Only the
+    verified chunk is appended, under a short lock that checks the offset again.
+    """
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session_id)
+        if chunk_received(session, index):
+            return session
+
+    attempt_path = chunk_attempt_path(session.pk)
+    try:
+        written, digest = receive_chunk(stream, attempt_path, session.chunk_size)
+        if not written:
+            raise UploadSessionError("Empty chunk")
+        if session.total_size is not None and session.received_bytes + written > session.total_size:
+            raise UploadSessionError("Chunk exceeds the declared total size")
+        if chunk_sha256 and digest != chunk_sha256.lower():
+            raise UploadSessionError("Chunk checksum mismatch")
+
+        with transaction.atomic():
+            session = UploadSession.objects.select_for_update().get(pk=session_id)
+            if chunk_received(session, index):
+                return session  # A concurrent retry appended it first
+            spool_path = session_spool_path(session.pk)
+            if not session.received_bytes:
+                os.replace(attempt_path, spool_path)
+            else:
+                with open(spool_path, 'r+b') as spool_file, open(attempt_path, 'rb') as chunk_file:
+                    # Drop bytes left over from an append whose commit failed
+                    spool_file.truncate(session.received_bytes)
+                    spool_file.seek(session.received_bytes)
+                    shutil.copyfileobj(chunk_file, spool_file, STREAM_READ_SIZE)
+            session.received_bytes += written
+            session.save(update_fields=['received_bytes', 'updated_at'])
+    finally:
+        if os.path.exists(attempt_path):
+            os.remove(attempt_path)
+    return session
+
+
+def start_finalize(session_id):
+    """Close the session for writing; the finalize task takes it from here"""
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session_id)
+        if session.status != UploadSession.STATUS_OPEN:
+            raise UploadSessionError(f"Upload session is {session.status}")
+        if not session.received_bytes:
+            raise UploadSessionError("No chunks received")
+        if session.total_size is not None and session.received_bytes != session.total_size:
+            raise UploadSessionError(
+                f"Received {session.received_bytes} of {session.total_size} bytes"
+            )
+        session.status = UploadSession.STATUS_FINALIZING
+        session.save(update_fields=['status', 'updated_at'])
+    return session
@@ -1,16 +1,30 @@
 # urls.py
 from django.urls import path
 from document_processor_app.views import (
-    DocumentList, DocumentDetail,
-    ProcessedDocumentList, ProcessedDocumentDetail,
-    TaskStatus, IndexView
+    DocumentList, DocumentDetail, DocumentDownload, DocumentHashCheck, BulkDocumentUpload,
+    ProcessedDocumentList, ProcessedDocumentDetail, ProcessedDocumentPages,
+    TaskStatus, IndexView,
+    UploadSessionList, UploadSessionDetail, UploadSessionChunk, UploadSessionFinalize,
+    DeadLetterList, DeadLetterReplay, FullTextSearch, SemanticSearch
 )
 
 urlpatterns = [
     path('', IndexView.as_view(), name='index'),
     path('document/', DocumentList.as_view()),
-    path('document/<int:id>/', DocumentDetail.as_view()),
+    path('document/bulk/', BulkDocumentUpload.as_view()),
+    path('document/check/', DocumentHashCheck.as_view()),
+    path('document/<int:pk>/', DocumentDetail.as_view()),
+    path('document/<int:pk>/download/', DocumentDownload.as_view()),
     path('processed_documents/list/', ProcessedDocumentList.as_view()),
-    path('processed_documents/<int:id>/', ProcessedDocumentDetail.as_view()),
+    path('processed_documents/<int:pk>/', ProcessedDocumentDetail.as_view()),
+    path('processed_documents/<int:pk>/pages/', ProcessedDocumentPages.as_view()),
     path('task/<str:task_id>/', TaskStatus.as_view(), name='task_status'),
+    path('uploads/', UploadSessionList.as_view()),
+    path('uploads/<uuid:pk>/', UploadSessionDetail.as_view()),
+    path('uploads/<uuid:pk>/chunks/<int:index>/', UploadSessionChunk.as_view()),
+    path('uploads/<uuid:pk>/finalize/', UploadSessionFinalize.as_view()),
+    path('dead_letters/', DeadLetterList.as_view()),
+    path('dead_letters/replay/', DeadLetterReplay.as_view()),
+    path('search/', FullTextSearch.as_view()),
+    path('search/semantic/', SemanticSearch.as_view()),
 ]
@@ -1,65 +1,227 @@
-from django.core.cache import cache
+from django.conf import settings
+from django.db import transaction
 import hashlib
+import os
+import tempfile
+import uuid
 from document_processor_app.tasks import process_document
-from .cache_utils import get_document_cache, set_document_cache
-from celery.exceptions import OperationalError
-import time
-import json
-
-def get_hash(file):
-    content = file.read()
-    file.seek(0)  # Reset pointer after reading
-    return hashlib.sha256(content).hexdigest()
-
-def get_cache_key(file_hash):
-    return f"doc:{file_hash}"
-
-def set_document_cache(file_hash, status, task_id=None):
-    cache_key = get_cache_key(file_hash)
-    cache_data = {
-        'status': status,
-        'task_id': task_id
+from .cache_utils import claim_document_cache, release_document_claim, get_document_cache_many
+from .models import Document
+from .storage import blob_key, get_blob_store
+from .extraction_engines import resolve_engine_name
+from .document_processing import get_page_count
+from .routing import get_queue_options, select_queue
+from . import outbox
+
+def iter_file_chunks(file, chunk_size=None):
+    """
+    Yield the file content in fixed-size chunks. Plain file objects are read
+    from their current position so non-seekable streams (archive members) work.
+    """
+    chunk_size = chunk_size or settings.UPLOAD_CHUNK_SIZE
+    if hasattr(file, 'chunks'):  # Django UploadedFile, rewinds itself
+        yield from file.chunks(chunk_size)
+        return
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+def spool_upload(file):
+    """
+    Hash the upload and copy it to the spool directory in a single pass.
+    Only one chunk is held in memory at a time. Returns (file_hash, spool_path).
+    """
+    hasher = hashlib.sha256()
+    fd, spool_path = tempfile.mkstemp(dir=settings.UPLOAD_SPOOL_DIR, suffix='.pdf')
+    try:
+        with os.fdopen(fd, 'wb') as spool_file:
+            for chunk in iter_file_chunks(file):
+                hasher.update(chunk)
+                spool_file.write(chunk)
+    except Exception:
+        discard_spool(spool_path)
+        raise
+    return hasher.hexdigest(), spool_path
+
+def hash_spooled_file(spool_path):
+    """Stream a spooled file through SHA-256, one chunk at a time"""
+    with open(spool_path, 'rb') as spool_file:
+        hasher = hashlib.sha256()
+        for chunk in iter_file_chunks(spool_file):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def discard_spool(spool_path):
+    try:
+        os.remove(spool_path)
+    except FileNotFoundError:
+        pass
+
+def prepare_document(file, file_name, engine=None, document_class=None):
+    """
+    Hash, spool and claim one file, then move it into the blob store.
+    Returns a manifest entry; entries of new documents carry the 'task_args'
+    that publish_document_tasks needs.
+    """
+    # Hash and spool in one pass, then move the spooled file into the blob store.
+    # The task only receives the hash and the storage reference (claim check).
+    file_hash, spool_path = spool_upload(file)
+    return prepare_spooled_document(file_hash, spool_path, file_name, engine, document_class)
+
+def prepare_spooled_document(file_hash, spool_path, file_name, engine=None, document_class=None):
+    """Claim an already hashed spool file and move it into the blob store"""
+    # Atomically claim the hash so concurrent uploads of the same file enqueue
+    # a single task; everyone else gets the winner's task id back
+    task_id = str(uuid.uuid4())
+    claimed, cache_data = claim_document_cache(file_hash, task_id)
+    if not claimed:
+        discard_spool(spool_path)
+        return {"file_name": file_name, "hash": file_hash, "task_id": cache_data.get('task_id'), "duplicate": True}
+
+    # Pre-flight inspection for queue routing, reads only the PDF trailer
+    try:
+        page_count = get_page_count(spool_path)
+    except Exception:
+        page_count = None  # Unreadable here, route by size and let the task fail properly
+    queue = select_queue(page_count, os.path.getsize(spool_path))
+
+    try:
+        storage_ref = get_blob_store().put_file(file_hash, spool_path)
+    except Exception:
+        release_document_claim(file_hash, task_id)
+        raise
+    engine = resolve_engine_name(engine, document_class)
+
+    return {
+        "file_name": file_name,
+        "hash": file_hash,
+        "task_id": task_id,
+        "duplicate": False,
+        "queue": queue,
+        "task_args": (storage_ref, file_name, file_hash, engine)
+    }
+
+def prepare_stored_document(file_hash, file_name, file_size, engine=None, document_class=None):
+    """
+    Like prepare_spooled_document, for a file that an earlier attempt already
+    moved into the blob store. Routed by size, the page count is not read again.
+    """
+    task_id = str(uuid.uuid4())
+    claimed, cache_data = claim_document_cache(file_hash, task_id)
+    if not claimed:
+        return {"file_name": file_name, "hash": file_hash, "task_id": cache_data.get('task_id'), "duplicate": True}
+
+    engine = resolve_engine_name(engine, document_class)
+    return {
+        "file_name": file_name,
+        "hash": file_hash,
+        "task_id": task_id,
+        "duplicate": False,
+        "queue": select_queue(None, file_size),
+        "task_args": (get_blob_store().make_ref(blob_key(file_hash)), file_name, file_hash, engine)
+    }
+
+def enqueue_document(file, engine=None, document_class=None, client_id=None):
+    entry = prepare_document(file, file.name, engine, document_class)
+    if not entry["duplicate"]:
+        publish_document_tasks([entry], client_id)
+    return {"hash": entry["hash"], "task_id": entry["task_id"]}
+
+def enqueue_documents(files, engine=None, document_class=None, client_id=None):
+    """
+    Enqueue many files, given as (file_name, size, file_obj) tuples, and publish
+    all new tasks in one broker batch. Returns a manifest entry per file.
+    """
+    manifest = []
+    try:
+        for file_name, size, file_obj in files:
+            if len(manifest) >= settings.BULK_UPLOAD_MAX_FILES:
+                manifest.append({"file_name": file_name, "error": "Too many files in one request"})
+                continue
+            if not file_name.lower().endswith('.pdf'):
+                manifest.append({"file_name": file_name, "error": "Not a PDF file"})
+                continue
+            if size is not None and size > settings.BULK_UPLOAD_MAX_FILE_SIZE:
+                manifest.append({"file_name": file_name, "error": "File too large"})
+                continue
+            manifest.append(prepare_document(file_obj, file_name, engine, document_class))
+    except Exception:
+        # Nothing was published yet, give the claims back before failing
+        for entry in manifest:
+            if entry.get("duplicate") is False:
+                release_document_claim(entry["hash"], entry["task_id"])
+        raise
+
+    publish_document_tasks([entry for entry in manifest if entry.get("duplicate") is False], client_id)
+    for entry in manifest:
+        entry.pop("task_args", None)
+    return manifest
+
+def publish_document_tasks(entries, client_id=None):
+    """
+    Record the tasks of prepared entries in the outbox; the outbox relay
+    publishes them, so this never talks to the broker. Claims are released
+    on failure.
+    """
+    try:
+        with transaction.atomic():
+            outbox.add_messages(entries, client_id)
+    except Exception:
+        for entry in entries:
+            release_document_claim(entry["hash"], entry["task_id"])
+        raise
+
+def publish_to_broker(entries, on_published=None):
+    """
+    Publish the tasks of prepared entries over a single broker connection,
+    calling on_published with each task id the broker accepted. Publishing
+    is not retried here: the outbox relay and the fair dispatcher both keep
+    the entries and try again later.
+    """
+    with process_document.app.producer_or_acquire() as producer:
+        for entry in entries:
+            process_document.apply_async(
+                args=entry["task_args"],
+                task_id=entry["task_id"],
+                producer=producer,
+                retry=False,
+                **get_queue_options(entry["queue"])
+            )
+            if on_published is not None:
+                on_published(entry["task_id"])
+
+def check_document_hashes(file_hashes):
+    """
+    Report what the service knows about each hash so clients can skip uploading
+    known documents. The database is authoritative; the cache adds queued tasks
+    and task ids.
+    """
+    cached = get_document_cache_many(file_hashes)
+    documents = {
+        document['content_hash']: document
+        for document in Document.objects.filter(content_hash__in=file_hashes).values('id', 'content_hash', 'status')
     }
-    cache.set(cache_key, json.dumps(cache_data), timeout=86400)  # 24 hours
-
-def get_document_cache(file_hash):
-    cache_key = get_cache_key(file_hash)
-    data = cache.get(cache_key)
-    return json.loads(data) if data else None
-
-def enqueue_document(file):
-    file_hash = get_hash(file)
-    
-    # Check if document is already being processed
-    cache_data = get_document_cache(file_hash)
-    if cache_data:
-        if cache_data.get('status') == "queued" and cache_data.get('task_id') is None:
-            file_content = file.read()
-            file_name = file.name
-            task = create_task_with_retry(file_content, file_name, file_hash)
-            set_document_cache(file_hash, "queued", task.id)
-            return {"hash": file_hash, "task_id": task.id}
+
+    results = []
+    for file_hash in file_hashes:
+        cache_data = cached.get(file_hash) or {}
+        document = documents.get(file_hash)
+        if document:
+            state = {
+                Document.STATUS_COMPLETED: 'processed',
+                Document.STATUS_FAILED_TRANSIENT: 'failed',
+                Document.STATUS_FAILED_PERMANENT: 'failed',
+            }.get(document['status'], 'queued')
+        elif cache_data.get('status') in ('queued', 'processed', 'failed'):
+            state = cache_data['status']
         else:
-            return {"hash": file_hash, "task_id": cache_data.get('task_id')}
-
-    # Read file content
-    file_content = file.read()
-    file_name = file.name
-
-    # Create new task with retry
-    task = create_task_with_retry(file_content, file_name, file_hash)
-    
-    # Store in cache
-    set_document_cache(file_hash, "queued", task.id)
-    
-    return {"hash": file_hash, "task_id": task.id}
-
-def create_task_with_retry(file_content, file_name, file_hash, max_retries=5, retry_delay=2):
-    """Create a Celery task with retry mechanism"""
-    for attempt in range(max_retries):
-        try:
-            return process_document.delay(file_content, file_name, file_hash)
-        except OperationalError as e:
-            if attempt == max_retries - 1:  # Last attempt
-                raise e
-            time.sleep(retry_delay * (attempt + 1))  # Exponential backoff
+            state = 'unknown'
+        results.append({
+            'hash': file_hash,
+            'state': state,
+            'task_id': cache_data.get('task_id'),
+            'document_id': document['id'] if document else None
+        })
+    return results
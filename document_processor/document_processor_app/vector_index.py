@@ -0,0 +1,340 @@
+"""
+In-process vector index over DocumentChunk embeddings.
+
+The index lives in VECTOR_INDEX_DIR, on the volume shared by the web and
+worker containers. It is made of shards of raw little-endian float32 vectors
+with their chunk ids, described by manifest.json. Web workers memory-map the
+shards read-only, so all gunicorn workers on a host share one copy through
+the page cache, and reload them whenever the manifest changes.
+
+Search is a brute-force matrix product per shard followed by a partial sort.
+For large corpora an optional IVF mode trains a coarse quantizer (spherical
+k-means centroids) and assigns every row to its nearest centroid; a query
+then only scores the rows of its nprobe nearest lists.
+
+update_vector_index appends chunks embedded since the last update to the
+open shard and swaps in a new manifest. Readers only see rows the manifest
+counts, so an append never exposes half-written data. Chunks deleted after
+indexing are skipped when results are loaded; once too many rows are stale,
+or the embedder changes, the index is rebuilt into a new generation of files.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from .embeddings import VECTOR_DTYPE, get_embedder, unpack_vector
+from .models import DocumentChunk
+
+MANIFEST_NAME = 'manifest.json'
+ID_DTYPE = np.dtype('<i8')
+LIST_DTYPE = np.dtype('<i4')
+BUILD_LOCK_KEY = 'vector-index:build-lock'
+
+SEARCH_MODES = ['auto', 'exact', 'ivf']
+
+
+def index_path(name):
+    return os.path.join(str(settings.VECTOR_INDEX_DIR), name)
+
+
+def read_manifest():
+    try:
+        with open(index_path(MANIFEST_NAME)) as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return None
+
+
+def write_manifest(manifest):
+    """Replace the manifest atomically, readers see either the old or the new one"""
+    temporary_path = index_path(f"{MANIFEST_NAME}.{uuid.uuid4().hex}.tmp")
+    with open(temporary_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+        manifest_file.flush()
+        os.fsync(manifest_file.fileno())
+    os.replace(temporary_path, index_path(MANIFEST_NAME))
+
+
+def index_files(manifest):
+    names = []
+    for shard in manifest['shards']:
+        names += [f"{shard['name']}.vectors", f"{shard['name']}.ids", f"{shard['name']}.lists"]
+    if manifest.get('centroids'):
+        names.append(manifest['centroids'])
+    return names
+
+
+def top_k(scores, k):
+    """Indices of the k highest scores, best first"""
+    if len(scores) > k:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+# Building
+
+def train_centroids(sample, n_lists, iterations=10):
+    """Spherical k-means on unit vectors; returns unit centroids"""
+    rng = np.random.default_rng(0)
+    n_lists = min(n_lists, len(sample))
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        norms = np.linalg.norm(sums, axis=1)
+        filled = norms > 0  # Empty lists keep their previous centroid
+        centroids[filled] = sums[filled] / norms[filled, None]
+    return centroids.astype(VECTOR_DTYPE)
+
+
+def assign_lists(vectors, centroids, block_rows=65536):
+    assignments = np.empty(len(vectors), dtype=LIST_DTYPE)
+    for start in range(0, len(vectors), block_rows):
+        block = np.asarray(vectors[start:start + block_rows])
+        assignments[start:start + block_rows] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+class IndexBuilder:
+
+    def __init__(self, manifest):
+        self.manifest = manifest
+        self.dimensions = manifest['dimensions']
+        self.centroids = None
+        if manifest.get('centroids'):
+            self.centroids = np.fromfile(index_path(manifest['centroids']), dtype=VECTOR_DTYPE).reshape(-1, self.dimensions)
+
+    def open_shard(self):
+        """The last shard if it has room, otherwise a new one"""
+        shards = self.manifest['shards']
+        if shards and shards[-1]['rows'] < settings.VECTOR_INDEX_SHARD_ROWS:
+            return shards[-1]
+        shard = {'name': f"g{self.manifest['generation']}-{len(shards):05d}", 'rows': 0}
+        shards.append(shard)
+        return shard
+
+    def append_file(self, shard, suffix, array):
+        path = index_path(f"{shard['name']}.{suffix}")
+        with open(path, 'ab') as shard_file:
+            # Drop whatever an interrupted earlier append left past the committed rows
+            shard_file.truncate(shard['rows'] * (array.nbytes // len(array)))
+            shard_file.write(array.tobytes())
+
+    def append(self, ids, vectors):
+        offset = 0
+        while offset < len(ids):
+            shard = self.open_shard()
+            count = min(settings.VECTOR_INDEX_SHARD_ROWS - shard['rows'], len(ids) - offset)
+            shard_ids = np.asarray(ids[offset:offset + count], dtype=ID_DTYPE)
+            shard_vectors = np.ascontiguousarray(vectors[offset:offset + count], dtype=VECTOR_DTYPE)
+            self.append_file(shard, 'vectors', shard_vectors)
+            self.append_file(shard, 'ids', shard_ids)
+            if self.centroids is not None:
+                self.append_file(shard, 'lists', assign_lists(shard_vectors, self.centroids))
+            shard['rows'] += count
+            offset += count
+        self.manifest['last_chunk_id'] = int(ids[-1])
+
+    def map_vectors(self, shard):
+        return np.memmap(index_path(f"{shard['name']}.vectors"), dtype=VECTOR_DTYPE, mode='r',
+                         shape=(shard['rows'], self.dimensions))
+
+    def train(self):
+        """Train the coarse quantizer on a sample of all rows and assign every row"""
+        total = sum(shard['rows'] for shard in self.manifest['shards'])
+        rng = np.random.default_rng(0)
+        sample_share = min(1.0, settings.VECTOR_INDEX_IVF_TRAINING_SAMPLE / total)
+        sample = np.concatenate([
+            np.asarray(self.map_vectors(shard)[np.sort(rng.choice(
+                shard['rows'], max(1, int(shard['rows'] * sample_share)), replace=False
+            ))])
+            for shard in self.manifest['shards'] if shard['rows']
+        ])
+        self.centroids = train_centroids(sample, settings.VECTOR_INDEX_IVF_LISTS)
+        name = f"g{self.manifest['generation']}-centroids-{uuid.uuid4().hex[:8]}"
+        self.centroids.tofile(index_path(name))
+        for shard in self.manifest['shards']:
+            assign_lists(self.map_vectors(shard), self.centroids).tofile(index_path(f"{shard['name']}.lists"))
+        self.manifest['centroids'] = name
+        self.manifest['lists'] = len(self.centroids)
+
+
+def new_manifest(embedder):
+    return {
+        'generation': int(time.time() * 1000),
+        'embedder': embedder.name,
+        'dimensions': embedder.dimensions,
+        'last_chunk_id': 0,
+        'shards': [],
+        'centroids': None,
+        'lists': 0,
+    }
+
+
+def is_stale(manifest, embedder):
+    """True when the embedder changed or too many indexed chunks were deleted"""
+    if manifest['embedder'] != embedder.name or manifest['dimensions'] != embedder.dimensions:
+        return True
+    indexed = sum(shard['rows'] for shard in manifest['shards'])
+    if not indexed:
+        return False
+    live = DocumentChunk.objects.filter(
+        embedder=embedder.name, dimensions=embedder.dimensions, id__lte=manifest['last_chunk_id']
+    ).count()
+    return (indexed - live) / indexed > settings.VECTOR_INDEX_MAX_STALE_RATIO
+
+
+def update_index(rebuild=False):
+    """
+    Add chunks embedded since the last update, or rebuild the index when asked
+    or when it is stale. Only one builder runs at a time. Returns the number of
+    rows added.
+    """
+    if not cache.add(BUILD_LOCK_KEY, 1, timeout=settings.VECTOR_INDEX_BUILD_LOCK_TIMEOUT):
+        return 0
+    try:
+        return _update_index(rebuild)
+    finally:
+        cache.delete(BUILD_LOCK_KEY)
+
+
+def _update_index(rebuild):
+    os.makedirs(str(settings.VECTOR_INDEX_DIR), exist_ok=True)
+    embedder = get_embedder()
+    current = read_manifest()
+    manifest = current
+    if manifest is None or rebuild or is_stale(manifest, embedder):
+        manifest = new_manifest(embedder)
+    builder = IndexBuilder(manifest)
+
+    chunks = (
+        DocumentChunk.objects.filter(
+            embedder=embedder.name, dimensions=embedder.dimensions, id__gt=manifest['last_chunk_id']
+        )
+        .order_by('id')
+        .values_list('id', 'vector')
+    )
+    added = 0
+    ids, vectors = [], []
+    for chunk_id, vector in chunks.iterator(chunk_size=2000):
+        ids.append(chunk_id)
+        vectors.append(unpack_vector(vector))
+        if len(ids) >= settings.VECTOR_INDEX_BATCH_SIZE:
+            builder.append(ids, np.vstack(vectors))
+            added += len(ids)
+            ids, vectors = [], []
+    if ids:
+        builder.append(ids, np.vstack(vectors))
+        added += len(ids)
+
+    total = sum(shard['rows'] for shard in manifest['shards'])
+    if (settings.VECTOR_INDEX_IVF_LISTS and builder.centroids is None
+            and total >= settings.VECTOR_INDEX_IVF_MIN_ROWS):
+        builder.train()
+
+    if manifest is not current or added:
+        write_manifest(manifest)
+    if current is not None and manifest is not current:
+        # Readers that still map the old files keep them until they reload
+        for name in index_files(current):
+            try:
+                os.remove(index_path(name))
+            except FileNotFoundError:
+                pass
+    return added
+
+
+# Searching
+
+class VectorIndex:
+    """A read-only view of one manifest"""
+
+    def __init__(self, manifest):
+        self.manifest = manifest
+        self.dimensions = manifest['dimensions']
+        self.shards = []
+        for shard in manifest['shards']:
+            if not shard['rows']:
+                continue
+            vectors = np.memmap(index_path(f"{shard['name']}.vectors"), dtype=VECTOR_DTYPE, mode='r',
+                                shape=(shard['rows'], self.dimensions))
+            ids = np.memmap(index_path(f"{shard['name']}.ids"), dtype=ID_DTYPE, mode='r', shape=(shard['rows'],))
+            lists = None
+            if manifest.get('centroids'):
+                lists = np.memmap(index_path(f"{shard['name']}.lists"), dtype=LIST_DTYPE, mode='r',
+                                  shape=(shard['rows'],))
+            self.shards.append((vectors, ids, lists))
+        self.centroids = None
+        if manifest.get('centroids'):
+            self.centroids = np.fromfile(index_path(manifest['centroids']), dtype=VECTOR_DTYPE).reshape(-1, self.dimensions)
+
+    @property
+    def size(self):
+        return sum(len(ids) for _, ids, _ in self.shards)
+
+    def search(self, query, k, mode='auto', nprobe=None):
+        """Return [(chunk_id, score)] of the k best rows by inner product, best first"""
+        query = np.asarray(query, dtype=VECTOR_DTYPE)
+        if mode == 'ivf' and self.centroids is None:
+            raise ValueError("The index has no IVF lists yet")
+        use_ivf = self.centroids is not None and mode != 'exact'
+        if use_ivf:
+            nprobe = min(nprobe or settings.VECTOR_INDEX_IVF_NPROBE, len(self.centroids))
+            probes = top_k(self.centroids @ query, nprobe)
+
+        best_scores, best_ids = [], []
+        for vectors, ids, lists in self.shards:
+            if use_ivf:
+                rows = np.flatnonzero(np.isin(lists, probes))
+                if not len(rows):
+                    continue
+                scores = vectors[rows] @ query
+                shard_ids = ids[rows]
+            else:
+                scores = vectors @ query
+                shard_ids = ids
+            best = top_k(scores, k)
+            best_scores.append(scores[best])
+            best_ids.append(np.asarray(shard_ids[best]))
+        if not best_scores:
+            return []
+        scores = np.concatenate(best_scores)
+        ids = np.concatenate(best_ids)
+        best = top_k(scores, k)
+        return [(int(ids[i]), float(scores[i])) for i in best]
+
+
+_index = None
+_index_mtime = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """This process's view of the index, reloaded when the manifest changes. None before the first build."""
+    global _index, _index_mtime
+    for _ in range(2):
+        try:
+            mtime = os.stat(index_path(MANIFEST_NAME)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if _index is not None and mtime == _index_mtime:
+            return _index
+        with _index_lock:
+            try:
+                manifest = read_manifest()
+                if manifest is None:
+                    return None
+                _index, _index_mtime = VectorIndex(manifest), mtime
+                return _index
+            except FileNotFoundError:
+                continue  # A rebuild removed the files of the manifest just read, try the new one
+    return _index
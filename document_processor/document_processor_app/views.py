@@ -1,12 +1,41 @@
+import tarfile
+import zipfile
 # from django.http import JsonResponse
 # from django.views.decorators.csrf import csrf_exempt
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.parsers import FormParser, MultiPartParser
-from django.http import Http404
-from .serializers import DocumentSerializer, DocumentUploadSerializer, ProcessedDocumentSerializer
-from .models import Document, ProcessedDocument
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from django.db import transaction
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast
+from django.http import FileResponse, Http404
+from .serializers import (
+    DocumentSerializer, DocumentUploadSerializer, BulkDocumentUploadSerializer,
+    ProcessedDocumentSerializer, ProcessedDocumentListSerializer,
+    DocumentPageSerializer, DocumentHashCheckSerializer,
+    UploadSessionCreateSerializer, UploadSessionSerializer,
+    DeadLetterSerializer, DeadLetterReplaySerializer,
+    SemanticSearchSerializer, SemanticSearchResultSerializer,
+    FullTextSearchSerializer, FullTextSearchResultSerializer
+)
+from .models import (
+    DeadLetter, Document, DocumentChunk, DocumentPage, OutboxMessage, ProcessedDocument, UploadSession
+)
+from .upload_sessions import UploadSessionError, append_chunk, start_finalize
+from .tasks import finalize_upload_session, replay_dead_letters
+from . import outbox
+from .dead_letters import filter_dead_letters
+from .embeddings import get_embedder
+from .vector_index import get_index
+from .admission import AdmissionRejected, broker_unavailable, check_admission, record_broker_failure
+from django.conf import settings
+from .storage import get_blob_store
+from .pagination import filter_created_range, paginate_keyset, paginate_ranked
+from rest_framework.exceptions import ValidationError
+from .utils import check_document_hashes
+from celery.exceptions import OperationalError
 from celery.result import AsyncResult
 from .cache_utils import get_document_cache
 from django.views.generic import TemplateView
@@ -16,24 +45,46 @@ class IndexView(TemplateView):
     template_name = 'index.html'
 
 
+def admission_rejected_response(e):
+    return Response({'status': 'error', 'errors': {'detail': str(e)}},
+                    status=status.HTTP_429_TOO_MANY_REQUESTS,
+                    headers={'Retry-After': str(e.retry_after)})
+
+
 class DocumentList(APIView):
 
     def get_queryset(self, request):
-        queryset = Document.objects.all()
-        order_by = request.query_params.get('order_by')
-        if order_by == 'created_at':
-            queryset = queryset.order_by('created_at')[:3]
-        return queryset
+        queryset = Document.objects.only(*DocumentSerializer.Meta.model_fields)
+        document_status = request.query_params.get('status')
+        if document_status:
+            queryset = queryset.filter(status=document_status)
+        file_name = request.query_params.get('file_name')
+        if file_name:
+            queryset = queryset.filter(file_name__startswith=file_name)
+        return filter_created_range(queryset, request)
 
     def get(self, request, format=None):
-        queryset = self.get_queryset(request)
-        serializer = DocumentSerializer(queryset, many=True)
-        return Response({'status': 'success', 'data': serializer.data}, status=status.HTTP_200_OK)
+        # ?order_by=created_at pages oldest first, the default is newest first
+        try:
+            queryset = self.get_queryset(request)
+            documents, next_cursor = paginate_keyset(
+                queryset, request, ascending=request.query_params.get('order_by') == 'created_at'
+            )
+        except ValidationError as e:
+            return Response({'status': 'error', 'errors': e.detail}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = DocumentSerializer(documents, many=True)
+        return Response({'status': 'success', 'data': serializer.data, 'next_cursor': next_cursor},
+                        status=status.HTTP_200_OK)
 
     def post(self, request, format=None):
+        # Checked before the body is parsed so rejected uploads are not spooled
+        try:
+            check_admission(request.client_id)
+        except AdmissionRejected as e:
+            return admission_rejected_response(e)
         serializer = DocumentUploadSerializer(data=request.data)
         if serializer.is_valid():
-            result = serializer.save()
+            result = serializer.save(client_id=request.client_id)
             return Response({
                 'status': 'success',
                 'data': {
@@ -44,11 +95,57 @@ class DocumentList(APIView):
         return Response({'status': 'error', 'errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)    
 
 
+class BulkDocumentUpload(APIView):
+    """
+    Upload many PDFs at once, as repeated 'files' parts or one ZIP/TAR 'archive'.
+    Returns a manifest with the hash and task id of every file.
+    """
+    parser_classes = [MultiPartParser]
+
+    def post(self, request, format=None):
+        try:
+            check_admission(request.client_id)
+        except AdmissionRejected as e:
+            return admission_rejected_response(e)
+        serializer = BulkDocumentUploadSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({'status': 'error', 'errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            # Reserve every document of the upload, archive members included
+            check_admission(request.client_id, cost=serializer.document_count())
+            manifest = serializer.save(client_id=request.client_id)
+        except (zipfile.BadZipFile, tarfile.TarError) as e:
+            return Response({'status': 'error', 'errors': {'archive': str(e)}}, status=status.HTTP_400_BAD_REQUEST)
+        except AdmissionRejected as e:
+            return admission_rejected_response(e)
+        return Response({'status': 'success', 'data': manifest}, status=status.HTTP_201_CREATED)
+
+
+class DocumentHashCheck(APIView):
+    """
+    Tell clients whether documents are already known before they upload them.
+    GET ?hash=<sha256> checks one hash, POST {"hashes": [...]} checks a batch.
+    """
+
+    def get(self, request, format=None):
+        return self.check({'hashes': request.query_params.getlist('hash')})
+
+    def post(self, request, format=None):
+        return self.check(request.data)
+
+    def check(self, data):
+        serializer = DocumentHashCheckSerializer(data=data)
+        if not serializer.is_valid():
+            return Response({'status': 'error', 'errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+        results = check_document_hashes(serializer.validated_data['hashes'])
+        return Response({'status': 'success', 'data': results}, status=status.HTTP_200_OK)
+
+
 class DocumentDetail(APIView):
 
     def get_object(self, pk):
         try:
-            return Document.objects.get(pk=pk)
+            return Document.objects.only(*DocumentSerializer.Meta.model_fields).get(pk=pk)
         except Document.DoesNotExist:
             raise Http404
 
@@ -71,16 +168,44 @@ class DocumentDetail(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+class DocumentDownload(APIView):
+    """Stream the original file from the blob store"""
+
+    def get(self, request, pk, format=None):
+        try:
+            document = Document.objects.only('file_name', 'storage_ref').get(pk=pk)
+        except Document.DoesNotExist:
+            raise Http404
+        if not document.storage_ref:
+            raise Http404
+        return FileResponse(
+            get_blob_store().open(document.storage_ref),
+            as_attachment=True,
+            filename=document.file_name,
+            content_type='application/pdf'
+        )
+
+
 class ProcessedDocumentList(APIView):
         
     def get_queryset(self, request):
-        queryset = ProcessedDocument.objects.all()
-        return queryset
+        queryset = ProcessedDocument.objects.defer('markdown_content')
+        file_name = request.query_params.get('file_name')
+        if file_name:
+            queryset = queryset.filter(document__file_name__startswith=file_name)
+        return filter_created_range(queryset, request)
 
     def get(self, request, format=None):
-        queryset = self.get_queryset(request)
-        serializer = ProcessedDocumentSerializer(queryset, many=True)
-        return Response({'status': 'success', 'data': serializer.data}, status=status.HTTP_200_OK)
+        try:
+            queryset = self.get_queryset(request)
+            processed_documents, next_cursor = paginate_keyset(
+                queryset, request, ascending=request.query_params.get('order_by') == 'created_at'
+            )
+        except ValidationError as e:
+            return Response({'status': 'error', 'errors': e.detail}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = ProcessedDocumentListSerializer(processed_documents, many=True)
+        return Response({'status': 'success', 'data': serializer.data, 'next_cursor': next_cursor},
+                        status=status.HTTP_200_OK)
     
 
 class ProcessedDocumentDetail(APIView):
@@ -97,33 +222,267 @@ class ProcessedDocumentDetail(APIView):
         return Response({'status': 'success', 'data': serializer.data}, status=status.HTTP_200_OK)
 
 
+class ProcessedDocumentPages(APIView):
+    """
+    Return a page range of a processed document, e.g. ?from=10&to=20.
+    Only the requested DocumentPage rows are read.
+    """
+
+    def get(self, request, pk, format=None):
+        try:
+            document_id = ProcessedDocument.objects.values_list('document_id', flat=True).get(pk=pk)
+        except ProcessedDocument.DoesNotExist:
+            raise Http404
+
+        try:
+            first_page = int(request.query_params.get('from', 1))
+            last_page = int(request.query_params.get('to', first_page + settings.MAX_PAGES_PER_REQUEST - 1))
+        except ValueError:
+            return Response({'status': 'error', 'errors': {'from': 'from and to must be integers'}},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if first_page < 1 or last_page < first_page:
+            return Response({'status': 'error', 'errors': {'from': 'Expected 1 <= from <= to'}},
+                            status=status.HTTP_400_BAD_REQUEST)
+        last_page = min(last_page, first_page + settings.MAX_PAGES_PER_REQUEST - 1)
+
+        pages = DocumentPage.objects.filter(
+            document_id=document_id,
+            page_number__range=(first_page, last_page)
+        ).order_by('page_number')
+        serializer = DocumentPageSerializer(pages, many=True)
+        return Response({
+            'status': 'success',
+            'data': {
+                'from': first_page,
+                'to': last_page,
+                'pages': serializer.data
+            }
+        }, status=status.HTTP_200_OK)
+
+
+class UploadSessionList(APIView):
+    """Create a resumable upload session"""
+
+    def post(self, request, format=None):
+        # Reject before the client spends time uploading chunks
+        try:
+            check_admission(request.client_id)
+        except AdmissionRejected as e:
+            return admission_rejected_response(e)
+        serializer = UploadSessionCreateSerializer(data=request.data)
+        if serializer.is_valid():
+            session = serializer.save(client_id=request.client_id)
+            return Response({'status': 'success', 'data': UploadSessionSerializer(session).data},
+                            status=status.HTTP_201_CREATED)
+        return Response({'status': 'error', 'errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class UploadSessionDetail(APIView):
+    """Report the received offset so an interrupted client knows where to resume"""
+
+    def get(self, request, pk, format=None):
+        try:
+            session = UploadSession.objects.get(pk=pk)
+        except UploadSession.DoesNotExist:
+            raise Http404
+        return Response({'status': 'success', 'data': UploadSessionSerializer(session).data},
+                        status=status.HTTP_200_OK)
+
+
+class UploadSessionChunk(APIView):
+    """
+    PUT the raw bytes of chunk number index (0-based). An optional
+    X-Chunk-SHA256 header is verified against the received bytes.
+    """
+
+    def put(self, request, pk, index, format=None):
+        if request.stream is None:
+            return Response({'status': 'error', 'errors': {'chunk': 'Empty chunk'}},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            session = append_chunk(pk, index, request.stream, request.headers.get('X-Chunk-SHA256'))
+        except UploadSession.DoesNotExist:
+            raise Http404
+        except UploadSessionError as e:
+            return Response({'status': 'error', 'errors': {'chunk': str(e)}}, status=status.HTTP_409_CONFLICT)
+        return Response({'status': 'success', 'data': UploadSessionSerializer(session).data},
+                        status=status.HTTP_200_OK)
+
+
+class UploadSessionFinalize(APIView):
+    """
+    Close the session and hand the file to the pipeline. Hashing and enqueueing
+    happen in a worker; poll the session for file_hash and task_id.
+    """
+
+    def post(self, request, pk, format=None):
+        try:
+            check_admission(request.client_id)
+            # The relay publishes the finalize task once the session is closed
+            with transaction.atomic():
+                session = start_finalize(pk)
+                outbox.add_task(finalize_upload_session.name, (str(session.pk),))
+        except UploadSession.DoesNotExist:
+            raise Http404
+        except UploadSessionError as e:
+            return Response({'status': 'error', 'errors': {'session': str(e)}}, status=status.HTTP_409_CONFLICT)
+        except AdmissionRejected as e:
+            return admission_rejected_response(e)
+        return Response({'status': 'success', 'data': UploadSessionSerializer(session).data},
+                        status=status.HTTP_202_ACCEPTED)
+
+
+class DeadLetterList(APIView):
+    """List dead letters, filtered by ?error_class=, ?error_kind= and ?status= (default dead)"""
+
+    def get(self, request, format=None):
+        try:
+            queryset = filter_dead_letters(
+                DeadLetter.objects.all(),
+                error_class=request.query_params.get('error_class'),
+                error_kind=request.query_params.get('error_kind'),
+                status=request.query_params.get('status', DeadLetter.STATUS_DEAD)
+            )
+            queryset = filter_created_range(queryset, request)
+            dead_letters, next_cursor = paginate_keyset(
+                queryset, request, ascending=request.query_params.get('order_by') == 'created_at'
+            )
+        except ValidationError as e:
+            return Response({'status': 'error', 'errors': e.detail}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = DeadLetterSerializer(dead_letters, many=True)
+        return Response({'status': 'success', 'data': serializer.data, 'next_cursor': next_cursor},
+                        status=status.HTTP_200_OK)
+
+
+class DeadLetterReplay(APIView):
+    """
+    Replay matching dead letters in the background, in rate-limited batches.
+    Returns how many dead letters matched.
+    """
+
+    def post(self, request, format=None):
+        serializer = DeadLetterReplaySerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({'status': 'error', 'errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+        filters = serializer.validated_data
+        queryset = filter_dead_letters(
+            DeadLetter.objects.all(), filters.get('error_class'), filters.get('error_kind')
+        )
+        if filters.get('ids'):
+            queryset = queryset.filter(pk__in=filters['ids'])
+        matched = queryset.count()
+        if filters.get('limit'):
+            matched = min(matched, filters['limit'])
+        if matched:
+            try:
+                replay_dead_letters.apply_async(kwargs=filters, retry=False)
+            except OperationalError:
+                record_broker_failure()
+                return admission_rejected_response(broker_unavailable())
+        return Response({'status': 'success', 'data': {'matched': matched}}, status=status.HTTP_202_ACCEPTED)
+
+
+class FullTextSearch(APIView):
+    """
+    Pages matching ?q= in web search syntax ("quoted phrase", or, -word),
+    best ranked first with highlighted snippets. ?document= limits the search
+    to one document. Paginated with ?cursor= and ?limit=.
+    """
+
+    def get(self, request, format=None):
+        serializer = FullTextSearchSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response({'status': 'error', 'errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+        params = serializer.validated_data
+        query = SearchQuery(params['q'], config=settings.SEARCH_CONFIG, search_type='websearch')
+
+        queryset = DocumentPage.objects.filter(search_vector=query)
+        if params.get('document'):
+            queryset = queryset.filter(document_id=params['document'])
+        # Cast the real ts_rank to double so it round-trips through the cursor exactly
+        queryset = queryset.annotate(
+            rank=Cast(SearchRank(F('search_vector'), query), FloatField()),
+            headline=SearchHeadline(
+                'content', query, config=settings.SEARCH_CONFIG, start_sel='<mark>', stop_sel='</mark>',
+                max_words=settings.SEARCH_HEADLINE_MAX_WORDS,
+                max_fragments=settings.SEARCH_HEADLINE_MAX_FRAGMENTS
+            ),
+            processed_document_id=F('document__processeddocument__id'),
+        ).select_related('document').only('document', 'document__file_name', 'page_number', 'char_offset')
+        try:
+            pages, next_cursor = paginate_ranked(queryset, request)
+        except ValidationError as e:
+            return Response({'status': 'error', 'errors': e.detail}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = FullTextSearchResultSerializer(pages, many=True)
+        return Response({'status': 'success', 'data': serializer.data, 'next_cursor': next_cursor},
+                        status=status.HTTP_200_OK)
+
+
+class SemanticSearch(APIView):
+    """
+    Top-k document chunks by embedding similarity to ?q=. ?mode=exact scores
+    every chunk, ?mode=ivf only the ?nprobe= nearest lists; auto uses IVF once
+    the index has trained it.
+    """
+
+    def get(self, request, format=None):
+        serializer = SemanticSearchSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response({'status': 'error', 'errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+        params = serializer.validated_data
+        index = get_index()
+        embedder = get_embedder()
+        if index is None or index.manifest['embedder'] != embedder.name or index.dimensions != embedder.dimensions:
+            return Response({'status': 'error', 'errors': {'index': 'The vector index is not built yet'}},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        try:
+            # Over-fetch, chunks deleted since the last index update are dropped below
+            hits = index.search(embedder.embed([params['q']])[0], params['k'] * 2,
+                                mode=params['mode'], nprobe=params.get('nprobe'))
+        except ValueError as e:
+            return Response({'status': 'error', 'errors': {'mode': str(e)}}, status=status.HTTP_400_BAD_REQUEST)
+
+        scores = dict(hits)
+        chunks = DocumentChunk.objects.select_related('document').only(
+            'document__file_name', 'chunk_index', 'first_page', 'last_page', 'content'
+        ).in_bulk(list(scores))
+        results = [chunks[chunk_id] for chunk_id, _ in hits if chunk_id in chunks][:params['k']]
+        serializer = SemanticSearchResultSerializer(results, many=True, context={'scores': scores})
+        return Response({'status': 'success', 'data': serializer.data}, status=status.HTTP_200_OK)
+
+
 class TaskStatus(APIView):
+    """
+    Report a task and its document. The document row is the source of truth;
+    the result backend (Redis, expiring) only supplies the Celery task state.
+    """
+
+    def get_document(self, task_id):
+        document = Document.objects.filter(task_id=task_id).only('content_hash', 'status').first()
+        if document:
+            return document.content_hash, document
+        # Not picked up by a worker yet, or superseded by a later task for the same file
+        message = OutboxMessage.objects.filter(task_id=task_id).only('content_hash').first()
+        file_hash = message.content_hash if message else None
+        if file_hash is None:
+            task_result = AsyncResult(task_id)
+            if task_result.successful() and isinstance(task_result.result, str):
+                file_hash = task_result.result
+        if file_hash is None:
+            return None, None
+        return file_hash, Document.objects.filter(content_hash=file_hash).only('content_hash', 'status').first()
+
     def get(self, request, task_id):
-        task_result = AsyncResult(task_id)
-        
-        # Get document status from cache if task is successful
-        document_status = None
-        cache_data = None
-        
-        if task_result.successful():
-            file_hash = task_result.result
-            cache_data = get_document_cache(file_hash)
-            
-            if not cache_data:  # If not in cache, get from database
-                try:
-                    document = Document.objects.get(content_hash=file_hash)
-                    document_status = document.status
-                except Document.DoesNotExist:
-                    pass
-            else:
-                document_status = cache_data.get('status')
+        file_hash, document = self.get_document(task_id)
+        cache_data = get_document_cache(file_hash) if file_hash else None
 
         return Response({
             'status': 'success',
             'data': {
                 'task_id': task_id,
-                'task_status': task_result.status,
-                'document_status': document_status,
+                'task_status': AsyncResult(task_id).status,
+                'document_hash': file_hash,
+                'document_status': document.status if document else None,
                 'cache_status': cache_data.get('status') if cache_data else None
             }
-        }, status=status.HTTP_200_OK)
\ No newline at end of file
+        }, status=status.HTTP_200_OK)
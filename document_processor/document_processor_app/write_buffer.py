@@ -0,0 +1,184 @@
+"""
+Write coalescing for small documents.
+
+Each worker process buffers the output of small documents (their pages, the
+ProcessedDocument row, the status flip, their near-duplicate signature and
+page cache rows and counters) and writes the buffer in one transaction with
+bulk_create and column-scoped bulk_updates once WRITE_BUFFER_MAX_ROWS rows
+are waiting or WRITE_BUFFER_MAX_DELAY seconds have passed. Near-duplicate
+candidates of the whole buffer are looked up together. Cache updates and
+scheduling slots follow only after the commit.
+
+Buffered documents stay 'processing' in the database until they are flushed.
+If the worker dies first, or a flush fails, requeue_stale_documents picks
+them up again, so nothing is lost. A document another execution claimed in
+the meantime is dropped from the flush, its new holder writes it.
+"""
+import logging
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Document, DocumentPage, ProcessedDocument
+from .near_duplicates import REUSED_EMBEDDER, find_near_duplicates, save_signatures
+from .page_cache import write_deferred
+
+logger = logging.getLogger(__name__)
+
+BufferedDocument = namedtuple(
+    'BufferedDocument', ['document', 'pages', 'processed_document', 'on_flushed', 'signature', 'cache_stats']
+)
+DOCUMENT_FIELDS = ['status', 'updated_at', 'page_cache_hits', 'page_cache_misses']
+
+
+def link_near_duplicates(signatures):
+    """
+    Store the signatures of a flush and match them in bulk. Returns
+    {document_id: (duplicate_of_id, similarity)}; detection only saves work,
+    so a failure never fails the flush.
+    """
+    if not signatures:
+        return {}
+    try:
+        with transaction.atomic():
+            duplicates = find_near_duplicates(signatures)
+            save_signatures(signatures)
+    except Exception:
+        logger.exception(f"Near-duplicate detection failed for {len(signatures)} buffered documents")
+        return {}
+    for document_id, (duplicate_of_id, duplicate_similarity) in duplicates.items():
+        logger.info(
+            f"Document {document_id} is a near-duplicate of {duplicate_of_id} "
+            f"(similarity {duplicate_similarity:.2f})"
+        )
+    return duplicates
+
+
+class WriteBuffer:
+
+    def __init__(self, max_rows, max_delay):
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.entries = []
+        self.rows = 0
+        self.timer = None
+
+    def add(self, document, pages, processed_document, on_flushed=None, signature=None, cache_stats=None):
+        """
+        Buffer a completed document; on_flushed runs once it is committed.
+        signature is its near_duplicates.Signature, stored and matched at flush,
+        and cache_stats its page cache counters and deferred rows.
+        """
+        with self.lock:
+            self.entries.append(BufferedDocument(
+                document, pages, processed_document, on_flushed, signature, cache_stats or {}
+            ))
+            self.rows += len(pages) + 1
+            full = self.rows >= self.max_rows
+            if not full and self.timer is None:
+                self.timer = threading.Timer(self.max_delay, self.flush_from_timer)
+                self.timer.daemon = True
+                self.timer.start()
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            entries, self.entries = self.entries, []
+            self.rows = 0
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        if not entries:
+            return
+
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                # Lock the documents this worker still holds the claim of
+                claims = dict(
+                    Document.objects.select_for_update()
+                    .filter(pk__in=[entry.document.pk for entry in entries])
+                    .values_list('pk', 'claim_token')
+                )
+                owned = []
+                for entry in entries:
+                    if claims.get(entry.document.pk) == entry.document.claim_token:
+                        owned.append(entry)
+                    else:
+                        logger.warning(f"Document {entry.document.pk} was taken over, dropping its buffered output")
+                signatures = {
+                    entry.document.pk: entry.signature for entry in owned if entry.signature is not None
+                }
+                duplicates = link_near_duplicates(signatures)
+
+                documents, signed_documents = [], []
+                for entry in owned:
+                    document = Document(
+                        pk=entry.document.pk, status=Document.STATUS_COMPLETED, updated_at=now,
+                        page_cache_hits=entry.cache_stats.get('hits', 0),
+                        page_cache_misses=entry.cache_stats.get('misses', 0)
+                    )
+                    if entry.document.pk in signatures:
+                        document.duplicate_of_id, document.duplicate_similarity = (
+                            duplicates.get(entry.document.pk, (None, None))
+                        )
+                        signed_documents.append(document)
+                    else:
+                        documents.append(document)
+                    if document.duplicate_of_id and settings.NEAR_DUPLICATE_ACTION == 'reuse':
+                        # Never chunked and embedded itself, see tasks.processed_document_defaults
+                        entry.processed_document.embedded_at = now
+                        entry.processed_document.embedder = REUSED_EMBEDDER
+                pages = [page for entry in owned for page in entry.pages]
+                DocumentPage.objects.bulk_create(pages, batch_size=1000)
+                ProcessedDocument.objects.bulk_create(
+                    [entry.processed_document for entry in owned],
+                    update_conflicts=True,
+                    unique_fields=['document'],
+                    update_fields=['markdown_content', 'embedded_at', 'embedder', 'updated_at']
+                )
+                Document.objects.bulk_update(documents, DOCUMENT_FIELDS)
+                Document.objects.bulk_update(
+                    signed_documents, DOCUMENT_FIELDS + ['duplicate_of', 'duplicate_similarity']
+                )
+        except Exception:
+            # The documents stay 'processing' and are requeued by the stale document sweep
+            logger.exception(f"Flushing {len(entries)} buffered documents failed")
+            return
+        # Pages are keyed by content, so rows of taken over documents are kept too
+        write_deferred([entry.cache_stats['deferred'] for entry in entries if 'deferred' in entry.cache_stats])
+
+        for entry in owned:
+            if entry.on_flushed is None:
+                continue
+            try:
+                entry.on_flushed()
+            except Exception:
+                logger.exception("Post-flush callback failed")
+
+    def flush_from_timer(self):
+        try:
+            self.flush()
+        finally:
+            connection.close()  # The timer thread has its own connection
+
+
+_write_buffer = None
+
+
+def get_write_buffer():
+    """Return this process's buffer, created lazily so it is never shared across a fork"""
+    global _write_buffer
+    if _write_buffer is None:
+        _write_buffer = WriteBuffer(settings.WRITE_BUFFER_MAX_ROWS, settings.WRITE_BUFFER_MAX_DELAY)
+    return _write_buffer
+
+
+def flush_write_buffer():
+    if _write_buffer is not None:
+        _write_buffer.flush()